@@ -6,9 +6,54 @@ from bs4 import BeautifulSoup
 import json
 import pytest
 import collections
+import collections.abc
 import functools
 import datetime
 import re
+import math
+import heapq
+import bisect
+import concurrent.futures
+import io
+import gzip
+import bz2
+import lzma
+import itertools
+import hashlib
+import random
+import copy
+import pickle
+import time
+import struct
+import operator
+import tempfile
+import subprocess
+import queue
+import threading
+import multiprocessing
+import multiprocessing.connection
+from array import array
+
+try:
+    import scipy.sparse as sparse
+except ImportError: # scipy необязателен: есть запасной вариант на чистых массивах
+    sparse = None
+
+try:
+    import numpy as np
+except ImportError: # векторные метрики тогда получают array('d') вместо numpy.ndarray
+    np = None
+
+try:
+    import zstandard
+except ImportError: # нужен только для файлов .zst
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # нужен только для экспорта/импорта Arrow и Parquet
+    pa = pq = None
 
 # ==========================================
 # Вспомогательные функции (Общие)
@@ -20,28 +65,840 @@ def parse_csv_line(line):
     parts = pattern.split(line.strip())
     return [p.strip('"') for p in parts]
 
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+READ_BUFFER_SIZE = 1 << 20 # 1 MiB: крупные блоки для потоковой распаковки
+
+def open_text(path):
+    """
+    Открывает CSV на чтение как текст. Файлы .gz, .bz2, .xz и .zst распаковываются
+    потоком (без временных файлов) с буферизованным чтением крупными блоками.
+    """
+    if path.endswith('.gz'):
+        raw = gzip.open(path, 'rb')
+    elif path.endswith('.bz2'):
+        raw = bz2.open(path, 'rb')
+    elif path.endswith('.xz'):
+        raw = lzma.open(path, 'rb')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Для чтения .zst нужен пакет zstandard")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_size=READ_BUFFER_SIZE)
+    else:
+        return open(path, 'r', encoding='utf-8', buffering=READ_BUFFER_SIZE)
+    return io.TextIOWrapper(io.BufferedReader(raw, buffer_size=READ_BUFFER_SIZE), encoding='utf-8')
+
+def find_data_file(base_dir, name):
+    """Путь к name в base_dir; если несжатого файла нет - к его сжатой версии (name.gz и т.д.)."""
+    path = os.path.join(base_dir, name)
+    for candidate in [path] + [path + suffix for suffix in COMPRESSED_SUFFIXES]:
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+def iter_csv_rows(path, limit=1000):
+    """Потоково отдаёт строки-словари из первых N строк CSV файла (limit=None - весь файл)."""
+    if not path or not os.path.exists(path):
+        return
+    with open_text(path) as f:
+        first = f.readline()
+        if not first:
+            return
+        headers = parse_csv_line(first)
+        # Читаем потоком только нужные строки, а не весь файл
+        for line in itertools.islice(f, limit):
+            if not line.strip():
+                continue
+            values = parse_csv_line(line)
+            if len(values) == len(headers):
+                yield {headers[i]: values[i] for i in range(len(headers))}
+
+def iter_csv_chunks(path, chunk_size=100000, limit=None):
+    """Отдаёт строки CSV списками по chunk_size: в памяти всегда не больше одного блока."""
+    rows = iter_csv_rows(path, limit)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 def read_csv_limited(path, limit=1000):
-    """Читает первые N строк CSV файла."""
-    if not os.path.exists(path):
-        return []
-    data = []
-    with open(path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    if not lines:
-        return []
-
-    headers = parse_csv_line(lines[0])
-    # limit+1 потому что есть строка заголовка
-    data_lines = lines[1:limit+1]
-    
-    for line in data_lines:
-        if not line.strip():
-            continue
-        values = parse_csv_line(line)
+    """Читает первые N строк CSV файла (limit=None - весь файл)."""
+    return list(iter_csv_rows(path, limit))
+
+# --- Выборки вместо чтения первых N строк ---
+
+class Estimate(collections.namedtuple('Estimate', 'value low high')):
+    """Оценка по выборке с доверительным интервалом [low, high]. Сравнивается по value."""
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.value} [{self.low}; {self.high}]"
+
+class CsvSample:
+    """
+    Выборка строк CSV. units - единица выборки для каждой строки: номер строки
+    (равномерная выборка строк) или значение stratify (выборка целых групп userId/movieId).
+    population - размер генеральной совокупности в тех же единицах (точный или оценённый).
+    """
+    Z = 1.96 # 95% доверительный интервал
+
+    def __init__(self, rows, units, population, stratify=None, method='reservoir'):
+        self.rows = rows
+        self.units = units
+        self.population = population
+        self.stratify = stratify
+        self.method = method
+
+    @property
+    def n_units(self):
+        return len(set(self.units)) if self.stratify else len(self.units)
+
+    def estimate_totals(self, keys):
+        """
+        keys - ключ (или None) для каждой строки выборки, в порядке rows.
+        Dict: ключ -> Estimate числа строк с этим ключом во всей совокупности.
+        """
+        n = self.n_units
+        per_unit = collections.Counter((u, k) for u, k in zip(self.units, keys) if k is not None)
+        s1, s2 = collections.Counter(), collections.Counter()
+        for (_, key), y in per_unit.items():
+            s1[key] += y
+            s2[key] += y * y
+        fpc = max(0.0, 1 - n / self.population) if self.population else 0.0
+        res = {}
+        for key in s1:
+            mean = s1[key] / n
+            var = (s2[key] - n * mean * mean) / (n - 1) if n > 1 else 0.0
+            half = self.Z * self.population * math.sqrt(max(var, 0.0) / n * fpc)
+            total = self.population * mean
+            res[key] = Estimate(int(round(total)), int(round(max(0.0, total - half))), int(round(total + half)))
+        return res
+
+    @classmethod
+    def estimate_mean(cls, values, exact=False):
+        """Среднее с доверительным интервалом (exact=True - группа попала в выборку целиком)."""
+        n = len(values)
+        mean = sum(values) / n if n else 0.0
+        half = 0.0
+        if n > 1 and not exact:
+            var = sum((x - mean) ** 2 for x in values) / (n - 1)
+            half = cls.Z * math.sqrt(var / n)
+        return Estimate(round(mean, 2), round(mean - half, 2), round(mean + half, 2))
+
+def _sample_reservoir(path, size, rnd):
+    """Алгоритм R: равномерная выборка size строк за один проход."""
+    sample = []
+    seen = 0
+    for seen, row in enumerate(iter_csv_rows(path, None), 1):
+        if len(sample) < size:
+            sample.append(row)
+        else:
+            j = rnd.randrange(seen)
+            if j < size:
+                sample[j] = row
+    return CsvSample(sample, list(range(len(sample))), seen)
+
+def _sample_seek(path, size, rnd):
+    """
+    Случайные смещения в файле: O(size) чтений вместо полного прохода.
+    Вероятность строки пропорциональна длине предыдущей строки (первой строки данных -
+    её собственной длине) - для CSV с близкими по длине строками это почти равномерная выборка.
+    """
+    end = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        headers = parse_csv_line(f.readline().decode('utf-8'))
+        start = f.tell()
+        first = f.readline()
+        picked = {}
+        attempts = 0
+        while len(picked) < size and attempts < size * 10 and end > start:
+            attempts += 1
+            # Смещение внутри строки выбирает следующую за ней строку. У первой строки данных
+            # предыдущей нет: ей отводятся len(first) смещений перед start, как будто перед ней
+            # строка той же длины (иначе она выбиралась бы только со смещения start-1).
+            offset = rnd.randrange(start - len(first), end - 1)
+            if offset < start:
+                pos, line = start, first
+            else:
+                f.seek(offset)
+                f.readline()
+                pos = f.tell()
+                line = f.readline()
+            if line.strip():
+                picked.setdefault(pos, line)
+    rows = []
+    for line in picked.values():
+        values = parse_csv_line(line.decode('utf-8'))
         if len(values) == len(headers):
-            row = {headers[i]: values[i] for i in range(len(headers))}
-            data.append(row)
-    return data
+            rows.append(dict(zip(headers, values)))
+    avg_len = sum(len(line) for line in picked.values()) / len(picked) if picked else 1
+    return CsvSample(rows, list(range(len(rows))), max(len(rows), int((end - start) / avg_len)), method='seek')
+
+def _sample_groups(path, size, stratify, seed):
+    """
+    Выборка целых групп (все строки случайных пользователей или фильмов) примерно на size строк.
+    Группы с наименьшим хэшем остаются (bottom-k): доля отобранных групп оценивается порогом хэша.
+    """
+    groups = {}
+    heap = [] # (-хэш, ключ) - сверху группа с наибольшим хэшем
+    tau = 1.0
+    total = 0
+    for row in iter_csv_rows(path, None):
+        key = row[stratify]
+        h = _hash64((seed, key)) / 2.0 ** 64
+        if h >= tau:
+            continue
+        if key not in groups:
+            groups[key] = []
+            heapq.heappush(heap, (-h, key))
+        groups[key].append(row)
+        total += 1
+        while total > size and len(heap) > 1:
+            neg_h, evicted = heapq.heappop(heap)
+            tau = -neg_h
+            total -= len(groups.pop(evicted))
+    rows, units = [], []
+    for key, group in groups.items():
+        rows.extend(group)
+        units.extend([key] * len(group))
+    population = len(groups) if tau >= 1.0 else max(len(groups), int(round(len(groups) / tau)))
+    return CsvSample(rows, units, population, stratify=stratify, method='groups')
+
+def sample_csv(path, size, method='reservoir', stratify=None, seed=None):
+    """
+    Выборка из всего CSV вместо первых N строк (в файлах MovieLens первые строки - первые пользователи).
+    method: 'reservoir' (один проход) или 'seek' (случайные смещения, только несжатые файлы).
+    stratify: 'userId'/'movieId' - в выборку попадают группы целиком.
+    """
+    if method not in ('reservoir', 'seek'):
+        raise ValueError(f"Неизвестный метод выборки: {method}")
+    if not path or not os.path.exists(path):
+        return CsvSample([], [], 0)
+    if stratify:
+        return _sample_groups(path, size, stratify, seed)
+    rnd = random.Random(seed)
+    if method == 'seek' and not path.endswith(COMPRESSED_SUFFIXES):
+        return _sample_seek(path, size, rnd)
+    return _sample_reservoir(path, size, rnd)
+
+def to_timestamp(value):
+    """Приводит границу интервала (timestamp, date, datetime или 'YYYY-MM-DD') к unix-времени."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    return int(value.timestamp())
+
+class TimeIndex:
+    """
+    Перестановка записей, отсортированная по timestamp.
+    Выборка за интервал [since, until) - бинарный поиск и срез вместо полного прохода.
+    Если переданы values, хранятся префиксные суммы для скользящих окон.
+    """
+    def __init__(self, timestamps, values=None):
+        self.order = array('l', sorted(range(len(timestamps)), key=timestamps.__getitem__))
+        self.times = array('q', [timestamps[i] for i in self.order])
+        self.prefix = None
+        if values is not None:
+            self.prefix = array('d', [0.0]) * (len(self.order) + 1)
+            acc = 0.0
+            for pos, i in enumerate(self.order):
+                acc += values[i]
+                self.prefix[pos + 1] = acc
+
+    def __len__(self):
+        return len(self.order)
+
+    def bounds(self, since=None, until=None):
+        """Позиции [lo, hi) в отсортированном порядке для интервала [since, until)."""
+        since, until = to_timestamp(since), to_timestamp(until)
+        lo = bisect.bisect_left(self.times, since) if since is not None else 0
+        hi = bisect.bisect_left(self.times, until) if until is not None else len(self.times)
+        return lo, max(lo, hi)
+
+    def select(self, since=None, until=None):
+        """Индексы исходных записей, попавших в интервал [since, until)."""
+        lo, hi = self.bounds(since, until)
+        return self.order[lo:hi]
+
+    def window(self, since, until):
+        """(количество, сумма значений) за интервал через префиксные суммы - O(log n)."""
+        lo, hi = self.bounds(since, until)
+        return hi - lo, self.prefix[hi] - self.prefix[lo]
+
+# --- Вероятностные скетчи (ограниченная память, объединяются между блоками) ---
+
+def _hash64(item):
+    """Детерминированный 64-битный хэш: в отличие от hash(), одинаков во всех процессах."""
+    return int.from_bytes(hashlib.blake2b(str(item).encode('utf-8'), digest_size=8).digest(), 'little')
+
+class CountMinSketch:
+    """
+    Count-Min: оценка частоты не меньше истинной и превышает её не более чем на
+    epsilon * total с вероятностью 1 - delta. Память: e/epsilon * ln(1/delta) счётчиков.
+    """
+    def __init__(self, epsilon=1e-3, delta=1e-2):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = [array('q', [0]) * self.width for _ in range(self.depth)]
+        self.total = 0
+
+    def _cells(self, item):
+        # Двойное хэширование: d индексов из одного 64-битного хэша
+        h = _hash64(item)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        for row, col in zip(self.table, self._cells(item)):
+            row[col] += count
+        self.total += count
+
+    def estimate(self, item):
+        return min(row[col] for row, col in zip(self.table, self._cells(item)))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Нельзя объединить Count-Min скетчи разного размера")
+        for row, other_row in zip(self.table, other.table):
+            for i, v in enumerate(other_row):
+                if v:
+                    row[i] += v
+        self.total += other.total
+        return self
+
+    @property
+    def memory(self):
+        return self.width * self.depth * self.table[0].itemsize
+
+class HeavyHitters:
+    """Top-k по частоте: Count-Min для оценок и k кандидатов с наибольшими оценками."""
+    def __init__(self, k=100, epsilon=1e-3, delta=1e-2):
+        self.k = k
+        self.cms = CountMinSketch(epsilon, delta)
+        self.candidates = {}
+        self._low = None # кандидат с минимальной оценкой (пересчитывается лениво)
+
+    def add(self, item, count=1):
+        self.cms.add(item, count)
+        est = self.cms.estimate(item)
+        if item in self.candidates or len(self.candidates) < self.k:
+            self.candidates[item] = est
+            if item == self._low:
+                self._low = None
+            return
+        if self._low is None:
+            self._low = min(self.candidates, key=self.candidates.get)
+        if est > self.candidates[self._low]:
+            del self.candidates[self._low]
+            self.candidates[item] = est
+            self._low = None
+
+    def merge(self, other):
+        """Объединяет скетчи; оценки кандидатов пересчитываются по общему Count-Min."""
+        self.cms.merge(other.cms)
+        pool = set(self.candidates) | set(other.candidates)
+        est = {item: self.cms.estimate(item) for item in pool}
+        self.candidates = dict(heapq.nlargest(self.k, est.items(), key=lambda x: x[1]))
+        self._low = None
+        return self
+
+    def top(self, n):
+        """Список (элемент, оценка частоты) по убыванию оценки."""
+        return sorted(self.candidates.items(), key=lambda x: x[1], reverse=True)[:n]
+
+class HyperLogLog:
+    """
+    Оценка числа различных элементов: 2**precision байт, стандартная ошибка 1.04 / sqrt(2**precision).
+    Если precision не задан, он подбирается по желаемой относительной ошибке error.
+    sparse=True - пока ненулевых регистров мало, хранятся только они (4 байта на регистр,
+    не больше SPARSE_LIMIT), потом массив становится плотным; оценка та же, но ключ с
+    несколькими элементами занимает несколько байт, поэтому оценку можно держать для каждого ключа.
+    """
+    __slots__ = ('p', 'm', 'registers', 'sparse')
+    SPARSE_LIMIT = 64
+
+    def __init__(self, precision=None, error=0.1, sparse=False):
+        if precision is None:
+            precision = math.ceil(math.log2((1.04 / error) ** 2))
+        self.p = max(4, min(16, precision))
+        self.m = 1 << self.p
+        # Разреженная запись: idx << 6 | rank (rank не больше 61)
+        self.sparse = array('I') if sparse else None
+        self.registers = None if sparse else bytearray(self.m)
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def _set(self, idx, rank):
+        if self.sparse is None:
+            if rank > self.registers[idx]:
+                self.registers[idx] = rank
+            return
+        for pos, v in enumerate(self.sparse):
+            if v >> 6 == idx:
+                if rank > v & 63:
+                    self.sparse[pos] = idx << 6 | rank
+                return
+        self.sparse.append(idx << 6 | rank)
+        if len(self.sparse) > min(self.SPARSE_LIMIT, self.m // 4):
+            self.registers, self.sparse = self.dense(), None
+
+    def add(self, item):
+        h = _hash64(item)
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        self._set(idx, (64 - self.p) - rest.bit_length() + 1) # позиция первой единицы
+
+    def dense(self):
+        """Регистры плотным массивом (у разреженного - построенные заново)."""
+        if self.sparse is None:
+            return self.registers
+        registers = bytearray(self.m)
+        for v in self.sparse:
+            registers[v >> 6] = v & 63
+        return registers
+
+    def merge(self, other):
+        if self.p != other.p:
+            raise ValueError("Нельзя объединить HyperLogLog разной точности")
+        if other.sparse is not None:
+            for v in other.sparse:
+                self._set(v >> 6, v & 63)
+            return self
+        self.registers = bytearray(max(a, b) for a, b in zip(self.dense(), other.registers))
+        self.sparse = None
+        return self
+
+    def count(self):
+        m = self.m
+        registers = self.dense()
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        est = alpha * m * m / sum(2.0 ** -r for r in registers)
+        zeros = registers.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros) # линейный подсчёт для малых мощностей
+        return int(round(est))
+
+# --- Мемоизация аналитических запросов ---
+
+def _freeze(value):
+    """Приводит аргументы к хешируемому виду: списки - в кортежи, словари - в отсортированные пары."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+def _detached(value):
+    """
+    Копия результата для вызывающего кода: сам контейнер и вложенные dict/list/set первого
+    уровня (распределения по окнам, списки тегов). Глубже результаты не вкладываются,
+    а полный deepcopy больших словарей стоил бы почти как пересчёт.
+    """
+    if isinstance(value, dict):
+        res = copy.copy(value)
+        for k, v in res.items():
+            if isinstance(v, (dict, list, set)):
+                res[k] = copy.copy(v)
+        return res
+    if isinstance(value, list):
+        return [copy.copy(v) if isinstance(v, (dict, list, set)) else v for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+class QueryCache:
+    """
+    LRU-кеш результатов запросов на maxsize записей со статистикой попаданий.
+    Потокобезопасен; вычисление идёт без блокировки, поэтому разные запросы считаются параллельно,
+    а одновременные промахи по одному ключу ждут одно вычисление (coalesced).
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._inflight = {} # ключ -> Future вычисления, которое уже идёт
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = self.uncacheable = self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return _detached(self._data[key])
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = concurrent.futures.Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return _detached(future.result())
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        future.set_result(value)
+        # Копия: изменение результата вызывающим кодом не портит кеш
+        return _detached(value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'uncacheable': self.uncacheable,
+                'evictions': self.evictions, 'size': len(self._data), 'maxsize': self.maxsize}
+
+def memoized(method):
+    """
+    Кеширует результат метода по его аргументам и версии данных владельца
+    (для Ratings.Movies/Users владелец - parent). Нехешируемые аргументы
+    (например, metric-объект без __hash__) выполняются без кеша.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        owner = getattr(self, 'parent', self)
+        cache = owner.query_cache
+        try:
+            key = (method.__qualname__, _freeze(args), _freeze(kwargs), owner._data_version())
+            hash(key)
+        except TypeError:
+            cache.uncacheable += 1
+            return method(self, *args, **kwargs)
+        return cache.get_or_compute(key, lambda: method(self, *args, **kwargs))
+    return wrapper
+
+class MemoizedMixin:
+    """
+    Кеш запросов владельца данных. Версия данных увеличивается при reload/append
+    (и при скрапинге в Links); в ключ кеша также входят размеры таблиц,
+    поэтому прямое добавление строк тоже делает старые записи недействительными.
+    """
+    QUERY_CACHE_SIZE = 128
+    _version = 0
+    _query_cache_lock = threading.Lock() # создание кеша: два потока не должны поставить каждый свой
+
+    @property
+    def query_cache(self):
+        cache = self.__dict__.get('_query_cache')
+        if cache is None:
+            with MemoizedMixin._query_cache_lock:
+                cache = self.__dict__.get('_query_cache')
+                if cache is None:
+                    cache = self._query_cache = QueryCache(self.QUERY_CACHE_SIZE)
+        return cache
+
+    def cache_info(self):
+        """Статистика кеша запросов: попадания, промахи, вытеснения, размер."""
+        return self.query_cache.info()
+
+    def _data_version(self):
+        return (self._version,)
+
+    def _invalidate(self):
+        """Данные изменились: новая версия, старые результаты больше не нужны."""
+        self._version += 1
+        self.query_cache.clear()
+
+# --- Группировка во внешней памяти ---
+
+class ExternalGroupBy:
+    """
+    Группировка, которая не держит все группы в памяти. Записи (ключ, порядок1, порядок2, значение)
+    копятся в буфере; заполненный буфер сортируется и сбрасывается во временный файл,
+    в конце отсортированные файлы объединяются k-путевым слиянием (heapq.merge).
+    В памяти - буфер и по блоку чтения на каждый сливаемый файл.
+    """
+    RECORD = struct.Struct('<qqqd')
+    RECORD_BYTES = 200 # оценка памяти на запись в буфере: кортеж, числа, ссылка в списке
+    READ_BYTES = 64 * 1024
+
+    def __init__(self, memory_budget):
+        # половина бюджета - буфер, четверть - блоки чтения при слиянии, остальное - запас
+        self.buffer_size = max(1024, memory_budget // 2 // self.RECORD_BYTES)
+        self.fanout = max(2, min(128, memory_budget // 4 // self.READ_BYTES))
+        self._buffer = []
+        self._runs = []
+        self.spilled = 0
+
+    def add(self, key, order1, order2, value):
+        self._buffer.append((key, order1, order2, value))
+        if len(self._buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort()
+        self._runs.append(self._write_run(self._buffer))
+        self._buffer = []
+        self.spilled += 1
+
+    def _write_run(self, records):
+        f = tempfile.TemporaryFile()
+        pack = self.RECORD.pack
+        batch = []
+        for r in records:
+            batch.append(pack(*r))
+            if len(batch) >= 4096:
+                f.write(b''.join(batch))
+                batch.clear()
+        f.write(b''.join(batch))
+        f.seek(0)
+        return f
+
+    def _read_run(self, f):
+        chunk = self.READ_BYTES - self.READ_BYTES % self.RECORD.size
+        with f:
+            while True:
+                block = f.read(chunk)
+                if not block:
+                    break
+                yield from self.RECORD.iter_unpack(block)
+
+    def _merged(self):
+        if not self._runs:
+            self._buffer.sort()
+            return iter(self._buffer)
+        if self._buffer:
+            self._spill()
+        runs, self._runs = self._runs, []
+        # Файлов больше, чем можно открыть с блоком чтения в бюджете: сливаем в несколько проходов
+        while len(runs) > self.fanout:
+            group, runs = runs[:self.fanout], runs[self.fanout:]
+            runs.append(self._write_run(heapq.merge(*map(self._read_run, group))))
+        return heapq.merge(*map(self._read_run, runs))
+
+    def groups(self):
+        """Генератор (ключ, (порядок1, порядок2) первой записи, значения) по возрастанию ключа."""
+        for key, records in itertools.groupby(self._merged(), key=operator.itemgetter(0)):
+            first = next(records)
+            values = [first[3]]
+            values.extend(r[3] for r in records)
+            yield key, (first[1], first[2]), values
+
+
+# --- Плотные целочисленные идентификаторы ---
+
+class IdMap:
+    """
+    Внешний id <-> плотный индекс 0..N-1 (в порядке первого появления).
+    Новые id добавляются под блокировкой: таблицы с общим словарём можно загружать
+    из разных потоков (ReportRunner), уже известные id читаются без неё.
+    """
+    __slots__ = ('index', 'keys', '_lock')
+
+    def __init__(self):
+        self.index = {}
+        self.keys = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return self.index, self.keys
+
+    def __setstate__(self, state):
+        self.index, self.keys = state
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def encode(self, key):
+        """Индекс id; новый id получает следующий свободный индекс."""
+        idx = self.index.get(key)
+        if idx is None:
+            with self._lock:
+                idx = self.index.get(key)
+                if idx is None:
+                    # Сначала keys, потом index: кто увидел индекс в index, найдёт и ключ
+                    self.keys.append(key)
+                    idx = self.index[key] = len(self.keys) - 1
+        return idx
+
+    def get(self, key, default=None):
+        return self.index.get(key, default)
+
+    def decode(self, idx):
+        return self.keys[idx]
+
+class IdDictionary:
+    """
+    Словарь идентификаторов таблицы: movieId и userId (int), imdbId (str).
+    Индексы не меняются: новые id только дописываются в конец, поэтому столбцы,
+    построенные разными таблицами по одному словарю, можно соединять по индексу.
+    По умолчанию (ids=None) у каждого объекта свой словарь, и массивы по индексам
+    имеют размер его собственных id; общий словарь передаётся явно через ids=.
+    """
+    def __init__(self):
+        self.movies = IdMap()
+        self.users = IdMap()
+        self.imdb = IdMap()
+
+def _require_arrow():
+    if pa is None:
+        raise ImportError("Для экспорта/импорта Arrow и Parquet нужен пакет pyarrow")
+
+class ParquetMixin:
+    """
+    Экспорт таблиц класса в Apache Arrow / Parquet и обратная загрузка.
+    Подкласс описывает схему (arrow_schema), выгрузку в колонки (_to_columns)
+    и сборку объекта из колонок (_from_columns).
+    """
+    PARQUET_SORT_KEY = 'movieId' # сортировка перед записью делает статистику групп строк избирательной
+    KEY_COLUMNS = () # без этих колонок записи не собрать, их нельзя исключать из columns
+    _missing_columns = frozenset() # колонки, не прочитанные from_parquet(columns=...)
+
+    def _require_columns(self, *names):
+        missing = [name for name in names if name in self._missing_columns]
+        if missing:
+            raise ValueError(f"{type(self).__name__}: колонки {', '.join(missing)} "
+                             "не загружены (from_parquet с columns=...)")
+
+    @classmethod
+    def arrow_schema(cls):
+        raise NotImplementedError
+
+    def _to_columns(self):
+        raise NotImplementedError
+
+    @classmethod
+    def _from_columns(cls, columns, **kwargs):
+        raise NotImplementedError
+
+    def to_arrow(self):
+        """Таблица pyarrow.Table с типизированной схемой класса."""
+        _require_arrow()
+        return pa.Table.from_pydict(self._to_columns(), schema=self.arrow_schema())
+
+    def to_parquet(self, path, row_group_size=64 * 1024, sort_by=None):
+        """
+        Пишет таблицу в Parquet. Строки сортируются по sort_by (по умолчанию PARQUET_SORT_KEY),
+        поэтому min/max групп строк позволяют пропускать ненужные группы при чтении по диапазону.
+        """
+        table = self.to_arrow()
+        key = sort_by or self.PARQUET_SORT_KEY
+        if key:
+            table = table.sort_by(key)
+        pq.write_table(table, path, row_group_size=row_group_size, write_statistics=True)
+        return path
+
+    @classmethod
+    def from_parquet(cls, path, columns=None, since=None, until=None, movie_ids=None, **kwargs):
+        """
+        Загружает объект из Parquet. columns - читаемые колонки: непрочитанные запоминаются,
+        и методы, которым они нужны, поднимают ValueError (см. requires_columns).
+        since/until - интервал [since, until) по timestamp, movie_ids - диапазон (min, max) movieId.
+        Фильтры проверяются по статистике групп строк, поэтому лишние группы не читаются.
+        """
+        _require_arrow()
+        schema = cls.arrow_schema()
+        if columns is not None:
+            absent = [key for key in cls.KEY_COLUMNS if key not in columns]
+            if absent:
+                raise ValueError(f"{cls.__name__}: ключевые колонки {', '.join(absent)} обязательны")
+        filters = []
+        if since is not None or until is not None:
+            if 'timestamp' not in schema.names:
+                raise ValueError(f"{cls.__name__}: в таблице нет колонки timestamp")
+            if since is not None:
+                filters.append(('timestamp', '>=', to_timestamp(since)))
+            if until is not None:
+                filters.append(('timestamp', '<', to_timestamp(until)))
+        if movie_ids is not None:
+            lo, hi = movie_ids
+            filters += [('movieId', '>=', lo), ('movieId', '<=', hi)]
+
+        table = pq.read_table(path, columns=columns, filters=filters or None)
+        cols = {}
+        for name in schema.names:
+            if name in table.column_names:
+                cols[name] = table.column(name).to_pylist()
+            else:
+                cols[name] = [None] * table.num_rows
+        obj = cls._from_columns(cols, **kwargs)
+        obj._missing_columns = frozenset(name for name in schema.names if name not in table.column_names)
+        return obj
+
+def requires_columns(*names):
+    """
+    Метод работает только при загруженных колонках names: у объекта из
+    from_parquet(columns=...) без них вызов поднимает ValueError, а не считает по None.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            getattr(self, 'parent', self)._require_columns(*names)
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class Record(collections.abc.Mapping):
+    """
+    Запись таблицы с полями в __slots__ вместо словаря: в несколько раз меньше памяти на строку.
+    Читается как словарь с ключами FIELDS (r['title'], r.get, items, сравнение с dict), поэтому
+    код и ResultVisualizer, которые ждут словари, работают без изменений. Подклассы задают
+    __slots__ (имена атрибутов) и FIELDS (ключи) в одном порядке; поля из OPTIONAL со значением
+    None считаются отсутствующими.
+    """
+    __slots__ = ()
+    FIELDS = ()
+    OPTIONAL = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._KEYS = dict(zip(cls.FIELDS, cls.__slots__))
+
+    def __init__(self, *values):
+        for i, slot in enumerate(self.__slots__):
+            setattr(self, slot, values[i] if i < len(values) else None)
+
+    @classmethod
+    def from_dict(cls, data, **defaults):
+        """Запись из словаря; недостающие ключи берутся из defaults (иначе None)."""
+        return cls(*(data.get(key, defaults.get(key)) for key in cls.FIELDS))
+
+    def __getitem__(self, key):
+        slot = self._KEYS.get(key)
+        if slot is None:
+            raise KeyError(key)
+        value = getattr(self, slot)
+        if value is None and key in self.OPTIONAL:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key, slot in self._KEYS.items():
+            if key not in self.OPTIONAL or getattr(self, slot) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
 
 class ResultVisualizer:
     def __init__(self, data, headers=None): # Добавляем параметр headers
@@ -73,7 +930,7 @@ class ResultVisualizer:
             first_key = next(iter(self.data))
             first_val = self.data[first_key]
 
-            if isinstance(first_val, dict):
+            if isinstance(first_val, collections.abc.Mapping): # dict или Record
                 # Формируем заголовки из ID + ключи внутреннего словаря
                 inner_keys = list(first_val.keys())
                 html += "<tr><th>ID</th>" + "".join(f"<th>{k.capitalize()}</th>" for k in inner_keys) + "</tr>"
@@ -112,21 +969,36 @@ class ResultVisualizer:
 
 # --- ЧАСТЬ АЛЕКСАНДРА (Фильмы, Теги) ---
 
-class Movies:
-    def __init__(self, path_to_the_file, limit=1000):
+class MovieRecord(Record):
+    """Строка Movies.movies: название, жанры через '|', год выпуска (None - нет в названии)."""
+    __slots__ = ('title', 'genres', 'year')
+    FIELDS = ('title', 'genres', 'year')
+
+class Movies(ParquetMixin, MemoizedMixin):
+    KEY_COLUMNS = ('movieId',)
+
+    def __init__(self, path_to_the_file, limit=1000, ids=None):
         self.movies = {}
         self.limit = limit
+        self.path = path_to_the_file
+        self.ids = ids if ids is not None else IdDictionary()
+        self._load()
+
+    def _load(self):
+        path_to_the_file, limit = self.path, self.limit
+        if path_to_the_file is None: # пустой объект (например, для from_parquet)
+            return
         
         # ИСПРАВЛЕНИЕ: Получаем директорию, в которой находится файл movies
         base_dir = os.path.dirname(path_to_the_file)
-        ratings_path = os.path.join(base_dir, 'ratings.csv')
-        tags_path = os.path.join(base_dir, 'tags.csv')
+        ratings_path = find_data_file(base_dir, 'ratings.csv')
+        tags_path = find_data_file(base_dir, 'tags.csv')
         
         valid_ids = set()
         
         # ИСПРАВЛЕНИЕ: Используем ratings_path вместо 'ratings.csv'
         if os.path.exists(ratings_path):
-            with open(ratings_path, 'r', encoding='utf-8') as f:
+            with open_text(ratings_path) as f:
                 next(f)
                 for i, line in enumerate(f):
                     if i >= self.limit: break
@@ -135,7 +1007,7 @@ class Movies:
         
         # ИСПРАВЛЕНИЕ: Используем tags_path вместо 'tags.csv'
         if os.path.exists(tags_path):
-            with open(tags_path, 'r', encoding='utf-8') as f:
+            with open_text(tags_path) as f:
                 next(f)
                 for i, line in enumerate(f):
                     if i >= self.limit: break
@@ -144,7 +1016,7 @@ class Movies:
 
         # 2. Загружаем фильмы, если их id есть в valid_ids
         if os.path.exists(path_to_the_file):
-            with open(path_to_the_file, 'r', encoding='utf-8') as f:
+            with open_text(path_to_the_file) as f:
                 next(f)
                 for i, line in enumerate(f):
                     if i >= limit:
@@ -160,19 +1032,63 @@ class Movies:
                             
                         title = parts[1]
                         genres = parts[2] if len(parts) > 2 else ""
-                        year = None
-                        match = re.search(r'\((\d{4})\)$', title.strip())
-                        if match:
-                            year = int(match.group(1))
-
-                        self.movies[movie_id] = {
-                            'title': title,
-                            'genres': genres,
-                            'year': year
-                        }
+                        self.movies[movie_id] = self._record(title, genres)
+                        self.ids.movies.encode(movie_id)
                     except Exception as e:
                         continue
 
+    @staticmethod
+    def _record(title, genres):
+        year = None
+        match = re.search(r'\((\d{4})\)$', title.strip())
+        if match:
+            year = int(match.group(1))
+        return MovieRecord(title, genres, year)
+
+    def _data_version(self):
+        return (self._version, id(self.movies), len(self.movies))
+
+    def reload(self):
+        """Перечитывает файл; закешированные результаты запросов сбрасываются."""
+        self.movies = {}
+        self._load()
+        self._invalidate()
+
+    def append(self, rows):
+        """Добавляет фильмы: словари с movieId, title, genres."""
+        for row in rows:
+            movie_id = int(row['movieId'])
+            self.movies[movie_id] = self._record(row['title'], row.get('genres', ''))
+            self.ids.movies.encode(movie_id)
+        self._invalidate()
+
+    @classmethod
+    def arrow_schema(cls):
+        _require_arrow()
+        return pa.schema([
+            ('movieId', pa.int32()),
+            ('title', pa.string()),
+            ('genres', pa.string()),
+            ('year', pa.int16()),
+        ])
+
+    def _to_columns(self):
+        ids = list(self.movies)
+        return {
+            'movieId': ids,
+            'title': [self.movies[i]['title'] for i in ids],
+            'genres': [self.movies[i]['genres'] for i in ids],
+            'year': [self.movies[i]['year'] for i in ids],
+        }
+
+    @classmethod
+    def _from_columns(cls, columns, limit=None, ids=None):
+        obj = cls(None, limit=limit, ids=ids)
+        for mid, title, genres, year in zip(columns['movieId'], columns['title'], columns['genres'], columns['year']):
+            obj.movies[mid] = MovieRecord(title, genres, year)
+            obj.ids.movies.encode(mid)
+        return obj
+
     def show(self, data, fields=None):
         headers = None
         if isinstance(data, list) and fields is not None:
@@ -180,6 +1096,8 @@ class Movies:
             headers = ["ID фильма", "Название"] + fields
         return ResultVisualizer(data, headers=headers)
     
+    @requires_columns('year')
+    @memoized
     def dist_by_release(self):
         """
         Возвращает dict или OrderedDict, где ключи - годы, а значения - количество фильмов.
@@ -190,6 +1108,8 @@ class Movies:
         # Сортировка по убыванию количества
         return dict(sorted(c.items(), key=lambda x: x[1], reverse=True))
     
+    @requires_columns('genres')
+    @memoized
     def dist_by_genres(self):
         """
         Возвращает dict, где ключи - жанры, а значения - количество фильмов.
@@ -202,6 +1122,8 @@ class Movies:
                 genre_counter.update(genres)
         return dict(sorted(genre_counter.items(), key=lambda x: x[1], reverse=True))
         
+    @requires_columns('title', 'genres')
+    @memoized
     def most_genres(self, n):
         """
         Возвращает dict с топ-n фильмами, где ключи - названия фильмов,
@@ -220,17 +1142,42 @@ class Movies:
         return dict(sorted_counts[:n])
 
 
-class Tags:
+# Плотные столбцы тегов: индексы фильма и пользователя (общий IdDictionary) и текст тега
+TagColumns = collections.namedtuple('TagColumns', 'movie user tag')
+
+class Tags(ParquetMixin, MemoizedMixin):
     """
     Анализ данных из tags.csv
     """
-    def __init__(self, path_to_the_file, limit=1000):
+    PARQUET_SORT_KEY = 'timestamp'
+
+    def __init__(self, path_to_the_file, limit=1000, sample=None, sample_method='reservoir', stratify=None, seed=None,
+                 ids=None):
         self.tags_data = [] # Список строк (тегов)
         self.rows = [] # Исходные строки
         self.limit = limit
-        
-        if os.path.exists(path_to_the_file):
-            with open(path_to_the_file, 'r', encoding='utf-8') as f:
+        self.path = path_to_the_file
+        self.sample = sample
+        self.sample_method = sample_method
+        self.stratify = stratify
+        self.seed = seed
+        self._time_index = None
+        self._sample = None
+        self._columns_cache = None
+        self._appended = False # строки из append есть только в памяти, не в файле
+        self.ids = ids if ids is not None else IdDictionary()
+        self._load()
+
+    def _load(self):
+        path_to_the_file, limit = self.path, self.limit
+        if self.sample:
+            # Выборка по всему файлу вместо первых limit строк
+            self._sample = sample_csv(path_to_the_file, self.sample, self.sample_method, self.stratify, self.seed)
+            for row in self._sample.rows:
+                self.rows.append([row['userId'], row['movieId'], row['tag'], row.get('timestamp', '')])
+                self.tags_data.append(row['tag'])
+        elif path_to_the_file is not None and os.path.exists(path_to_the_file):
+            with open_text(path_to_the_file) as f:
                 next(f)
                 for i, line in enumerate(f):
                     if i >= limit:
@@ -242,9 +1189,111 @@ class Tags:
                         self.tags_data.append(tag_text)
                         self.rows.append(parts)
 
+    def _data_version(self):
+        return (self._version, id(self.tags_data), len(self.tags_data))
+
+    def _invalidate(self):
+        self._time_index = None
+        self._columns_cache = None
+        super()._invalidate()
+
+    def reload(self):
+        """Перечитывает файл; индексы и закешированные результаты запросов сбрасываются."""
+        self.tags_data, self.rows = [], []
+        self._sample = None
+        self._appended = False
+        self._load()
+        self._invalidate()
+
+    def append(self, rows):
+        """Добавляет теги: словари с userId, movieId, tag, timestamp."""
+        for row in rows:
+            self.rows.append([str(row['userId']), str(row['movieId']), row['tag'], str(row.get('timestamp', ''))])
+            self.tags_data.append(row['tag'])
+        self._appended = True
+        self._invalidate()
+
+    @classmethod
+    def arrow_schema(cls):
+        _require_arrow()
+        return pa.schema([
+            ('userId', pa.int32()),
+            ('movieId', pa.int32()),
+            ('tag', pa.string()),
+            ('timestamp', pa.int64()),
+        ])
+
+    def _to_columns(self):
+        # Пустая строка - колонка не была загружена (from_parquet с columns=...)
+        def number(r, i):
+            return int(r[i]) if len(r) > i and r[i] != '' else None
+        return {
+            'userId': [number(r, 0) for r in self.rows],
+            'movieId': [number(r, 1) for r in self.rows],
+            'tag': [None if 'tag' in self._missing_columns else r[2] for r in self.rows],
+            'timestamp': [number(r, 3) for r in self.rows],
+        }
+
+    @classmethod
+    def _from_columns(cls, columns, limit=None, ids=None):
+        obj = cls(None, limit=limit, ids=ids)
+        for uid, mid, tag, ts in zip(columns['userId'], columns['movieId'], columns['tag'], columns['timestamp']):
+            # Исходные строки хранятся как в CSV - списком строк
+            obj.rows.append(['' if v is None else str(v) for v in (uid, mid, tag, ts)])
+            obj.tags_data.append(tag)
+        return obj
+
     def show(self, data):
         return ResultVisualizer(data)
+
+    def columns(self):
+        """Теги в виде плотных столбцов (TagColumns) по общему словарю self.ids; один раз на версию данных."""
+        version = self._data_version()
+        if self._columns_cache is None or self._columns_cache[0] != version:
+            movies, users, missing = self.ids.movies, self.ids.users, self._missing_columns
+            cols = TagColumns(
+                None if 'movieId' in missing else array('l', [movies.encode(int(r[1])) for r in self.rows]),
+                None if 'userId' in missing else array('l', [users.encode(int(r[0])) for r in self.rows]),
+                self.tags_data
+            )
+            self._columns_cache = (version, cols)
+        return self._columns_cache[1]
+
+    def time_index(self):
+        """Индекс тегов, отсортированный по timestamp (строится один раз)."""
+        self._require_columns('timestamp')
+        if self._time_index is None:
+            self._time_index = TimeIndex([int(r[3]) if len(r) > 3 else 0 for r in self.rows])
+        return self._time_index
+
+    def _window(self, since=None, until=None):
+        """Теги за интервал [since, until); без границ - все теги."""
+        if since is None and until is None:
+            return self.tags_data
+        return [self.tags_data[i] for i in self.time_index().select(since, until)]
+
+    def _stream(self, since=None, until=None):
+        """
+        Теги за интервал [since, until) потоком, без списков и индекса по времени: из файла
+        (те же первые limit строк, что и при загрузке) или, если строки есть только в памяти
+        (выборка, append, from_parquet), по загруженным строкам.
+        """
+        if since is not None or until is not None:
+            self._require_columns('timestamp')
+        since, until = to_timestamp(since), to_timestamp(until)
+        if self.path and not self.sample and not self._appended:
+            rows = ((row['tag'], row.get('timestamp', '')) for row in iter_csv_rows(self.path, self.limit))
+        else:
+            rows = ((r[2], r[3] if len(r) > 3 else '') for r in self.rows)
+        for tag, ts in rows:
+            if since is not None or until is not None:
+                ts = int(ts) if ts != '' else 0 # как в time_index
+                if (since is not None and ts < since) or (until is not None and ts >= until):
+                    continue
+            yield tag
     
+    @requires_columns('tag')
+    @memoized
     def most_words(self, n):
         """
         Топ-n тегов с наибольшим количеством слов внутри. Dict: тег -> количество слов.
@@ -259,6 +1308,8 @@ class Tags:
         sorted_res = sorted(res.items(), key=lambda x: x[1], reverse=True)
         return dict(sorted_res[:n])
 
+    @requires_columns('tag')
+    @memoized
     def longest(self, n):
         """
         Топ-n самых длинных тегов (символов). Список тегов.
@@ -269,6 +1320,8 @@ class Tags:
         sorted_tags = sorted(list(unique_tags), key=lambda x: len(x), reverse=True)
         return sorted_tags[:n]
 
+    @requires_columns('tag')
+    @memoized
     def most_words_and_longest(self, n):
         """
         Пересечение между топ-n тегами с наибольшим количеством слов и топ-n самыми длинными тегами.
@@ -285,16 +1338,36 @@ class Tags:
         intersection = list(set_words & set_longest)
         return intersection
         
-    def most_popular(self, n):
+    @requires_columns('tag')
+    @memoized
+    def most_popular(self, n, since=None, until=None, sketch=False, epsilon=1e-3, delta=1e-2):
         """
         Самые популярные теги. Dict: тег -> количество.
         Удалить дубликаты? Нет, популярность подразумевает подсчёт дубликатов в исходных данных,
         но возвращаем уникальные ключи.
-        Сортировка по убыванию количества.
+        Сортировка по убыванию количества. since/until ограничивают интервал [since, until).
+        sketch=True - приближённый подсчёт в ограниченной памяти: HeavyHitters вместо Counter
+        по потоку тегов (_stream), без списка тегов окна.
+        В режиме sample значения - Estimate с 95% доверительным интервалом.
         """
-        c = collections.Counter(self.tags_data)
+        if sketch:
+            hh = HeavyHitters(max(n, 1) * 4, epsilon, delta)
+            for tag in self._stream(since, until):
+                hh.add(tag)
+            return dict(hh.top(n))
+        if self._sample is not None:
+            # Оценки числа тегов во всём файле с доверительными интервалами
+            window = None
+            if since is not None or until is not None:
+                window = set(self.time_index().select(since, until))
+            keys = [t if window is None or i in window else None for i, t in enumerate(self.tags_data)]
+            est = self._sample.estimate_totals(keys)
+            return dict(sorted(est.items(), key=lambda x: x[1], reverse=True)[:n])
+        c = collections.Counter(self._window(since, until))
         return dict(c.most_common(n))
         
+    @requires_columns('tag')
+    @memoized
     def tags_with(self, word):
         """
         Уникальные теги, содержащие слово. Список тегов.
@@ -312,135 +1385,980 @@ class Tags:
 
 # --- ЧАСТЬ MERCEDEB (Логика оценок) ---
 
-class Ratings:
-    def __init__(self, path_to_the_file, path_to_movies_file="movies.csv", limit = 1000):
-        self.ratings_path = path_to_the_file
-        self.movies_path = path_to_movies_file
-        self.limit = limit
-        self._ratings = []
-        self._movies_map = {}
-        
-        self.movies = self.Movies(self)
-        self.users = self.Users(self)
-        
-        self._load_data()
-    
-    def _load_data(self): # Бонус
-        """Читает оценки и названия фильмов в память."""
-        if self._ratings: # Предотвращаем повторную загрузку, если уже загружено
-            return
+# Плотные столбцы оценок: индексы фильма и пользователя, оценка, код оценки (None - есть оценки
+# вне шкалы половинок звёзд); названия - по индексу фильма
+RatingColumns = collections.namedtuple('RatingColumns', 'movie user rating code titles')
 
-        # Загрузка оценок
-        ratings_data = read_csv_limited(self.ratings_path, self.limit)
-        for row in ratings_data:
-            self._ratings.append({
-                'userId': int(row['userId']),
-                'movieId': int(row['movieId']),
-                'rating': float(row['rating']),
-                'timestamp': int(row['timestamp'])
-            })
+# Оценки MovieLens - половинки звёзд от 0.5 до 5.0: код оценки 0..9 = 2 * оценка - 1
+RATING_SCALE = tuple(i / 2 for i in range(1, 11))
 
-        # Загрузка названий фильмов для сопоставления (используется в top_by_ratings и др.)
-        if os.path.exists(self.movies_path):
-            movies_data = read_csv_limited(self.movies_path, self.limit)
-            for row in movies_data:
-                self._movies_map[int(row['movieId'])] = row['title']
+def rating_code(rating):
+    """Код оценки в RATING_SCALE или None, если оценка не на шкале."""
+    code = float(rating) * 2 - 1
+    return int(code) if code.is_integer() and 0 <= code < len(RATING_SCALE) else None
 
-    def show(self, data):
-        return ResultVisualizer(data)
-    
-    # Вспомогательные математические функции
-    @staticmethod
-    def average(values): # Бонус
-        return sum(values) / len(values) if values else 0.0
+class RatingHistogram:
+    """
+    Гистограмма оценок группы по 10 кодам RATING_SCALE. Медиана, квантили, мода, среднее
+    и дисперсия точные и считаются за O(10) без хранения и сортировки самих оценок.
+    """
+    __slots__ = ('counts',)
 
-    @staticmethod
-    def median(values): # Бонус
-        if not values: return 0.0
-        s = sorted(values)
-        mid = len(s) // 2
-        return float(s[mid]) if len(s) % 2 != 0 else (s[mid-1] + s[mid]) / 2.0
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts is not None else [0] * len(RATING_SCALE)
 
-    @staticmethod
-    def variance(values): # Бонус
-        if not values: return 0.0
-        avg = sum(values) / len(values)
-        return sum((x - avg) ** 2 for x in values) / len(values)
+    @classmethod
+    def from_values(cls, values):
+        """Гистограмма по оценкам; ValueError, если оценка не на шкале."""
+        hist = cls()
+        for v in values:
+            code = rating_code(v)
+            if code is None:
+                raise ValueError(f"Оценка {v} не на шкале половинок звёзд")
+            hist.counts[code] += 1
+        return hist
 
-    class Movies:
-        def __init__(self, parent):
-            self.parent = parent
-        
-        def dist_by_year(self):
-            """Ключи: годы (из timestamp), Значения: количество. Сортировка по годам по возрастанию."""
-            self.parent._load_data()
-            c = collections.Counter()
-            for r in self.parent._ratings:
-                dt = datetime.datetime.fromtimestamp(r['timestamp'])
-                c[dt.year] += 1
-            return dict(sorted(c.items()))
-        
-        def dist_by_rating(self):
-            """Ключи: оценки, Значения: количество. Сортировка по оценкам по возрастанию."""
-            self.parent._load_data()
-            c = collections.Counter()
-            for r in self.parent._ratings:
-                c[r['rating']] += 1
-            return dict(sorted(c.items()))
-        
-        def top_by_num_of_ratings(self, n):
-            """Dict: название -> количество. Сортировка по убыванию количества."""
-            self.parent._load_data()
+    def add(self, code, count=1):
+        self.counts[code] += count
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        return self
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def _value(self, k):
+        """k-я (с нуля) оценка в отсортированном порядке."""
+        for code, c in enumerate(self.counts):
+            if k < c:
+                return RATING_SCALE[code]
+            k -= c
+        raise IndexError(k)
+
+    def median(self):
+        """Как Ratings.median: среднее двух центральных оценок при чётном числе."""
+        n = len(self)
+        if not n: return 0.0
+        mid = n // 2
+        return self._value(mid) if n % 2 else (self._value(mid - 1) + self._value(mid)) / 2.0
+
+    def quantile(self, q):
+        """Квантиль уровня q в [0, 1] с линейной интерполяцией между соседними оценками."""
+        if not 0 <= q <= 1:
+            raise ValueError("q должен быть в диапазоне [0, 1]")
+        n = len(self)
+        if not n: return 0.0
+        pos = q * (n - 1)
+        lo = int(pos)
+        low = self._value(lo)
+        if lo == pos:
+            return low
+        return low + (self._value(lo + 1) - low) * (pos - lo)
+
+    def mode(self):
+        """Самая частая оценка (при равенстве - меньшая); 0.0 для пустой гистограммы."""
+        best = max(range(len(self.counts)), key=lambda code: (self.counts[code], -code))
+        return RATING_SCALE[best] if self.counts[best] else 0.0
+
+    def mean(self):
+        # Произведения половинок звёзд на счётчики точны: результат совпадает с Ratings.average
+        n = len(self)
+        return math.fsum(v * c for v, c in zip(RATING_SCALE, self.counts)) / n if n else 0.0
+
+    def variance(self):
+        n = len(self)
+        if not n: return 0.0
+        avg = self.mean()
+        return math.fsum(c * (v - avg) ** 2 for v, c in zip(RATING_SCALE, self.counts)) / n
+
+    def to_dict(self):
+        """{оценка: количество} по возрастанию оценки, без пустых корзин."""
+        return {v: c for v, c in zip(RATING_SCALE, self.counts) if c}
+
+def _compress(major, minor, values, n_major):
+    """Строит сжатое представление (indptr, indices, data), сгруппированное по главной оси."""
+    counts = [0] * (n_major + 1)
+    for m in major:
+        counts[m + 1] += 1
+    for i in range(n_major):
+        counts[i + 1] += counts[i]
+    pos = counts[:-1]
+    indices = array('l', [0]) * len(minor)
+    data = array('d', [0.0]) * len(values)
+    for m, j, v in zip(major, minor, values):
+        p = pos[m]
+        indices[p] = j
+        data[p] = v
+        pos[m] = p + 1
+    return array('q', counts), indices, data
+
+
+class SparseRatingMatrix:
+    """
+    Разреженная матрица пользователь×фильм: CSR (строки - пользователи) и CSC (столбцы - фильмы).
+    Если установлен scipy, произведения считаются через scipy.sparse, иначе - на массивах array.
+    """
+    AXES = ('movie', 'user')
+    METHODS = ('cosine', 'pearson')
+
+    def __init__(self, user_ids, movie_ids, ratings, backend=None):
+        self.users = sorted(set(user_ids))
+        self.movies = sorted(set(movie_ids))
+        self.user_index = {u: i for i, u in enumerate(self.users)}
+        self.movie_index = {m: i for i, m in enumerate(self.movies)}
+        self.backend = backend or ('scipy' if sparse is not None else 'array')
+        if self.backend == 'scipy' and sparse is None:
+            raise ImportError("Для backend='scipy' нужен пакет scipy")
+
+        self._rows = array('l', [self.user_index[u] for u in user_ids])
+        self._cols = array('l', [self.movie_index[m] for m in movie_ids])
+        self._vals = array('d', ratings)
+        self.csr = _compress(self._rows, self._cols, self._vals, len(self.users))
+        self.csc = _compress(self._cols, self._rows, self._vals, len(self.movies))
+        self._weighted = {} # (axis, method) -> нормированные векторы
+
+    @property
+    def shape(self):
+        return len(self.users), len(self.movies)
+
+    @property
+    def nnz(self):
+        return len(self._vals)
+
+    def _axis(self, axis):
+        """Возвращает (главная ось, второстепенная ось, ключи, индекс) для 'movie' или 'user'."""
+        if axis == 'movie':
+            return self._cols, self._rows, self.movies, self.movie_index
+        if axis == 'user':
+            return self._rows, self._cols, self.users, self.user_index
+        raise ValueError(f"Неизвестная ось: {axis}")
+
+    def _weights(self, axis, method):
+        """Векторы сущностей, нормированные к единичной длине (для pearson - ещё и центрированные)."""
+        key = (axis, method)
+        if key in self._weighted:
+            return self._weighted[key]
+        if method not in self.METHODS:
+            raise ValueError(f"Неизвестная мера сходства: {method}")
+        major, minor, keys, _ = self._axis(axis)
+        n_major = len(keys)
+        n_minor = len(self.users) + len(self.movies) - n_major
+        vals = list(self._vals)
+
+        if method == 'pearson':
+            sums = [0.0] * n_major
+            counts = [0] * n_major
+            for m, v in zip(major, vals):
+                sums[m] += v
+                counts[m] += 1
+            vals = [v - sums[m] / counts[m] for m, v in zip(major, vals)]
+
+        norms = [0.0] * n_major
+        for m, v in zip(major, vals):
+            norms[m] += v * v
+        norms = [math.sqrt(x) for x in norms]
+        vals = [v / norms[m] if norms[m] else 0.0 for m, v in zip(major, vals)]
+
+        if self.backend == 'scipy':
+            weighted = sparse.csr_matrix((vals, (major, minor)), shape=(n_major, n_minor))
+            weighted = (weighted, weighted.T.tocsr())
+        else:
+            weighted = (_compress(major, minor, vals, n_major), _compress(minor, major, vals, n_minor))
+        self._weighted[key] = weighted
+        return weighted
+
+    def _top_k_block(self, axis, block, k, method):
+        """Топ-k соседей для блока индексов: одно разреженное произведение на весь блок."""
+        entity, other = self._weights(axis, method)
+        order = lambda x: (x[1], -x[0]) # при равенстве - меньший индекс
+        result = []
+        if self.backend == 'scipy':
+            prod = (entity[block] @ other).tocsr()
+            for i, e in enumerate(block):
+                start, end = prod.indptr[i], prod.indptr[i + 1]
+                pairs = [(int(j), float(v)) for j, v in zip(prod.indices[start:end], prod.data[start:end]) if j != e and v]
+                result.append(heapq.nlargest(k, pairs, key=order))
+            return result
+
+        e_ptr, e_idx, e_dat = entity
+        o_ptr, o_idx, o_dat = other
+        for e in block:
+            scores = {} # разреженный аккумулятор строки произведения
+            for p in range(e_ptr[e], e_ptr[e + 1]):
+                o, w = e_idx[p], e_dat[p]
+                if not w:
+                    continue
+                for q in range(o_ptr[o], o_ptr[o + 1]):
+                    j = o_idx[q]
+                    scores[j] = scores.get(j, 0.0) + w * o_dat[q]
+            scores.pop(e, None)
+            pairs = [(j, v) for j, v in scores.items() if v]
+            result.append(heapq.nlargest(k, pairs, key=order))
+        return result
+
+    def top_k_neighbours(self, axis, keys=None, k=10, method='cosine', block_size=256, workers=None):
+        """
+        Топ-k ближайших соседей для каждого ключа оси ('movie' или 'user').
+        Запросы обрабатываются блоками по block_size, поэтому память ограничена размером блока;
+        workers > 1 включает пул потоков. Dict: ключ -> список (ключ соседа, сходство).
+        """
+        _, _, all_keys, index = self._axis(axis)
+        if keys is None:
+            keys = all_keys
+        ids = [index[key] for key in keys if key in index]
+        blocks = [ids[i:i + block_size] for i in range(0, len(ids), block_size)]
+        run = functools.partial(self._top_k_block, axis, k=k, method=method)
+
+        if workers and workers > 1 and len(blocks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(run, blocks))
+        else:
+            parts = [run(block) for block in blocks]
+
+        res = {}
+        for block, part in zip(blocks, parts):
+            for e, pairs in zip(block, part):
+                res[all_keys[e]] = [(all_keys[j], score) for j, score in pairs]
+        return res
+
+
+class RatingsSketch:
+    """
+    Скетчи по потоку оценок в ограниченной памяти:
+    HeavyHitters по фильмам (топ по числу оценок), Count-Min по пользователям,
+    распределение пользователей по числу оценок (count_dist) и разреженные HyperLogLog
+    различных пользователей на фильм и различных фильмов на пользователя - для каждого
+    ключа, от нескольких байт до 2**precision байт на ключ.
+    count_dist считается по сериям подряд идущих оценок одного пользователя и точен, только
+    если поток отсортирован по userId (как файлы MovieLens): порядок проверяется, и при
+    нарушении user_sorted становится False. Скетчи объединяются (merge); объединение
+    сохраняет user_sorted, если у частей непересекающиеся диапазоны userId.
+    """
+    def __init__(self, k=100, epsilon=1e-3, delta=1e-2, error=0.1):
+        self.k, self.epsilon, self.delta, self.error = k, epsilon, delta, error
+        self.movie_popularity = HeavyHitters(k, epsilon, delta)
+        self.user_counts = CountMinSketch(epsilon, delta)
+        self.count_dist = collections.Counter()
+        self.users_per_movie = {}
+        self.movies_per_user = {}
+        self.user_sorted = True
+        self._first = None # первый userId потока
+        self._last = (None, 0) # последний пользователь и его число оценок: серия может продолжиться в следующем блоке
+
+    def _hll(self, table, key):
+        hll = table.get(key)
+        if hll is None:
+            hll = table[key] = HyperLogLog(error=self.error, sparse=True)
+        return hll
+
+    def _add_user_run(self, uid, count):
+        last, prev = self._last
+        if uid != last:
+            if last is not None and uid < last:
+                self.user_sorted = False
+            prev = 0
+        if self._first is None:
+            self._first = uid
+        self._last = (uid, prev + count)
+        self.user_counts.add(uid, count)
+        # Пользователь переносится из корзины prev (0 - новый) в prev + count
+        if prev:
+            self.count_dist[prev] -= 1
+            if not self.count_dist[prev]:
+                del self.count_dist[prev]
+        self.count_dist[prev + count] += 1
+
+    def update(self, rows):
+        """Добавляет блок строк (словари с userId и movieId)."""
+        run_user, run_len = None, 0
+        for row in rows:
+            uid, mid = int(row['userId']), int(row['movieId'])
+            self.movie_popularity.add(mid)
+            self._hll(self.users_per_movie, mid).add(uid)
+            self._hll(self.movies_per_user, uid).add(mid)
+            # Подряд идущие оценки одного пользователя - одно обновление (серия)
+            if uid != run_user:
+                if run_len:
+                    self._add_user_run(run_user, run_len)
+                run_user, run_len = uid, 0
+            run_len += 1
+        if run_len:
+            self._add_user_run(run_user, run_len)
+        return self
+
+    def merge(self, other):
+        if other._first is not None:
+            if self._first is not None:
+                # Части без общих пользователей: диапазоны userId не пересекаются
+                disjoint = self._last[0] < other._first or other._last[0] < self._first
+                self.user_sorted = self.user_sorted and other.user_sorted and disjoint
+                if other._last[0] > self._last[0]:
+                    self._last = other._last
+                self._first = min(self._first, other._first)
+            else:
+                self.user_sorted, self._first, self._last = other.user_sorted, other._first, other._last
+        self.movie_popularity.merge(other.movie_popularity)
+        self.user_counts.merge(other.user_counts)
+        self.count_dist.update(other.count_dist)
+        for table, other_table in ((self.users_per_movie, other.users_per_movie),
+                                   (self.movies_per_user, other.movies_per_user)):
+            for key, hll in other_table.items():
+                if key in table:
+                    table[key].merge(hll)
+                else:
+                    table[key] = hll
+        return self
+
+    @classmethod
+    def from_file(cls, path, limit=None, chunk_size=100000, **config):
+        """Строит скетчи потоком по CSV: в памяти только текущий блок и сами скетчи."""
+        sketch = cls(**config)
+        for chunk in iter_csv_chunks(path, chunk_size, limit):
+            sketch.update(chunk)
+        return sketch
+
+# --- Сессии пользователей ---
+
+SESSION_GAP = 30 * 60 # пауза между оценками (секунды), после которой начинается новая сессия
+
+# Сессии в порядке (пользователь, время): плотный индекс пользователя, первая и последняя
+# оценка (timestamp), число оценок
+UserSessions = collections.namedtuple('UserSessions', 'user start end count')
+
+def _seconds(value):
+    """Длительность в секундах из числа или timedelta."""
+    return value.total_seconds() if isinstance(value, datetime.timedelta) else value
+
+# --- Параллельное вычисление метрик ---
+
+METRIC_BATCH_SIZE = 1024 # групп в одном задании пула процессов
+# Пул метрик запускается через spawn: fork из многопоточного процесса (HTTP-сервер, ReportRunner)
+# копирует чужие захваченные блокировки
+METRIC_START_METHOD = 'spawn'
+
+def vectorized_metric(func):
+    """
+    Помечает metric как векторную: она вызывается один раз на пакет групп со списком массивов
+    оценок (numpy.ndarray, если numpy установлен, иначе array('d')) и возвращает список значений.
+    """
+    func.vectorized = True
+    return func
+
+def _is_picklable(obj):
+    try:
+        pickle.dumps(obj)
+        return True
+    except Exception: # PicklingError, AttributeError (локальные объекты), TypeError
+        return False
+
+def _metric_batch(metric, groups):
+    """Значения metric для пакета групп: в процессе пула или в текущем процессе."""
+    if getattr(metric, 'vectorized', False):
+        arrays = [np.asarray(g, dtype=float) if np is not None else array('d', g) for g in groups]
+        values = list(metric(arrays))
+        if len(values) != len(groups):
+            raise ValueError(f"Векторная метрика вернула {len(values)} значений для {len(groups)} групп")
+        return values
+    return [metric(g) for g in groups]
+
+def evaluate_metric(metric, groups, workers=None, batch_size=METRIC_BATCH_SIZE):
+    """
+    Список metric(группа) для списка групп оценок. При workers > 1 пакеты по batch_size групп
+    считаются в пуле процессов (не больше os.cpu_count() и числа пакетов, METRIC_START_METHOD);
+    если metric не сериализуется pickle (лямбда, замыкание) или пул не запускается,
+    вычисление идёт последовательно.
+    """
+    batches = [groups[i:i + batch_size] for i in range(0, len(groups), batch_size)]
+    parts = None
+    if workers:
+        workers = min(workers, os.cpu_count() or 1, len(batches))
+    if workers and workers > 1 and _is_picklable(metric):
+        try:
+            context = multiprocessing.get_context(METRIC_START_METHOD)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                parts = list(pool.map(functools.partial(_metric_batch, metric), batches))
+        except (concurrent.futures.process.BrokenProcessPool, OSError):
+            parts = None
+    if parts is None:
+        parts = [_metric_batch(metric, batch) for batch in batches]
+    return [value for part in parts for value in part]
+
+
+class Ratings(ParquetMixin, MemoizedMixin):
+    PARQUET_SORT_KEY = 'timestamp'
+
+    def __init__(self, path_to_the_file, path_to_movies_file="movies.csv", limit = 1000,
+                 sample=None, sample_method='reservoir', stratify=None, seed=None, ids=None,
+                 memory_budget=None):
+        self.ratings_path = path_to_the_file
+        self.movies_path = path_to_movies_file
+        self.limit = limit
+        # sample=N: случайная выборка N оценок по всему файлу вместо первых limit строк
+        self.sample = sample
+        self.sample_method = sample_method
+        self.stratify = stratify
+        self.seed = seed
+        self._sample = None
+        self._ratings = []
+        self._movies_map = {}
+        self._matrix = None
+        self._time_index = None
+        self._sketch = None
+        self._columns_cache = None
+        self._timeline = None
+        self.ids = ids if ids is not None else IdDictionary()
+        # memory_budget (байты): группировки читают файл потоком и сбрасывают данные на диск,
+        # оценки в память не загружаются, пока их не потребует другой метод
+        self.memory_budget = memory_budget
+        
+        self.movies = self.Movies(self)
+        self.users = self.Users(self)
+        
+        if memory_budget is None or sample:
+            self._load_data()
+        else:
+            self._load_titles()
+    
+    def _load_data(self): # Бонус
+        """Читает оценки и названия фильмов в память."""
+        if self._ratings: # Предотвращаем повторную загрузку, если уже загружено
+            return
+
+        # Загрузка оценок
+        if self.sample:
+            self._sample = sample_csv(self.ratings_path, self.sample, self.sample_method, self.stratify, self.seed)
+            ratings_data = self._sample.rows
+        else:
+            ratings_data = read_csv_limited(self.ratings_path, self.limit)
+        for row in ratings_data:
+            self._ratings.append({
+                'userId': int(row['userId']),
+                'movieId': int(row['movieId']),
+                'rating': float(row['rating']),
+                'timestamp': int(row['timestamp'])
+            })
+
+        self._load_titles()
+
+    def _load_titles(self):
+        # Загрузка названий фильмов для сопоставления (используется в top_by_ratings и др.)
+        if self.movies_path and os.path.exists(self.movies_path):
+            movies_data = read_csv_limited(self.movies_path, None if self.sample else self.limit)
+            for row in movies_data:
+                self._movies_map[int(row['movieId'])] = row['title']
+
+    def _data_version(self):
+        return (self._version, id(self._ratings), len(self._ratings), id(self._movies_map), len(self._movies_map))
+
+    def _invalidate(self):
+        # Производные структуры строятся заново по новым данным
+        self._matrix = None
+        self._time_index = None
+        self._sketch = None
+        self._columns_cache = None
+        self._timeline = None
+        super()._invalidate()
+
+    def reload(self):
+        """Перечитывает файлы; индексы и закешированные результаты запросов сбрасываются."""
+        self._ratings = []
+        self._movies_map = {}
+        self._sample = None
+        self._invalidate()
+        self._load_data()
+
+    def append(self, rows):
+        """Добавляет оценки: словари с userId, movieId, rating, timestamp."""
+        self._load_data()
+        for row in rows:
+            self._ratings.append({
+                'userId': int(row['userId']),
+                'movieId': int(row['movieId']),
+                'rating': float(row['rating']),
+                'timestamp': int(row['timestamp'])
+            })
+        self._invalidate()
+
+    @classmethod
+    def arrow_schema(cls):
+        _require_arrow()
+        return pa.schema([
+            ('userId', pa.int32()),
+            ('movieId', pa.int32()),
+            ('rating', pa.float32()), # половинки звёзд точно представимы во float32
+            ('timestamp', pa.int64()),
+        ])
+
+    def _to_columns(self):
+        self._load_data()
+        return {name: [r[name] for r in self._ratings] for name in ('userId', 'movieId', 'rating', 'timestamp')}
+
+    @classmethod
+    def _from_columns(cls, columns, path_to_movies_file=None, limit=None, ids=None):
+        """Названия фильмов (если нужны) читаются из path_to_movies_file."""
+        obj = cls(None, path_to_movies_file, limit=limit, ids=ids)
+        for uid, mid, rating, ts in zip(columns['userId'], columns['movieId'], columns['rating'], columns['timestamp']):
+            obj._ratings.append({'userId': uid, 'movieId': mid, 'rating': rating, 'timestamp': ts})
+        return obj
+
+    def show(self, data):
+        return ResultVisualizer(data)
+
+    def matrix(self, backend=None):
+        """Разреженная матрица пользователь×фильм по загруженным оценкам (строится один раз)."""
+        self._require_columns('userId', 'movieId', 'rating')
+        self._load_data()
+        if self._matrix is None or (backend and self._matrix.backend != backend):
+            self._matrix = SparseRatingMatrix(
+                [r['userId'] for r in self._ratings],
+                [r['movieId'] for r in self._ratings],
+                [r['rating'] for r in self._ratings],
+                backend=backend
+            )
+        return self._matrix
+
+    def time_index(self):
+        """Индекс оценок, отсортированный по timestamp, с префиксными суммами оценок."""
+        self._require_columns('timestamp')
+        self._load_data()
+        if self._time_index is None:
+            self._time_index = TimeIndex(
+                [r['timestamp'] for r in self._ratings],
+                None if 'rating' in self._missing_columns else [r['rating'] for r in self._ratings]
+            )
+        return self._time_index
+
+    def sketch(self, chunk_size=100000, **config):
+        """
+        Скетчи по файлу оценок (RatingsSketch), построенные потоком без загрузки в память.
+        Параметры точности (k, epsilon, delta, error) передаются в RatingsSketch.
+        """
+        if self._sketch is None or config:
+            self._sketch = RatingsSketch.from_file(self.ratings_path, self.limit, chunk_size, **config)
+        return self._sketch
+
+    def columns(self):
+        """
+        Оценки в виде плотных столбцов (RatingColumns): movieId и userId заменены индексами
+        общего словаря self.ids, названия фильмов лежат в списке по индексу фильма.
+        Незагруженные из Parquet колонки - None (в словарь ничего не кодируется).
+        Строятся один раз на версию данных; агрегаты дальше - индексация массивов.
+        """
+        self._load_data()
+        version = self._data_version()
+        if self._columns_cache is None or self._columns_cache[0] != version:
+            movies, users, missing = self.ids.movies, self.ids.users, self._missing_columns
+            has_rating = 'rating' not in missing
+            codes = [rating_code(r['rating']) for r in self._ratings] if has_rating else [None]
+            cols = RatingColumns(
+                None if 'movieId' in missing else array('l', [movies.encode(r['movieId']) for r in self._ratings]),
+                None if 'userId' in missing else array('l', [users.encode(r['userId']) for r in self._ratings]),
+                array('d', [r['rating'] for r in self._ratings]) if has_rating else None,
+                None if None in codes else array('b', codes),
+                [None] * len(movies)
+            )
+            for mid, title in self._movies_map.items():
+                idx = movies.get(mid)
+                if idx is not None:
+                    cols.titles[idx] = title
+            self._columns_cache = (version, cols)
+        return self._columns_cache[1]
+
+    def _title(self, idx):
+        """Название фильма по плотному индексу (или movieId строкой, если названия нет)."""
+        title = self.columns().titles[idx]
+        return title if title is not None else str(self.ids.movies.decode(idx))
+
+    def _groups(self, axis, since=None, until=None):
+        """
+        Оценки, сгруппированные по плотному индексу фильма (axis='movie') или пользователя ('user'),
+        за интервал [since, until). Возвращает (индексы в порядке первого появления, списки оценок по индексу).
+        """
+        self._require_columns('movieId' if axis == 'movie' else 'userId', 'rating')
+        cols = self.columns()
+        keys, id_map = (cols.movie, self.ids.movies) if axis == 'movie' else (cols.user, self.ids.users)
+        if since is None and until is None:
+            positions = range(len(keys))
+        else:
+            positions = self.time_index().select(since, until)
+        groups = [None] * len(id_map)
+        order = []
+        rating = cols.rating
+        for pos in positions:
+            k = keys[pos]
+            group = groups[k]
+            if group is None:
+                group = groups[k] = []
+                order.append(k)
+            group.append(rating[pos])
+        return order, groups
+
+    def _user_timeline(self):
+        """
+        Плотные индексы пользователей и timestamp оценок, отсортированные по (пользователь, время).
+        Сортировка одна на версию данных: numpy.lexsort, без numpy - sorted по перестановке.
+        """
+        self._require_columns('userId', 'timestamp')
+        cols = self.columns()
+        version = self._data_version()
+        if self._timeline is None or self._timeline[0] != version:
+            times = [r['timestamp'] for r in self._ratings]
+            if np is not None:
+                users, times = np.asarray(cols.user, dtype=np.int64), np.asarray(times, dtype=np.int64)
+                order = np.lexsort((times, users))
+                timeline = (users[order], times[order])
+            else:
+                order = sorted(range(len(times)), key=lambda i: (cols.user[i], times[i]))
+                timeline = (array('l', [cols.user[i] for i in order]), array('q', [times[i] for i in order]))
+            self._timeline = (version, timeline)
+        return self._timeline[1]
+
+    def sessions(self, gap=SESSION_GAP):
+        """
+        Сессии: подряд идущие оценки пользователя, между которыми не больше gap (секунды или timedelta).
+        Границы сессий находятся одним векторным проходом по _user_timeline. Возвращает UserSessions.
+        """
+        users, times = self._user_timeline()
+        gap = _seconds(gap)
+        n = len(times)
+        if not n:
+            return UserSessions([], [], [], [])
+        if np is not None:
+            # Новая сессия - смена пользователя или пауза больше gap
+            new = np.ones(n, dtype=bool)
+            new[1:] = (users[1:] != users[:-1]) | (np.diff(times) > gap)
+            starts = np.flatnonzero(new)
+            ends = np.append(starts[1:], n)
+            return UserSessions(users[starts].tolist(), times[starts].tolist(),
+                                times[ends - 1].tolist(), (ends - starts).tolist())
+        res = UserSessions([], [], [], [])
+        for i in range(n):
+            if i and users[i] == users[i - 1] and times[i] - times[i - 1] <= gap:
+                res.end[-1] = times[i]
+                res.count[-1] += 1
+            else:
+                res.user.append(users[i])
+                res.start.append(times[i])
+                res.end.append(times[i])
+                res.count.append(1)
+        return res
+
+    def _peak_activity(self, window):
+        """
+        Для каждого плотного индекса пользователя - наибольшее число его оценок за интервал
+        [t, t + window); window=None - все оценки пользователя.
+        """
+        users, times = self._user_timeline()
+        n_users, n = len(self.ids.users), len(times)
+        if window is None:
+            if np is not None:
+                return np.bincount(users, minlength=n_users).tolist()
+            best = [0] * n_users
+            for u in users:
+                best[u] += 1
+            return best
+        window = _seconds(window)
+        if np is not None:
+            if not n:
+                return [0] * n_users
+            # Ключ (пользователь, время) в одном int64: окна не переходят на следующего пользователя
+            t = times - times.min()
+            span = int(t.max()) + int(math.ceil(window)) + 1
+            key = users * span + t
+            reach = np.searchsorted(key, key + window, side='left') - np.arange(n)
+            best = np.zeros(n_users, dtype=np.int64)
+            np.maximum.at(best, users, reach)
+            return best.tolist()
+        best = [0] * n_users
+        j = 0
+        for i in range(n):
+            j = max(j, i)
+            while j < n and users[j] == users[i] and times[j] < times[i] + window:
+                j += 1
+            best[users[i]] = max(best[users[i]], j - i)
+        return best
+
+    def _histograms(self, axis, since=None, until=None):
+        """
+        Как _groups, но вместо списков оценок - RatingHistogram по индексу, за один проход
+        по кодам оценок. None, если есть оценки вне шкалы половинок звёзд.
+        """
+        self._require_columns('movieId' if axis == 'movie' else 'userId', 'rating')
+        cols = self.columns()
+        if cols.code is None:
+            return None
+        keys, id_map = (cols.movie, self.ids.movies) if axis == 'movie' else (cols.user, self.ids.users)
+        if since is None and until is None:
+            positions = range(len(keys))
+        else:
+            positions = self.time_index().select(since, until)
+        width = len(RATING_SCALE)
+        counts = array('q', [0]) * (len(id_map) * width)
+        seen = bytearray(len(id_map))
+        order = []
+        code = cols.code
+        for pos in positions:
+            k = keys[pos]
+            if not seen[k]:
+                seen[k] = 1
+                order.append(k)
+            counts[k * width + code[pos]] += 1
+        hists = [None] * len(id_map)
+        for k in order:
+            hists[k] = RatingHistogram(counts[k * width:(k + 1) * width])
+        return order, hists
+
+    @staticmethod
+    def _histogram_metric(metric):
+        """Метод RatingHistogram, дающий тот же результат, что и metric, или None."""
+        for func, method in ((Ratings.average, RatingHistogram.mean), (Ratings.median, RatingHistogram.median)):
+            if metric is func:
+                return method
+        return None
+
+    def _iter_rows(self):
+        """Оценки по одной: из памяти, если загружены, иначе потоком из файла."""
+        if self._ratings or self.memory_budget is None:
+            self._load_data()
+            yield from self._ratings
+            return
+        for row in iter_csv_rows(self.ratings_path, self.limit):
+            yield {
+                'userId': int(row['userId']),
+                'movieId': int(row['movieId']),
+                'rating': float(row['rating']),
+                'timestamp': int(row['timestamp'])
+            }
+
+    def _external_groups(self, key, since=None, until=None):
+        """
+        Режим memory_budget: генератор (id, порядок первой оценки, оценки) по возрастанию id
+        через ExternalGroupBy. Оценки группы идут в том же порядке, что и в _groups.
+        """
+        grouper = ExternalGroupBy(self.memory_budget)
+        windowed = since is not None or until is not None
+        since, until = to_timestamp(since), to_timestamp(until)
+        for i, r in enumerate(self._iter_rows()):
+            ts = r['timestamp']
+            if (since is not None and ts < since) or (until is not None and ts >= until):
+                continue
+            # В интервале порядок - по времени, как в time_index()
+            grouper.add(r[key], ts if windowed else 0, i, r['rating'])
+        return grouper.groups()
+
+    def _external_top(self, key, value, n, since=None, until=None):
+        """Топ-n групп [(id, value(оценки))] по убыванию; при равенстве - первая по порядку появления."""
+        calc = ((gid, first, round(value(rates), 2)) for gid, first, rates in self._external_groups(key, since, until))
+        top = heapq.nlargest(n, calc, key=lambda x: (x[2], -x[1][0], -x[1][1]))
+        return [(gid, val) for gid, _, val in top]
+
+    def _window(self, since=None, until=None):
+        """Оценки за интервал [since, until); без границ - все оценки."""
+        self._load_data()
+        if since is None and until is None:
+            return self._ratings
+        return [self._ratings[i] for i in self.time_index().select(since, until)]
+
+    def _estimate_counts(self, key, since=None, until=None):
+        """
+        Режим sample: Dict ключ -> Estimate числа оценок во всём файле.
+        key(r) возвращает ключ строки оценки.
+        """
+        window = None
+        if since is not None or until is not None:
+            window = set(self.time_index().select(since, until))
+        keys = [key(r) if window is None or i in window else None for i, r in enumerate(self._ratings)]
+        return self._sample.estimate_totals(keys)
+
+    def _estimate_user_dist(self, value):
+        """
+        Режим sample со stratify='userId': пользователи попадают в выборку целиком,
+        поэтому value(оценки пользователя) точны, а число пользователей - Estimate.
+        """
+        user_ratings = collections.defaultdict(list)
+        for r in self._ratings:
+            user_ratings[r['userId']].append(r['rating'])
+        per_user = {uid: value(rates) for uid, rates in user_ratings.items()}
+        # Каждый пользователь - одна единица выборки: ключ учитываем один раз на пользователя
+        keys = []
+        for r in self._ratings:
+            keys.append(per_user.pop(r['userId'], None))
+        return self._sample.estimate_totals(keys)
+    
+    # Вспомогательные математические функции
+    @staticmethod
+    def average(values): # Бонус
+        # fsum точна и не зависит от порядка значений (важно для объединения шардов)
+        return math.fsum(values) / len(values) if values else 0.0
+
+    @staticmethod
+    def median(values): # Бонус
+        if not values: return 0.0
+        s = sorted(values)
+        mid = len(s) // 2
+        return float(s[mid]) if len(s) % 2 != 0 else (s[mid-1] + s[mid]) / 2.0
+
+    @staticmethod
+    def variance(values): # Бонус
+        if not values: return 0.0
+        avg = math.fsum(values) / len(values)
+        return math.fsum((x - avg) ** 2 for x in values) / len(values)
+
+    class Movies:
+        def __init__(self, parent):
+            self.parent = parent
+        
+        @requires_columns('timestamp')
+        @memoized
+        def dist_by_year(self):
+            """Ключи: годы (из timestamp), Значения: количество. Сортировка по годам по возрастанию."""
+            self.parent._load_data()
+            if self.parent._sample is not None:
+                year = lambda r: datetime.datetime.fromtimestamp(r['timestamp']).year
+                return dict(sorted(self.parent._estimate_counts(year).items()))
             c = collections.Counter()
             for r in self.parent._ratings:
-                c[r['movieId']] += 1
+                dt = datetime.datetime.fromtimestamp(r['timestamp'])
+                c[dt.year] += 1
+            return dict(sorted(c.items()))
+        
+        @requires_columns('rating')
+        @memoized
+        def dist_by_rating(self, since=None, until=None):
+            """Ключи: оценки, Значения: количество. Сортировка по оценкам по возрастанию."""
+            self.parent._load_data()
+            if self.parent._sample is not None:
+                return dict(sorted(self.parent._estimate_counts(lambda r: r['rating'], since, until).items()))
+            if self.parent.columns().code is not None:
+                # Счётчики по кодам оценок вместо Counter с ключами-float
+                codes = self.parent.columns().code
+                positions = range(len(codes)) if since is None and until is None \
+                    else self.parent.time_index().select(since, until)
+                hist = RatingHistogram()
+                for pos in positions:
+                    hist.counts[codes[pos]] += 1
+                return hist.to_dict()
+            c = collections.Counter()
+            for r in self.parent._window(since, until):
+                c[r['rating']] += 1
+            return dict(sorted(c.items()))
+        
+        @requires_columns('movieId')
+        @memoized
+        def top_by_num_of_ratings(self, n, since=None, until=None, sketch=False):
+            """
+            Dict: название -> количество. Сортировка по убыванию количества.
+            sketch=True - приближённые значения из скетча всего файла (без since/until).
+            """
+            if sketch:
+                if since is not None or until is not None:
+                    raise ValueError("Режим sketch не поддерживает since/until")
+                top = self.parent.sketch().movie_popularity.top(n)
+            elif self.parent._sample is not None:
+                est = self.parent._estimate_counts(lambda r: r['movieId'], since, until)
+                top = sorted(est.items(), key=lambda x: x[1], reverse=True)[:n]
+            else:
+                # Нужен только столбец фильмов: Counter хранит порядок первого появления,
+                # most_common сортирует устойчиво - равные количества в том же порядке, что и группы
+                movie = self.parent.columns().movie
+                if since is None and until is None:
+                    counts = collections.Counter(movie)
+                else:
+                    counts = collections.Counter(movie[pos] for pos in self.parent.time_index().select(since, until))
+                return {self.parent._title(i): c for i, c in counts.most_common(n)}
             
             # Сопоставляем id с названиями
             res = {}
-            for mid, count in c.most_common(n):
+            for mid, count in top:
                 title = self.parent._movies_map.get(mid, str(mid))
                 res[title] = count
             return res
         
-        def top_by_ratings(self, n, metric=None):
-            """Dict: название -> значение_метрики. Сортировка по убыванию метрики. Округление до 2 знаков."""
+        @requires_columns('movieId', 'rating')
+        @memoized
+        def top_by_ratings(self, n, metric=None, since=None, until=None, workers=None):
+            """
+            Dict: название -> значение_метрики. Сортировка по убыванию метрики. Округление до 2 знаков.
+            workers > 1 - metric считается в пуле процессов (evaluate_metric).
+            """
             if metric is None: metric = self.parent.average
-            self.parent._load_data()
-            
-            groups = collections.defaultdict(list)
-            for r in self.parent._ratings:
-                groups[r['movieId']].append(r['rating'])
+            if self.parent.memory_budget is not None and self.parent._sample is None:
+                top = self.parent._external_top('movieId', metric, n, since, until)
+                return {self.parent._movies_map.get(mid, str(mid)): val for mid, val in top}
             
-            calc = []
-            for mid, rates in groups.items():
-                val = round(metric(rates), 2)
-                calc.append((mid, val))
+            # В режиме sample среднее возвращается с доверительным интервалом
+            estimate = self.parent._sample is not None and metric is self.parent.average
+            exact = self.parent.stratify == 'movieId'
+            # Медиана и среднее половинок звёзд - по гистограммам, без сортировки оценок
+            method = None if estimate else self.parent._histogram_metric(metric)
+            hists = method and self.parent._histograms('movie', since, until)
+            if hists:
+                order, hists = hists
+                calc = [(i, round(method(hists[i]), 2)) for i in order]
+                calc.sort(key=lambda x: x[1], reverse=True)
+                return {self.parent._title(i): val for i, val in calc[:n]}
+
+            order, groups = self.parent._groups('movie', since, until)
+            if estimate:
+                calc = [(i, CsvSample.estimate_mean(groups[i], exact)) for i in order]
+            else:
+                values = evaluate_metric(metric, [groups[i] for i in order], workers)
+                calc = [(i, round(val, 2)) for i, val in zip(order, values)]
             
             calc.sort(key=lambda x: x[1], reverse=True)
-            
-            res = {}
-            for mid, val in calc[:n]:
-                title = self.parent._movies_map.get(mid, str(mid))
-                res[title] = val
-            return res
+            return {self.parent._title(i): val for i, val in calc[:n]}
         
+        @requires_columns('movieId', 'rating')
+        @memoized
         def top_controversial(self, n):
             """Дисперсия оценок. Dict: название -> дисперсия. По убыванию."""
-            self.parent._load_data()
-            groups = collections.defaultdict(list)
-            for r in self.parent._ratings:
-                groups[r['movieId']].append(r['rating'])
-                
-            calc = []
-            for mid, rates in groups.items():
-                val = round(self.parent.variance(rates), 2)
-                calc.append((mid, val))
-            
+            if self.parent.memory_budget is not None and self.parent._sample is None:
+                top = self.parent._external_top('movieId', self.parent.variance, n)
+                return {self.parent._movies_map.get(mid, str(mid)): val for mid, val in top}
+            order, groups = self.parent._groups('movie')
+            calc = [(i, round(self.parent.variance(groups[i]), 2)) for i in order]
             calc.sort(key=lambda x: x[1], reverse=True)
+            return {self.parent._title(i): val for i, val in calc[:n]}
+
+        @requires_columns('timestamp', 'rating')
+        @memoized
+        def rating_trend(self, window_days=30, step_days=7, since=None, until=None):
+            """
+            Скользящее окно по времени: ключи - даты начала окна длиной window_days с шагом step_days,
+            значения - {'count': количество оценок, 'average': средняя оценка}. Каждое окно - O(log n).
+            """
+            index = self.parent.time_index()
+            if not len(index):
+                return {}
+            start = to_timestamp(since) if since is not None else index.times[0]
+            end = to_timestamp(until) if until is not None else index.times[-1] + 1
+            day = datetime.datetime.fromtimestamp(start).date()
+            window = datetime.timedelta(days=window_days)
+            step = datetime.timedelta(days=step_days)
+
             res = {}
-            for mid, val in calc[:n]:
+            while to_timestamp(day) < end:
+                lo = max(to_timestamp(day), start)
+                count, total = index.window(lo, min(to_timestamp(day + window), end))
+                res[day] = {'count': count, 'average': round(total / count, 2) if count else 0.0}
+                day += step
+            return res
+
+        @memoized
+        def distinct_users(self, movie_id):
+            """Оценка числа различных пользователей, оценивших фильм (HyperLogLog)."""
+            hll = self.parent.sketch().users_per_movie.get(movie_id)
+            return hll.count() if hll else 0
+
+        @memoized
+        def similar_movies(self, movie_id, n, method='cosine'):
+            """Топ-n фильмов, похожих на movie_id (cosine/pearson). Dict: название -> сходство. По убыванию."""
+            neighbours = self.parent.matrix().top_k_neighbours('movie', [movie_id], n, method)
+            res = {}
+            for mid, val in neighbours.get(movie_id, []):
                 title = self.parent._movies_map.get(mid, str(mid))
-                res[title] = val
+                res[title] = round(val, 2)
             return res
 
     class Users(Movies):
@@ -448,233 +2366,1563 @@ class Ratings:
         def __init__(self, parent):
             super().__init__(parent)
             
-        def dist_by_num_of_ratings(self):
-            """Распределение пользователей по количеству оценок."""
+        @requires_columns('userId')
+        @memoized
+        def dist_by_num_of_ratings(self, sketch=False):
+            """
+            Распределение пользователей по количеству оценок.
+            sketch=True - по сериям оценок в потоке файла, без счётчика на каждого пользователя;
+            файл должен быть отсортирован по userId (иначе ValueError).
+            """
+            if sketch:
+                stream = self.parent.sketch()
+                if not stream.user_sorted:
+                    raise ValueError("dist_by_num_of_ratings(sketch=True): файл оценок не отсортирован по userId")
+                return dict(sorted(stream.count_dist.items()))
             self.parent._load_data()
-            user_counts = collections.Counter()
-            for r in self.parent._ratings:
-                user_counts[r['userId']] += 1
+            if self.parent._sample is not None and self.parent.stratify == 'userId':
+                return dict(sorted(self.parent._estimate_user_dist(len).items()))
+            users = self.parent.columns().user # сначала столбцы: они дописывают id в словарь
+            user_counts = [0] * len(self.parent.ids.users)
+            for u in users:
+                user_counts[u] += 1
             
-            # Теперь распределение этих количеств
-            dist = collections.Counter(user_counts.values())
+            # Теперь распределение этих количеств (индексы без оценок в этих данных пропускаем)
+            dist = collections.Counter(c for c in user_counts if c)
             return dict(sorted(dist.items())) # Сортировка по количеству оценок (ключи) по возрастанию
             
-        def dist_by_ratings(self, metric=None):
-            """Распределение пользователей по средним/медианным оценкам."""
+        @requires_columns('userId', 'rating')
+        @memoized
+        def dist_by_ratings(self, metric=None, workers=None):
+            """
+            Распределение пользователей по средним/медианным оценкам.
+            workers > 1 - metric считается в пуле процессов (evaluate_metric).
+            """
             if metric is None: metric = self.parent.average
+            dist = collections.Counter()
+            if self.parent.memory_budget is not None and self.parent._sample is None:
+                for _, _, rates in self.parent._external_groups('userId'):
+                    dist[round(metric(rates), 2)] += 1
+                return dict(sorted(dist.items()))
+
             self.parent._load_data()
+            if self.parent._sample is not None and self.parent.stratify == 'userId':
+                value = lambda rates: round(metric(rates), 2)
+                return dict(sorted(self.parent._estimate_user_dist(value).items()))
             
-            user_ratings = collections.defaultdict(list)
-            for r in self.parent._ratings:
-                user_ratings[r['userId']].append(r['rating'])
-            
-            dist = collections.Counter()
-            for uid, rates in user_ratings.items():
-                val = round(metric(rates), 2)
-                dist[val] += 1
+            method = self.parent._histogram_metric(metric)
+            hists = method and self.parent._histograms('user')
+            if hists:
+                order, hists = hists
+                for u in order:
+                    dist[round(method(hists[u]), 2)] += 1
+                return dict(sorted(dist.items()))
+
+            order, groups = self.parent._groups('user')
+            for val in evaluate_metric(metric, [groups[u] for u in order], workers):
+                dist[round(val, 2)] += 1
             return dict(sorted(dist.items()))
             
+        @requires_columns('userId', 'rating')
+        @memoized
         def top_controversial(self, n):
             """Топ пользователей с наибольшей дисперсией оценок."""
-            self.parent._load_data()
-            user_ratings = collections.defaultdict(list)
-            for r in self.parent._ratings:
-                user_ratings[r['userId']].append(r['rating'])
-                
-            calc = []
-            for uid, rates in user_ratings.items():
-                val = round(self.parent.variance(rates), 2)
-                calc.append((uid, val))
-            
+            if self.parent.memory_budget is not None and self.parent._sample is None:
+                return dict(self.parent._external_top('userId', self.parent.variance, n))
+            order, groups = self.parent._groups('user')
+            calc = [(u, round(self.parent.variance(groups[u]), 2)) for u in order]
             calc.sort(key=lambda x: x[1], reverse=True)
-            return dict(calc[:n])
+            return {self.parent.ids.users.decode(u): val for u, val in calc[:n]}
+
+        @memoized
+        def sessions_per_user(self, gap=SESSION_GAP, binge=10):
+            """
+            Сессии пользователей (Ratings.sessions с паузой gap). Dict: userId -> {'sessions': число сессий,
+            'ratings_per_session': среднее число оценок, 'hours_between': средний перерыв между сессиями
+            в часах (None - сессия одна), 'binges': сессии не меньше чем из binge оценок}. По возрастанию userId.
+            """
+            sessions = self.parent.sessions(gap)
+            stats = {}
+            prev_user, prev_end = None, None
+            for u, start, end, count in zip(*sessions):
+                st = stats.get(u)
+                if st is None:
+                    st = stats[u] = [0, 0, 0, 0] # сессии, оценки, сумма перерывов, запои
+                st[0] += 1
+                st[1] += count
+                if u == prev_user:
+                    st[2] += start - prev_end
+                if count >= binge:
+                    st[3] += 1
+                prev_user, prev_end = u, end
+            res = {}
+            for u, (n_sessions, n_ratings, pauses, binges) in stats.items():
+                res[self.parent.ids.users.decode(u)] = {
+                    'sessions': n_sessions,
+                    'ratings_per_session': round(n_ratings / n_sessions, 2),
+                    'hours_between': round(pauses / (n_sessions - 1) / 3600, 2) if n_sessions > 1 else None,
+                    'binges': binges,
+                }
+            return dict(sorted(res.items()))
+
+        @memoized
+        def dist_by_session_length(self, gap=SESSION_GAP):
+            """Распределение сессий по числу оценок. Dict: число оценок -> число сессий. По возрастанию."""
+            return dict(sorted(collections.Counter(self.parent.sessions(gap).count).items()))
+
+        @memoized
+        def most_active_users(self, n, window=None):
+            """
+            Топ-n пользователей по числу оценок; window (секунды или timedelta) - по наибольшему числу
+            оценок за любой интервал такой длины. Dict: userId -> количество. По убыванию.
+            """
+            best = self.parent._peak_activity(window)
+            top = sorted((u for u, c in enumerate(best) if c), key=lambda u: best[u], reverse=True)[:n]
+            return {self.parent.ids.users.decode(u): best[u] for u in top}
+
+        @memoized
+        def distinct_movies(self, user_id):
+            """Оценка числа различных фильмов, оценённых пользователем (HyperLogLog)."""
+            hll = self.parent.sketch().movies_per_user.get(user_id)
+            return hll.count() if hll else 0
+
+        @memoized
+        def similar_users(self, user_id, n, method='cosine'):
+            """Топ-n пользователей, похожих на user_id (cosine/pearson). Dict: userId -> сходство. По убыванию."""
+            neighbours = self.parent.matrix().top_k_neighbours('user', [user_id], n, method)
+            return {uid: round(val, 2) for uid, val in neighbours.get(user_id, [])}
+
+
+# --- Соединение тегов и оценок ---
+
+def hash_join(left, right):
+    """
+    Пары позиций (i, j), где left[i] == right[j]. Хеш-таблица строится по меньшей стороне,
+    большая просматривается один раз. Сторона без len (итератор) всегда просматривается,
+    поэтому её ключи можно отдавать потоком, не собирая в список. Пары отсортированы.
+    """
+    if hasattr(left, '__len__') and hasattr(right, '__len__'):
+        swap = len(left) > len(right)
+    else:
+        swap = not hasattr(left, '__len__')
+    build, probe = (right, left) if swap else (left, right)
+    table = {}
+    for i, key in enumerate(build):
+        matches = table.get(key)
+        if matches is None:
+            table[key] = [i]
+        else:
+            matches.append(i)
+    pairs = []
+    for j, key in enumerate(probe):
+        matches = table.get(key)
+        if matches is not None:
+            pairs.extend((j, i) if swap else (i, j) for i in matches)
+    pairs.sort()
+    return pairs
+
+def merge_join(left, right):
+    """То же, что hash_join, но слиянием: обе стороны сортируются по ключу и проходятся один раз."""
+    lo = sorted(range(len(left)), key=left.__getitem__)
+    ro = sorted(range(len(right)), key=right.__getitem__)
+    pairs = []
+    i = j = 0
+    while i < len(lo) and j < len(ro):
+        a, b = left[lo[i]], right[ro[j]]
+        if a < b:
+            i += 1
+        elif a > b:
+            j += 1
+        else:
+            i_end, j_end = i + 1, j + 1
+            while i_end < len(lo) and left[lo[i_end]] == a:
+                i_end += 1
+            while j_end < len(ro) and right[ro[j_end]] == a:
+                j_end += 1
+            pairs.extend((x, y) for x in lo[i:i_end] for y in ro[j:j_end])
+            i, j = i_end, j_end
+    pairs.sort()
+    return pairs
+
+class TagRatingJoin:
+    """
+    Корреляция тегов и оценок. Обе таблицы соединяются по плотным индексам общего IdDictionary:
+    - on='movie' (movieId): оценки сначала сворачиваются в гистограмму по фильму, поэтому тег
+      получает все оценки своих фильмов без перебора пар тег×оценка;
+    - on='user' ((userId, movieId)): hash_join или merge_join (method) - оценка, которую
+      автор тега поставил этому фильму.
+    Результаты пересчитываются, если Tags или Ratings изменились.
+    """
+    JOINS = {'hash': hash_join, 'merge': merge_join}
+
+    def __init__(self, tags, ratings, method='hash'):
+        if method not in self.JOINS:
+            raise ValueError(f"method должен быть одним из: {', '.join(self.JOINS)}")
+        if tags.ids is not ratings.ids:
+            raise ValueError("Tags и Ratings должны использовать один IdDictionary (параметр ids)")
+        self.tags = tags
+        self.ratings = ratings
+        self.method = method
+        self._state = None
+
+    def _build(self):
+        state = (self.tags._data_version(), self.ratings._data_version())
+        if self._state == state:
+            return
+        self.ratings._require_columns('userId', 'movieId', 'rating')
+        self.tags._require_columns('userId', 'movieId', 'tag')
+        rc = self.ratings.columns()
+        tc = self.tags.columns()
+        # Гистограммы оценок по индексу фильма; order - фильмы в порядке первой оценки
+        self._movie_hist = [None] * len(self.ratings.ids.movies)
+        self._movie_order = []
+        for m, r in zip(rc.movie, rc.rating):
+            hist = self._movie_hist[m]
+            if hist is None:
+                hist = self._movie_hist[m] = collections.Counter()
+                self._movie_order.append(m)
+            hist[r] += 1
+        # Различные фильмы каждого тега (dict как упорядоченное множество)
+        self._tag_movies = {}
+        self._movie_tags = {}
+        for m, tag in zip(tc.movie, tc.tag):
+            self._tag_movies.setdefault(tag, {})[m] = None
+            self._movie_tags.setdefault(m, collections.Counter())[tag] += 1
+        self._pairs = None
+        self._state = state
+
+    def pairs(self):
+        """
+        Пары (позиция тега, позиция оценки) с одинаковыми (userId, movieId).
+        Ключи собираются только для тегов; ключи оценок для hash_join идут потоком по столбцам,
+        merge_join сортирует обе стороны, поэтому ему они передаются компактным array('q').
+        """
+        self._build()
+        if self._pairs is None:
+            rc, tc = self.ratings.columns(), self.tags.columns()
+            n_movies = len(self.ratings.ids.movies)
+            # Пара индексов сворачивается в одно целое - ключ соединения
+            tag_keys = [u * n_movies + m for u, m in zip(tc.user, tc.movie)]
+            rating_keys = (u * n_movies + m for u, m in zip(rc.user, rc.movie))
+            if self.method == 'merge':
+                rating_keys = array('q', rating_keys)
+            self._pairs = self.JOINS[self.method](tag_keys, rating_keys)
+        return self._pairs
+
+    def _tag_hists(self, on):
+        """Dict: тег -> Counter оценок (в порядке первого появления тега)."""
+        self._build()
+        res = {}
+        if on == 'movie':
+            for tag, movies in self._tag_movies.items():
+                hist = collections.Counter()
+                for m in movies:
+                    if self._movie_hist[m] is not None:
+                        hist.update(self._movie_hist[m])
+                if hist:
+                    res[tag] = hist
+        elif on == 'user':
+            tags, rating = self.tags.columns().tag, self.ratings.columns().rating
+            seen = set()
+            for t, r in self.pairs():
+                # Повторы одного тега тем же пользователем не умножают его оценку
+                if (tags[t], r) not in seen:
+                    seen.add((tags[t], r))
+                    res.setdefault(tags[t], collections.Counter())[rating[r]] += 1
+        else:
+            raise ValueError("on должен быть 'movie' или 'user'")
+        return res
+
+    @staticmethod
+    def _average(hist):
+        return math.fsum(v * c for v, c in hist.items()) / sum(hist.values())
+
+    def avg_rating_by_tag(self, n, on='movie', min_ratings=1):
+        """
+        Dict: тег -> средняя оценка (on='movie' - всех оценок фильмов с этим тегом,
+        on='user' - оценок авторов тега). Не меньше min_ratings оценок. По убыванию, 2 знака.
+        """
+        calc = [(tag, round(self._average(hist), 2)) for tag, hist in self._tag_hists(on).items()
+                if sum(hist.values()) >= min_ratings]
+        calc.sort(key=lambda x: x[1], reverse=True)
+        return dict(calc[:n])
+
+    def rating_dist_by_tag(self, tag=None, on='movie'):
+        """Распределение оценок тега {оценка: количество}; без tag - Dict: тег -> распределение."""
+        hists = self._tag_hists(on)
+        if tag is not None:
+            return dict(sorted(hists.get(tag, {}).items()))
+        return {t: dict(sorted(hist.items())) for t, hist in hists.items()}
+
+    def tags_for_top_rated_movies(self, n, min_ratings=1):
+        """
+        Топ-n фильмов по средней оценке и их теги. Dict: название -> список тегов
+        по убыванию частоты (пустой - у фильма нет тегов).
+        """
+        self._build()
+        calc = [(m, round(self._average(self._movie_hist[m]), 2)) for m in self._movie_order
+                if sum(self._movie_hist[m].values()) >= min_ratings]
+        calc.sort(key=lambda x: x[1], reverse=True)
+        res = {}
+        for m, _ in calc[:n]:
+            tags = self._movie_tags.get(m)
+            res[self.ratings._title(m)] = [tag for tag, _ in tags.most_common()] if tags else []
+        return res
+
+
+# --- ЧАСТЬ MARIONTR (Ссылки и скрапинг) ---
+
+# Связанные фильмы в плотном виде: пары индексов (фильм, imdbId), названия по индексу фильма,
+# данные кэша IMDb по индексу imdbId (None - ещё не скрапили)
+LinkColumns = collections.namedtuple('LinkColumns', 'movie imdb titles info')
+
+class ImdbMeta(Record):
+    """Метаданные загрузки записи кэша IMDb (см. Links._fetch_imdb)."""
+    __slots__ = ('fetched', 'status', 'code', 'etag', 'last_modified')
+    FIELDS = ('fetched', 'status', 'code', 'etag', 'last_modified')
+
+class ImdbInfo(Record):
+    """Запись кэша IMDb: поля Links.CACHE_DEFAULTS и '_meta' (ImdbMeta; нет в старом формате кэша)."""
+    __slots__ = ('director', 'budget', 'gross', 'runtime', 'meta')
+    FIELDS = ('Director', 'Budget', 'Cumulative Worldwide Gross', 'Runtime', '_meta')
+    OPTIONAL = ('_meta',)
+
+    @classmethod
+    def from_dict(cls, data, **defaults):
+        info = super().from_dict(data, **defaults)
+        if info.meta is not None and not isinstance(info.meta, ImdbMeta):
+            info.meta = ImdbMeta.from_dict(info.meta)
+        return info
+
+class Links(ParquetMixin, MemoizedMixin):
+    KEY_COLUMNS = ('movieId',)
+
+    # Значения по умолчанию для записи кэша IMDb (поля, которые не удалось получить)
+    CACHE_DEFAULTS = {
+        'Director': None,
+        'Budget': 0,
+        'Cumulative Worldwide Gross': 0,
+        'Runtime': 0
+    }
+
+    # Адрес страницы фильма; {} - imdbId без префикса tt
+    IMDB_URL = "https://www.imdb.com/title/tt{}/"
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+
+    def __init__(self, path_to_the_file, limit=1000, ids=None):
+        self.limit = limit
+        self.ids = ids if ids is not None else IdDictionary()
+        self._columns_cache = None
+        self.links_path = path_to_the_file # Сохраняем путь!
+        self.links_data = read_csv_limited(path_to_the_file, self.limit)
+        
+        self.movie_imdb_map = {row['movieId']: row['imdbId'] for row in self.links_data if 'imdbId' in row}
+        
+        self.cache_file = "imdb_cache.json"
+        # Кэш меняют и сохраняют и фоновые потоки (ImdbRefresher): изменение и запись - под блокировкой
+        self._cache_lock = threading.RLock()
+        self._cache = self._load_cache()
+        self.titles = self._load_titles() # Теперь использует self.links_path
+        
+    def _load_cache(self):
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as f:
+                    return {imdb_id: ImdbInfo.from_dict(entry, **self.CACHE_DEFAULTS)
+                            for imdb_id, entry in json.load(f).items()}
+            except (OSError, ValueError):
+                return {}
+        return {}
+
+    def _save_cache(self):
+        with self._cache_lock:
+            data = json.dumps(self._cache, default=dict) # Record -> словарь
+            # Уникальное имя рядом с кэшем: pid не различает объекты Links одного процесса
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(self.cache_file) or '.',
+                                             prefix=os.path.basename(self.cache_file) + '.',
+                                             suffix='.tmp', delete=False) as f:
+                f.write(data)
+            try:
+                os.replace(f.name, self.cache_file) # атомарная замена, как в MaterializedViews
+            except OSError:
+                os.unlink(f.name)
+                raise
+
+    def _update_cache(self, entries):
+        """Добавляет записи {imdbId: запись} в кэш и сохраняет его."""
+        with self._cache_lock:
+            self._cache.update(entries)
+            self._save_cache()
+        self._invalidate()
+
+    def _data_version(self):
+        return (self._version, id(self._cache), len(self._cache), id(self.movie_imdb_map),
+                len(self.movie_imdb_map), id(self.titles), len(self.titles))
+
+    def reload(self):
+        """Перечитывает links, кэш IMDb и названия; закешированные результаты запросов сбрасываются."""
+        self.links_data = read_csv_limited(self.links_path, self.limit)
+        self.movie_imdb_map = {row['movieId']: row['imdbId'] for row in self.links_data if 'imdbId' in row}
+        self._cache = self._load_cache()
+        self.titles = self._load_titles()
+        self._invalidate()
+
+    def get_ids(self, n):
+        """БОНУС/Помощник: Получает первые n ID фильмов из загруженных данных links."""
+        # контроль в ячейках Jupyter, чтобы разбирать только 'n' фильмов
+        return [row['movieId'] for row in self.links_data[:n]]
+
+    def _load_titles(self):
+        titles = {}
+        if self.links_path is None:
+            return titles
+        base_dir = os.path.dirname(self.links_path)
+        m_path = find_data_file(base_dir, 'movies.csv')
+        
+        if os.path.exists(m_path):
+            data = read_csv_limited(m_path, self.limit)
+            for row in data:
+                titles[int(row['movieId'])] = row['title']
+        return titles
+
+    def _scrape_imdb(self, imdb_id):
+        if imdb_id in self._cache:
+            return self._cache[imdb_id]
+
+        info = self._fetch_imdb(imdb_id)
+        self._update_cache({imdb_id: info})
+        return info
+
+    @classmethod
+    def _parse_imdb(cls, content):
+        """Поля CACHE_DEFAULTS со страницы фильма IMDb (что не нашлось - значения по умолчанию)."""
+        info = dict(cls.CACHE_DEFAULTS)
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
+
+            # --- Стратегия 1: JSON-LD ---
+            json_ld = soup.find('script', type='application/ld+json')
+            if json_ld:
+                try:
+                    data = json.loads(json_ld.string)
+                    if 'director' in data:
+                        d = data['director']
+                        if isinstance(d, list): info['Director'] = d[0].get('name')
+                        elif isinstance(d, dict): info['Director'] = d.get('name')
+                                
+                    if 'duration' in data:
+                        dur = data['duration']
+                        match = re.search(r'PT(?:(\d+)H)?(?:(\d+)M)?', dur)
+                        if match:
+                            h = int(match.group(1) or 0)
+                            m = int(match.group(2) or 0)
+                            info['Runtime'] = h * 60 + m
+                except: pass
+
+            # --- Стратегия 2: Поиск в DOM (режиссёр) ---
+            if not info['Director']:
+                director_label = soup.find(string=re.compile(r"^Director", re.IGNORECASE))
+                if director_label:
+                    parent = director_label.find_parent('li')
+                    if parent:
+                        link = parent.find('a', href=re.compile(r'/name/'))
+                        if link:
+                            info['Director'] = link.get_text().strip()
+
+            # --- Стратегия 3: Текстовые регулярные выражения для бюджета/сборов ---
+            text = soup.get_text()
+            
+            # Бюджет: ищет "Budget" сразу перед валютой ИЛИ "Budget" ... валюта
+            budget_match = re.search(r'Budget.*?([$€£][\d,]+)', text, re.IGNORECASE)
+            if budget_match:
+                raw = budget_match.group(1)
+                info['Budget'] = float(re.sub(r'[^\d.]', '', raw))
+
+            # Сборы: ищем "Gross worldwide" ИЛИ "Cumulative Worldwide Gross"
+            gross_match = re.search(r'(?:Gross worldwide|Cumulative Worldwide Gross).*?([$€£][\d,]+)', text, re.IGNORECASE)
+            if gross_match:
+                raw = gross_match.group(1)
+                info['Cumulative Worldwide Gross'] = float(re.sub(r'[^\d.]', '', raw))
+        except Exception:
+            pass
+        return info
+
+    def _fetch_imdb(self, imdb_id, previous=None, session=None):
+        """
+        Загружает и разбирает страницу IMDb; возвращает запись кэша с метаданными '_meta'
+        (время загрузки, статус 'ok'/'failed', HTTP-код, ETag, Last-Modified).
+        previous - прежняя запись: её ETag/Last-Modified уходят в условном запросе,
+        при 304 и при неудаче прежние данные сохраняются.
+        """
+        meta, content = self._request_imdb(imdb_id, previous, session)
+        info = self._parse_imdb(content) if content is not None else None
+        return self._entry(meta, info, previous)
+
+    def _request_imdb(self, imdb_id, previous=None, session=None):
+        """Сетевая часть _fetch_imdb: (ImdbMeta, страница или None - разбирать нечего)."""
+        old_meta = (previous or {}).get('_meta', {})
+        headers = dict(self.HEADERS)
+        if old_meta.get('etag'):
+            headers['If-None-Match'] = old_meta['etag']
+        if old_meta.get('last_modified'):
+            headers['If-Modified-Since'] = old_meta['last_modified']
+        meta = ImdbMeta(time.time(), 'failed', None, old_meta.get('etag'), old_meta.get('last_modified'))
+
+        content = None
+        try:
+            req = (session or requests).get(self.IMDB_URL.format(imdb_id), headers=headers, timeout=3)
+            meta.code = req.status_code
+            if req.status_code == 304 and previous is not None:
+                meta.status = 'ok'
+            elif req.status_code == 200:
+                content = req.content
+                meta.status = 'ok'
+                meta.etag, meta.last_modified = req.headers.get('ETag'), req.headers.get('Last-Modified')
+        except requests.RequestException:
+            pass
+        return meta, content
+
+    def _entry(self, meta, info, previous):
+        """Запись кэша из разобранной страницы info (None - 304 или неудача) и метаданных."""
+        # Неудачная загрузка не затирает полученные раньше данные
+        info = ImdbInfo.from_dict(info or previous or self.CACHE_DEFAULTS, **self.CACHE_DEFAULTS)
+        info.meta = meta
+        return info
+
+    @classmethod
+    def arrow_schema(cls):
+        _require_arrow()
+        return pa.schema([
+            ('movieId', pa.int32()),
+            ('imdbId', pa.string()), # строка: ведущие нули значимы
+            ('tmdbId', pa.string()),
+            ('title', pa.string()),
+            ('Director', pa.string()),
+            ('Budget', pa.float64()),
+            ('Cumulative Worldwide Gross', pa.float64()),
+            ('Runtime', pa.int32()),
+        ])
+
+    def _to_columns(self):
+        """Строки links.csv вместе с названием и данными кэша IMDb (None - ещё не скрапили)."""
+        cols = {name: [] for name in self.arrow_schema().names}
+        for row in self.links_data:
+            info = self._cache.get(row.get('imdbId'), {})
+            cols['movieId'].append(int(row['movieId']))
+            cols['imdbId'].append(row.get('imdbId'))
+            cols['tmdbId'].append(row.get('tmdbId') or None)
+            cols['title'].append(self.titles.get(int(row['movieId'])))
+            for field in self.CACHE_DEFAULTS:
+                cols[field].append(info.get(field))
+        return cols
+
+    @classmethod
+    def _from_columns(cls, columns, limit=None, ids=None):
+        obj = cls(None, limit=limit, ids=ids)
+        for i, mid in enumerate(columns['movieId']):
+            imdb_id = columns['imdbId'][i]
+            obj.links_data.append({'movieId': str(mid), 'imdbId': imdb_id, 'tmdbId': columns['tmdbId'][i] or ''})
+            if imdb_id is not None:
+                obj.movie_imdb_map[str(mid)] = imdb_id
+            if columns['title'][i] is not None:
+                obj.titles[mid] = columns['title'][i]
+            values = {field: columns[field][i] for field in cls.CACHE_DEFAULTS}
+            if imdb_id is not None and any(v is not None for v in values.values()):
+                obj._cache[imdb_id] = ImdbInfo(*(default if values[f] is None else values[f]
+                                                 for f, default in cls.CACHE_DEFAULTS.items()))
+        return obj
+
+    def _get_title(self, mid):
+        return self.titles.get(int(mid), f"Фильм {mid}")
+
+    def columns(self):
+        """
+        Связанные фильмы в виде плотных столбцов (LinkColumns) по общему словарю self.ids.
+        Строятся один раз на версию данных, поэтому запросы не приводят movieId к int
+        и не ищут название и кэш по словарю для каждого фильма.
+        """
+        version = self._data_version()
+        if self._columns_cache is None or self._columns_cache[0] != version:
+            movies, imdb = self.ids.movies, self.ids.imdb
+            movie_idx, imdb_idx = array('l'), array('l')
+            for mid, imdb_id in self.movie_imdb_map.items():
+                movie_idx.append(movies.encode(int(mid)))
+                imdb_idx.append(imdb.encode(imdb_id))
+            cols = LinkColumns(movie_idx, imdb_idx, [None] * len(movies), [None] * len(imdb))
+            for mid, title in self.titles.items():
+                idx = movies.get(mid)
+                if idx is not None:
+                    cols.titles[idx] = title
+            for imdb_id, info in self._cache.items():
+                idx = imdb.get(imdb_id)
+                if idx is not None:
+                    cols.info[idx] = info
+            self._columns_cache = (version, cols)
+        return self._columns_cache[1]
+
+    def _scraped(self):
+        """(название, данные IMDb) для связанных фильмов, которые есть в кэше."""
+        cols = self.columns()
+        for m, i in zip(cols.movie, cols.imdb):
+            info = cols.info[i]
+            if info is not None:
+                title = cols.titles[m]
+                yield (title if title is not None else f"Фильм {self.ids.movies.decode(m)}"), info
+
+    def show(self, data):
+        return ResultVisualizer(data)
+    
+    def get_imdb(self, list_of_movies, list_of_fields):
+        result = []
+        for mid in list_of_movies:
+            # mid может быть строкой или int из get_ids()
+            if str(mid) in self.movie_imdb_map:
+                imdb_id = self.movie_imdb_map[str(mid)]
+                data = self._scrape_imdb(imdb_id)
+                
+                # Получаем настоящее название с помощью исправленного помощника
+                actual_title = self._get_title(mid)
+                
+                row = [str(mid), actual_title]
+                for field in list_of_fields:
+                    row.append(data.get(field, None))
+                result.append(row)
+        return sorted(result, key=lambda x: int(x[0]), reverse=True)
+        
+    def prefetch_imdb(self, list_of_movies, refresh=False, **options):
+        """
+        Загружает данные IMDb фильмов в кэш конвейером ImdbPipeline (options - его параметры).
+        Фильмы, которые уже есть в кэше, пропускаются, если не refresh. Возвращает статистику конвейера.
+        """
+        ids = [self.movie_imdb_map[str(mid)] for mid in list_of_movies if str(mid) in self.movie_imdb_map]
+        if not refresh:
+            ids = [imdb_id for imdb_id in ids if imdb_id not in self._cache]
+        return ImdbPipeline(self, **options).run(ids)
+
+    @requires_columns('imdbId', 'Director')
+    @memoized
+    def top_directors(self, n):
+        counts = collections.defaultdict(int)
+        for _, info in self._scraped():
+            d = info.get('Director')
+            if d:
+                counts[d] += 1
+        return dict(sorted(counts.items(), key=lambda x: x[1], reverse=True)[:n])
+        
+    @requires_columns('imdbId', 'Budget')
+    @memoized
+    def most_expensive(self, n):
+        budgets = {}
+        for title, info in self._scraped():
+            b = info.get('Budget', 0)
+            if b > 0:
+                budgets[title] = b
+        return dict(sorted(budgets.items(), key=lambda x: x[1], reverse=True)[:n])
+        
+    @requires_columns('imdbId', 'Budget', 'Cumulative Worldwide Gross')
+    @memoized
+    def most_profitable(self, n):
+        profits = {}
+        for title, info in self._scraped():
+            b = info.get('Budget', 0)
+            g = info.get('Cumulative Worldwide Gross', 0)
+            if b > 0 and g > 0:
+                profits[title] = g - b
+        return dict(sorted(profits.items(), key=lambda x: x[1], reverse=True)[:n])
+        
+    @requires_columns('imdbId', 'Runtime')
+    @memoized
+    def longest(self, n):
+        runtimes = {}
+        for title, info in self._scraped():
+            r = info.get('Runtime', 0)
+            if r > 0:
+                runtimes[title] = r
+        return dict(sorted(runtimes.items(), key=lambda x: x[1], reverse=True)[:n])
+        
+    @requires_columns('imdbId', 'Budget', 'Runtime')
+    @memoized
+    def top_cost_per_minute(self, n):
+        cpm = {}
+        for title, info in self._scraped():
+            b = info.get('Budget', 0)
+            r = info.get('Runtime', 0)
+            if b > 0 and r > 0:
+                cpm[title] = round(b / r, 2)
+        return dict(sorted(cpm.items(), key=lambda x: x[1], reverse=True)[:n])
+
+
+class ImdbRefresher:
+    """
+    Обновление устаревших записей кэша IMDb (Links._cache) небольшими партиями, в том числе в фоне.
+    Сначала - неудачные загрузки, затем самые старые записи; записи без метаданных (старый формат)
+    считаются загруженными давно, а записи только из значений по умолчанию - неудачными.
+    За проход - не больше budget запросов, партиями по batch_size с паузой pause; после каждой
+    партии кэш сохраняется. Условные запросы (ETag/Last-Modified) не передают неизменённые страницы.
+    """
+    def __init__(self, links, max_age=7 * 24 * 3600, retry_failed=3600, batch_size=10, budget=100, pause=1.0):
+        self.links = links
+        self.max_age = max_age
+        self.retry_failed = retry_failed
+        self.batch_size = batch_size
+        self.budget = budget
+        self.pause = pause
+        self.stats = collections.Counter()
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _state(self, entry):
+        """(неудачная ли загрузка, время загрузки) записи кэша."""
+        meta = entry.get('_meta')
+        if meta is None:
+            failed = all(entry.get(k) == v for k, v in Links.CACHE_DEFAULTS.items())
+            return failed, 0.0
+        return meta.get('status') != 'ok', meta.get('fetched', 0.0)
+
+    def due(self, now=None):
+        """imdbId записей, которые пора обновить, в порядке приоритета."""
+        now = time.time() if now is None else now
+        queue = []
+        with self.links._cache_lock:
+            entries = list(self.links._cache.items())
+        for imdb_id, entry in entries:
+            failed, fetched = self._state(entry)
+            if now - fetched >= (self.retry_failed if failed else self.max_age):
+                queue.append((not failed, fetched, imdb_id))
+        queue.sort()
+        return [imdb_id for _, _, imdb_id in queue]
+
+    def refresh(self, budget=None):
+        """Один проход обновления; возвращает счётчики этого прохода."""
+        budget = self.budget if budget is None else budget
+        queue = self.due()[:budget]
+        run = collections.Counter()
+        for start in range(0, len(queue), self.batch_size):
+            if start and self._stop.wait(self.pause):
+                break
+            batch = {}
+            for imdb_id in queue[start:start + self.batch_size]:
+                previous = self.links._cache.get(imdb_id)
+                entry = self.links._fetch_imdb(imdb_id, previous, self._session)
+                meta = entry['_meta']
+                run['requests'] += 1
+                if meta['status'] != 'ok':
+                    run['failed'] += 1
+                elif meta['code'] == 304:
+                    run['not_modified'] += 1
+                else:
+                    run['updated'] += 1
+                batch[imdb_id] = entry
+            self.links._update_cache(batch)
+        self.stats.update(run)
+        self.stats['runs'] += 1
+        return run
+
+    def _loop(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                self.stats['errors'] += 1
+            if self._stop.wait(interval):
+                break
+
+    def start(self, interval=3600):
+        """Запускает фоновый поток: проход обновления каждые interval секунд."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name='imdb-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Останавливает фоновый поток (текущая партия завершается)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def _parse_page(parse, content):
+    """Разбор страницы в процессе пула: (данные, время разбора)."""
+    start = time.perf_counter()
+    return parse(content), time.perf_counter() - start
+
+class ImdbPipeline:
+    """
+    Скрапинг IMDb конвейером из трёх стадий, которые работают одновременно:
+    - fetchers потоков загружают страницы (у каждого свой requests.Session) в очередь страниц;
+      потоки, а не asyncio: скрапинг в Links построен на синхронном requests, а загрузка
+      страницы - ожидание сети, при котором поток отпускает GIL;
+    - пул из parsers процессов разбирает их Links._parse_imdb (parsers=0 - разбор в потоке диспетчера);
+    - один поток-писатель кладёт записи в кэш и сохраняет его партиями по batch_size.
+    Очереди ограничены queue_size, а разборов в работе не больше 2 * parsers, поэтому при отставании
+    разбора или записи загрузка ждёт (backpressure) и в памяти - ограниченное число страниц.
+    """
+    def __init__(self, links, fetchers=8, parsers=None, queue_size=32, batch_size=50):
+        self.links = links
+        self.fetchers = fetchers
+        self.parsers = (os.cpu_count() or 1) if parsers is None else parsers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.stats = {}
+
+    def _record(self, stage, busy, items=1):
+        with self._lock:
+            self._stages[stage]['items'] += items
+            self._stages[stage]['busy'] += busy
+
+    def _put(self, name, item):
+        q = self._queues[name]
+        q.put(item)
+        with self._lock:
+            depth = self._depth[name]
+            size = q.qsize()
+            depth['max'] = max(depth['max'], size)
+            depth['total'] += size
+            depth['samples'] += 1
+
+    def _fetch(self, todo):
+        session = requests.Session()
+        try:
+            while True:
+                try:
+                    imdb_id = todo.get_nowait()
+                except queue.Empty:
+                    return
+                with self.links._cache_lock:
+                    previous = self.links._cache.get(imdb_id)
+                start = time.perf_counter()
+                meta, content = self.links._request_imdb(imdb_id, previous, session)
+                self._record('fetch', time.perf_counter() - start)
+                self._put('pages', (imdb_id, previous, meta, content))
+        except BaseException as e:
+            self._errors.append(e)
+        finally:
+            session.close()
+
+    def _parse(self, pool):
+        pages = self._queues['pages']
+        pending = collections.deque()
+        limit = 2 * max(1, self.parsers)
+        parse = type(self.links)._parse_imdb
+
+        def emit(page, future):
+            info, busy = future.result()
+            self._record('parse', busy)
+            self._put('results', (page, info))
+
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    break
+                if page[3] is None: # 304 или неудача: разбирать нечего
+                    self._put('results', (page, None))
+                    continue
+                if pool is None:
+                    info, busy = _parse_page(parse, page[3])
+                    self._record('parse', busy)
+                    self._put('results', (page, info))
+                    continue
+                pending.append((page, pool.submit(_parse_page, parse, page[3])))
+                while len(pending) >= limit or (pending and pending[0][1].done()):
+                    emit(*pending.popleft())
+            while pending:
+                emit(*pending.popleft())
+        except BaseException as e:
+            self._errors.append(e)
+            while pages.get() is not None: # загрузка не должна застрять на полной очереди
+                pass
+        finally:
+            self._queues['results'].put(None)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        self.links._update_cache(batch) # под блокировкой кэша, с атомарной заменой файла
+        self._record('write', time.perf_counter() - start, len(batch))
+        self._stages['write']['batches'] += 1
+
+    def _write(self):
+        results = self._queues['results']
+        batch = {}
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    break
+                (imdb_id, previous, meta, _), info = item
+                entry = self.links._entry(meta, info, previous)
+                if meta.status != 'ok':
+                    self._outcomes['failed'] += 1
+                elif meta.code == 304:
+                    self._outcomes['not_modified'] += 1
+                else:
+                    self._outcomes['updated'] += 1
+                batch[imdb_id] = entry
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = {}
+            if batch:
+                self._flush(batch)
+        except BaseException as e:
+            self._errors.append(e)
+            while results.get() is not None:
+                pass
+
+    def run(self, imdb_ids):
+        """
+        Загружает записи imdb_ids в кэш. Возвращает статистику: по стадиям - число элементов,
+        суммарное время работы и пропускная способность (элементов в секунду за весь прогон),
+        по очередям - ёмкость, максимальная и средняя глубина, а также исходы загрузок.
+        """
+        todo = queue.Queue()
+        for imdb_id in dict.fromkeys(imdb_ids):
+            todo.put(imdb_id)
+        self._lock = threading.Lock()
+        self._queues = {'pages': queue.Queue(self.queue_size), 'results': queue.Queue(self.queue_size)}
+        self._depth = {name: {'max': 0, 'total': 0, 'samples': 0} for name in self._queues}
+        self._stages = {stage: {'items': 0, 'busy': 0.0} for stage in ('fetch', 'parse', 'write')}
+        self._stages['write']['batches'] = 0
+        self._outcomes = collections.Counter()
+        self._errors = []
+
+        start = time.perf_counter()
+        pool = None
+        if self.parsers > 0 and not todo.empty():
+            pool = concurrent.futures.ProcessPoolExecutor(self.parsers)
+            # Пул создаёт процессы лениво, при первой задаче. Пустая задача заставляет сделать fork
+            # сейчас, пока потоков конвейера ещё нет: fork при работающих загрузчиках скопировал бы
+            # в дочерние процессы захваченные ими блокировки (очередей, requests, логирования).
+            pool.submit(int).result()
+        try:
+            fetchers = [threading.Thread(target=self._fetch, args=(todo,), name=f'imdb-fetch-{i}', daemon=True)
+                        for i in range(max(1, min(self.fetchers, todo.qsize())))]
+            parser = threading.Thread(target=self._parse, args=(pool,), name='imdb-parse', daemon=True)
+            writer = threading.Thread(target=self._write, name='imdb-write', daemon=True)
+            for thread in fetchers + [parser, writer]:
+                thread.start()
+            for thread in fetchers:
+                thread.join()
+            self._queues['pages'].put(None)
+            parser.join()
+            writer.join()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.perf_counter() - start
+        if self._errors:
+            raise self._errors[0]
+
+        stages = {}
+        for stage, counters in self._stages.items():
+            stages[stage] = dict(counters, busy=round(counters['busy'], 4),
+                                 per_second=round(counters['items'] / elapsed, 2) if elapsed else 0.0)
+        queues = {name: {'capacity': self.queue_size, 'max': d['max'],
+                         'mean': round(d['total'] / d['samples'], 2) if d['samples'] else 0.0}
+                  for name, d in self._depth.items()}
+        self.stats = {'elapsed': round(elapsed, 4), 'stages': stages, 'queues': queues, **self._outcomes}
+        return self.stats
+
+
+# --- Материализованные представления ---
+
+class MaterializedViews:
+    """
+    Сводки, которые отчёт пересчитывает при каждом запуске, считаются один раз
+    и сохраняются в файл рядом с данными. Файл привязан к отпечаткам входных CSV
+    (размер и время изменения) и лимиту: при изменении входов представления пересобираются.
+    """
+    VERSION = 1
+    INPUTS = ('movies.csv', 'ratings.csv', 'tags.csv')
+
+    def __init__(self, data_dir, limit=1000, path=None):
+        self.data_dir = data_dir
+        self.limit = limit
+        self.path = path or os.path.join(data_dir, 'movielens_views.json')
+        self._views = None
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """Отпечаток входных файлов: {имя: [файл, размер, mtime_ns]} + лимит."""
+        fp = {'version': self.VERSION, 'limit': self.limit}
+        for name in self.INPUTS:
+            full = find_data_file(self.data_dir, name)
+            if os.path.exists(full):
+                st = os.stat(full)
+                fp[name] = [os.path.basename(full), st.st_size, st.st_mtime_ns]
+            else:
+                fp[name] = None
+        return fp
+
+    def _build(self):
+        """Считает все сводки за один проход по загруженным данным."""
+        m_path = find_data_file(self.data_dir, 'movies.csv')
+        r_path = find_data_file(self.data_dir, 'ratings.csv')
+        movies = Movies(m_path, limit=self.limit)
+        ratings = Ratings(r_path, m_path, limit=self.limit)
+
+        movie_stats = {}
+        user_stats = {}
+        for r in ratings._ratings:
+            for table, key in ((movie_stats, r['movieId']), (user_stats, r['userId'])):
+                st = table.setdefault(key, [0, 0.0, 0.0])
+                st[0] += 1
+                st[1] += r['rating']
+                st[2] += r['rating'] ** 2
+
+        # Пары [ключ, значение] вместо объектов JSON сохраняют типы ключей и порядок
+        return {
+            'dist_by_release': list(movies.dist_by_release().items()),
+            'dist_by_genres': list(movies.dist_by_genres().items()),
+            'dist_by_year': list(ratings.movies.dist_by_year().items()),
+            'dist_by_rating': list(ratings.movies.dist_by_rating().items()),
+            'dist_by_num_of_ratings': list(ratings.users.dist_by_num_of_ratings().items()),
+            'movie_stats': [[k] + v for k, v in movie_stats.items()],
+            'user_stats': [[k] + v for k, v in user_stats.items()],
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, stored):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(stored, f)
+        os.replace(tmp, self.path) # атомарная замена: читатели не увидят полузаписанный файл
+
+    def refresh(self, force=False):
+        """Проверяет отпечатки входов; при несовпадении (или force) пересобирает и сохраняет представления."""
+        fp = self.fingerprint()
+        if not force and self._views is not None and fp == self._fingerprint:
+            return False
+        stored = None if force else self._load()
+        rebuilt = stored is None or stored.get('fingerprint') != fp
+        if rebuilt:
+            stored = {'fingerprint': fp, 'views': self._build()}
+            self._save(stored)
+        self._views = stored['views']
+        self._fingerprint = fp
+        return rebuilt
+
+    def _view(self, name):
+        self.refresh()
+        return self._views[name]
+
+    def dist_by_release(self):
+        return dict(self._view('dist_by_release'))
+
+    def dist_by_genres(self):
+        return dict(self._view('dist_by_genres'))
+
+    def dist_by_year(self):
+        return dict(self._view('dist_by_year'))
+
+    def dist_by_rating(self):
+        return dict(self._view('dist_by_rating'))
+
+    def dist_by_num_of_ratings(self):
+        return dict(self._view('dist_by_num_of_ratings'))
+
+    def movie_stats(self):
+        """Dict: movieId -> (количество, сумма, сумма квадратов) оценок."""
+        return {row[0]: tuple(row[1:]) for row in self._view('movie_stats')}
+
+    def user_stats(self):
+        """Dict: userId -> (количество, сумма, сумма квадратов) оценок."""
+        return {row[0]: tuple(row[1:]) for row in self._view('user_stats')}
+
+
+# --- OLAP-куб оценок ---
+
+class RatingCube:
+    """
+    Куб количества оценок: набор жанров фильма × год выпуска × оценка.
+    Жанры хранятся комбинациями (битовые маски), поэтому каждая оценка лежит ровно в одной
+    ячейке и запрос по нескольким жанрам не считает фильм дважды. Суммы оценок следуют из
+    оси оценок, по (комбинация, год) они посчитаны заранее. Результаты запросов кешируются.
+    """
+    VERSION = 1
+    GROUPS = ('genre', 'year', 'decade', 'rating')
+
+    def __init__(self, genres, combos, years, buckets, counts):
+        self.genres = list(genres)   # имя жанра i соответствует биту 1 << i
+        self.combos = list(combos)   # маски жанров
+        self.years = list(years)     # годы выпуска по возрастанию, None (неизвестен) - последним
+        self.buckets = list(buckets) # значения оценок по возрастанию
+        self.counts = counts         # array('q'): [комбинация][год][оценка]
+        self._genre_bit = {g: i for i, g in enumerate(self.genres)}
+        self._year_index = {y: i for i, y in enumerate(self.years)}
+        # Итоги по (комбинация, год): количество и сумма оценок
+        nb = len(self.buckets)
+        self._total_n = array('q', [0]) * (len(self.combos) * len(self.years))
+        self._total_s = array('d', [0.0]) * len(self._total_n)
+        for cell in range(len(self._total_n)):
+            row = counts[cell * nb:(cell + 1) * nb]
+            self._total_n[cell] = sum(row)
+            self._total_s[cell] = math.fsum(v * c for v, c in zip(self.buckets, row))
+        self._cache = {}
+
+    @classmethod
+    def build(cls, movies, ratings):
+        """Строит куб за один проход по оценкам, присоединённым к фильмам по movieId."""
+        movies._require_columns('genres', 'year')
+        ratings._require_columns('movieId', 'rating')
+        info = movies.movies
+        genre_index = {}
+        combo_index = {}
+        masks = {}
+        for mid, movie in info.items():
+            mask = 0
+            for g in movie['genres'].split('|'):
+                if g and g != '(no genres listed)':
+                    mask |= 1 << genre_index.setdefault(g, len(genre_index))
+            masks[mid] = mask
+            combo_index.setdefault(mask, len(combo_index))
+        years = sorted({m['year'] for m in info.values() if m['year'] is not None})
+        if any(m['year'] is None for m in info.values()):
+            years.append(None)
+        year_index = {y: i for i, y in enumerate(years)}
+
+        cols = ratings.columns()
+        buckets = sorted(set(cols.rating))
+        bucket_index = {v: i for i, v in enumerate(buckets)}
+        nb = len(buckets)
+        # Начало строки ячеек для каждого плотного индекса фильма (None - фильма нет в Movies)
+        base = [None] * len(ratings.ids.movies)
+        for idx, mid in enumerate(ratings.ids.movies.keys):
+            movie = info.get(mid)
+            if movie is not None:
+                base[idx] = (combo_index[masks[mid]] * len(years) + year_index[movie['year']]) * nb
+
+        counts = array('q', [0]) * (len(combo_index) * len(years) * nb)
+        for m, r in zip(cols.movie, cols.rating):
+            start = base[m]
+            if start is not None:
+                counts[start + bucket_index[r]] += 1
+        genres = sorted(genre_index, key=genre_index.get)
+        return cls(genres, sorted(combo_index, key=combo_index.get), years, buckets, counts)
+
+    def _combos(self, genres, match):
+        """Индексы комбинаций под фильтр жанров: match='all' (все жанры), 'any' (хотя бы один), 'exact'."""
+        if not genres:
+            return range(len(self.combos))
+        if isinstance(genres, str):
+            genres = [genres]
+        bits = [self._genre_bit.get(g) for g in genres]
+        mask = sum(1 << b for b in bits if b is not None)
+        if match == 'all':
+            if None in bits:
+                return []
+            ok = lambda c: c & mask == mask
+        elif match == 'any':
+            ok = lambda c: c & mask
+        elif match == 'exact':
+            ok = lambda c: c == mask and None not in bits
+        else:
+            raise ValueError("match должен быть 'all', 'any' или 'exact'")
+        return [i for i, c in enumerate(self.combos) if ok(c)]
+
+    def _group_keys(self, by, combo, year, bucket):
+        if by is None:
+            return (None,)
+        if by == 'genre':
+            return [g for g, bit in self._genre_bit.items() if combo & (1 << bit)]
+        if by == 'year':
+            return (year,)
+        if by == 'decade':
+            return (None if year is None else year // 10 * 10,)
+        return (bucket,)
+
+    def aggregate(self, genres=None, match='all', years=None, ratings=None, by=None):
+        """
+        Количество и средняя оценка по ячейкам под фильтрами: genres (см. match),
+        years=(с, по) и ratings=(от, до) - включительно. by=None - {'count', 'mean'},
+        by='genre'|'year'|'decade'|'rating' - Dict: значение -> {'count', 'mean'} по возрастанию
+        (по жанру фильм учитывается в каждом из своих жанров).
+        """
+        if by is not None and by not in self.GROUPS:
+            raise ValueError(f"by должен быть одним из: {', '.join(self.GROUPS)}")
+        key = (tuple([genres] if isinstance(genres, str) else genres or ()), match,
+               tuple(years) if years else None, tuple(ratings) if ratings else None, by)
+        if key not in self._cache:
+            self._cache[key] = self._aggregate(genres, match, years, ratings, by)
+        return copy.deepcopy(self._cache[key])
+
+    def _aggregate(self, genres, match, years, ratings, by):
+        y_lo, y_hi = years or (None, None)
+        year_ids = [i for i, y in enumerate(self.years)
+                    if not years or (y is not None and (y_lo is None or y >= y_lo) and (y_hi is None or y <= y_hi))]
+        r_lo, r_hi = ratings or (None, None)
+        bucket_ids = [i for i, v in enumerate(self.buckets)
+                      if (r_lo is None or v >= r_lo) and (r_hi is None or v <= r_hi)]
+        # Без фильтра по оценке и группировки по ней хватает итогов по (комбинация, год)
+        use_totals = ratings is None and by != 'rating'
+        n_years, nb = len(self.years), len(self.buckets)
+
+        acc = {}
+        for c in self._combos(genres, match):
+            combo = self.combos[c]
+            for y in year_ids:
+                cell = c * n_years + y
+                if use_totals:
+                    if not self._total_n[cell]:
+                        continue
+                    parts = [(None, self._total_n[cell], self._total_s[cell])]
+                else:
+                    parts = [(self.buckets[b], self.counts[cell * nb + b], self.buckets[b] * self.counts[cell * nb + b])
+                             for b in bucket_ids]
+                for bucket, n, total in parts:
+                    if not n:
+                        continue
+                    for k in self._group_keys(by, combo, self.years[y], bucket):
+                        st = acc.setdefault(k, [0, 0.0])
+                        st[0] += n
+                        st[1] += total
+
+        stats = lambda st: {'count': st[0], 'mean': round(st[1] / st[0], 2) if st[0] else 0.0}
+        if by is None:
+            return stats(acc.get(None, [0, 0.0]))
+        return {k: stats(acc[k]) for k in sorted(acc, key=lambda k: (k is None, k))}
+
+    def roll_up(self, by=None):
+        """Свёртка всего куба по измерению by (или общий итог)."""
+        return self.aggregate(by=by)
+
+    def slice(self, genre=None, year=None, rating=None, by=None):
+        """Срез: одно значение измерения (жанр, год выпуска, оценка)."""
+        return self.aggregate(genres=genre, years=(year, year) if year is not None else None,
+                              ratings=(rating, rating) if rating is not None else None, by=by)
+
+    def dice(self, genres=None, match='all', years=None, ratings=None, by=None):
+        """Подкуб: наборы жанров и диапазоны лет и оценок, например dice(['Sci-Fi', 'Horror'], by='decade')."""
+        return self.aggregate(genres, match, years, ratings, by)
+
+    def save(self, path, fingerprint=None):
+        """Файл куба: строка JSON с измерениями, затем счётчики ячеек (int64)."""
+        header = {'version': self.VERSION, 'fingerprint': fingerprint, 'genres': self.genres,
+                  'combos': self.combos, 'years': self.years, 'buckets': self.buckets}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(self.counts.tobytes())
+        os.replace(tmp, path) # атомарная замена, как в MaterializedViews
+        return path
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """Читает куб; None, если файла нет, он повреждён или отпечаток не совпадает."""
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                counts = array('q')
+                counts.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        if header.get('version') != cls.VERSION or (fingerprint is not None and header.get('fingerprint') != fingerprint):
+            return None
+        return cls(header['genres'], header['combos'], header['years'], header['buckets'], counts)
+
+    @classmethod
+    def open(cls, data_dir, limit=1000, path=None):
+        """
+        Куб рядом с данными (movielens_cube.bin): загружается, если отпечатки входных CSV
+        не изменились, иначе строится заново и сохраняется.
+        """
+        path = path or os.path.join(data_dir, 'movielens_cube.bin')
+        fp = MaterializedViews(data_dir, limit).fingerprint()
+        cube = cls.load(path, fp)
+        if cube is None:
+            m_path = find_data_file(data_dir, 'movies.csv')
+            ids = IdDictionary()
+            cube = cls.build(Movies(m_path, limit=limit, ids=ids),
+                             Ratings(find_data_file(data_dir, 'ratings.csv'), m_path, limit=limit, ids=ids))
+            cube.save(path, fp)
+        return cube
+
+
+# --- Шардированное выполнение (map-reduce) ---
+
+def partition_csv(path, out_dir, n_shards, key='userId', limit=None):
+    """
+    Делит файл оценок на n_shards CSV по хешу столбца key (userId или movieId).
+    К каждой строке дописывается столбец row - номер строки в исходном файле,
+    по нему координатор восстанавливает порядок, как при обработке на одном узле.
+    Возвращает пути шардов.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = [os.path.join(out_dir, f"shard-{i:03d}.csv") for i in range(n_shards)]
+    files = [open(p, 'w', encoding='utf-8') for p in paths]
+    try:
+        header = None
+        for i, row in enumerate(iter_csv_rows(path, limit)):
+            if header is None:
+                header = list(row)
+                for f in files:
+                    f.write(','.join(header + ['row']) + '\n')
+            f = files[_hash64(int(row[key])) % n_shards]
+            f.write(','.join([row[name] for name in header] + [str(i)]) + '\n')
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+class RatingsShard:
+    """
+    Шард оценок на рабочем узле: считает частичные агрегаты, которые объединяются сложением.
+    Ключ порядка группы - номер первой строки (или (timestamp, номер) для интервала),
+    чтобы при равных значениях порядок совпадал с Ratings.
+    """
+    def __init__(self, path):
+        rows = list(iter_csv_rows(path, None))
+        self.ratings = Ratings(None, None, limit=None, ids=IdDictionary())
+        self.ratings.append(rows)
+        self.row = array('q', [int(r['row']) for r in rows])
+
+    def _positions(self, since=None, until=None):
+        if since is None and until is None:
+            return range(len(self.row))
+        return self.ratings.time_index().select(since, until)
+
+    def counts(self, key, since=None, until=None):
+        """Counter по году (key='year') или оценке (key='rating') за интервал."""
+        c = collections.Counter()
+        for pos in self._positions(since, until):
+            r = self.ratings._ratings[pos]
+            c[datetime.datetime.fromtimestamp(r['timestamp']).year if key == 'year' else r['rating']] += 1
+        return c
+
+    def groups(self, axis, since=None, until=None):
+        """Dict: movieId/userId -> [ключ порядка, Counter оценок]."""
+        windowed = since is not None or until is not None
+        res = {}
+        for pos in self._positions(since, until):
+            r = self.ratings._ratings[pos]
+            order = (r['timestamp'], self.row[pos]) if windowed else self.row[pos]
+            group = res.get(r[axis])
+            if group is None:
+                group = res[r[axis]] = [order, collections.Counter()]
+            elif order < group[0]:
+                group[0] = order
+            group[1][r['rating']] += 1
+        return res
 
+def _serve_shard_connection(conn, path):
+    """Цикл рабочего узла: ('имя_метода', kwargs) -> результат; None - завершение."""
+    shard = RatingsShard(path)
+    conn.send(('ready', len(shard.row)))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        name, kwargs = request
+        try:
+            conn.send(('ok', getattr(shard, name)(**kwargs)))
+        except Exception as e:
+            conn.send(('error', e))
+    conn.close()
 
-# --- ЧАСТЬ MARIONTR (Ссылки и скрапинг) ---
+def serve_shard(path, address, authkey):
+    """
+    Рабочий узел на отдельном хосте: слушает address (host, port) и обслуживает
+    одного координатора (ShardedRatings.connect) по протоколу multiprocessing.connection.
+    """
+    with multiprocessing.connection.Listener(address, authkey=authkey) as listener:
+        with listener.accept() as conn:
+            _serve_shard_connection(conn, path)
 
-class Links:
-    def __init__(self, path_to_the_file, limit=1000):
-        self.limit = limit
-        self.links_path = path_to_the_file # Сохраняем путь!
-        self.links_data = read_csv_limited(path_to_the_file, self.limit)
-        
-        self.movie_imdb_map = {row['movieId']: row['imdbId'] for row in self.links_data if 'imdbId' in row}
-        
-        self.cache_file = "imdb_cache.json"
-        self._cache = self._load_cache()
-        self.titles = self._load_titles() # Теперь использует self.links_path
-        
-    def _load_cache(self):
-        if os.path.exists(self.cache_file):
+class ShardedRatings(MemoizedMixin):
+    """
+    Координатор map-reduce: запросы Ratings.Movies и Ratings.Users по шардам файла оценок.
+    Каждый шард обрабатывает свой рабочий процесс (или хост), координатор складывает
+    частичные агрегаты (гистограммы оценок на ключ) и применяет метрику.
+    Шарды не меняются после запуска, поэтому результаты запросов кешируются (@memoized).
+    Результаты совпадают с Ratings на одном узле (метрики - симметричные функции оценок).
+    Поддерживаются: dist_by_year, dist_by_rating, top_by_num_of_ratings, top_by_ratings,
+    top_controversial, Users.dist_by_num_of_ratings, Users.dist_by_ratings, Users.top_controversial.
+    """
+    def __init__(self, connections, path_to_movies_file=None, limit=1000, processes=(), work_dir=None):
+        self.connections = list(connections)
+        self.processes = list(processes)
+        self._work_dir = work_dir
+        self.sizes = [self._receive(conn) for conn in self.connections]
+        # Названия фильмов читаются так же, как в Ratings на одном узле
+        self._movies_map = Ratings(None, path_to_movies_file, limit=limit, ids=IdDictionary())._movies_map
+
+        self.movies = self.Movies(self)
+        self.users = self.Users(self)
+
+    @classmethod
+    def local(cls, path_to_the_file, path_to_movies_file="movies.csv", n_shards=2, key='userId', limit=1000,
+              start_method=None):
+        """
+        Делит файл на шарды во временном каталоге и запускает по рабочему процессу на шард.
+        start_method - способ запуска процессов (по умолчанию fork, где он есть, иначе spawn).
+        """
+        methods = multiprocessing.get_all_start_methods()
+        if start_method is None:
+            start_method = 'fork' if 'fork' in methods else 'spawn'
+        elif start_method not in methods:
+            raise ValueError(f"start_method {start_method!r} недоступен, доступны: {', '.join(methods)}")
+        ctx = multiprocessing.get_context(start_method)
+        work_dir = tempfile.TemporaryDirectory(prefix='movielens-shards-')
+        paths = partition_csv(path_to_the_file, work_dir.name, n_shards, key, limit)
+        connections, processes = [], []
+        for path in paths:
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_serve_shard_connection, args=(child_conn, path), daemon=True)
+            proc.start()
+            child_conn.close()
+            connections.append(parent_conn)
+            processes.append(proc)
+        return cls(connections, path_to_movies_file, limit, processes, work_dir)
+
+    @classmethod
+    def connect(cls, addresses, authkey, path_to_movies_file="movies.csv", limit=1000):
+        """Подключается к рабочим узлам serve_shard по адресам (host, port)."""
+        connections = [multiprocessing.connection.Client(address, authkey=authkey) for address in addresses]
+        return cls(connections, path_to_movies_file, limit)
+
+    def close(self):
+        for conn in self.connections:
             try:
-                with open(self.cache_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for proc in self.processes:
+            proc.join(5)
+        if self._work_dir is not None:
+            self._work_dir.cleanup()
+        self.connections, self.processes, self._work_dir = [], [], None
 
-    def _save_cache(self):
-        with open(self.cache_file, 'w') as f:
-            json.dump(self._cache, f)
+    def __enter__(self):
+        return self
 
-    def get_ids(self, n):
-        """БОНУС/Помощник: Получает первые n ID фильмов из загруженных данных links."""
-        # контроль в ячейках Jupyter, чтобы разбирать только 'n' фильмов
-        return [row['movieId'] for row in self.links_data[:n]]
+    def __exit__(self, *exc):
+        self.close()
 
-    def _load_titles(self):
-        titles = {}
-        base_dir = os.path.dirname(self.links_path)
-        m_path = os.path.join(base_dir, 'movies.csv')
-        
-        if os.path.exists(m_path):
-            data = read_csv_limited(m_path, self.limit)
-            for row in data:
-                titles[int(row['movieId'])] = row['title']
-        return titles
+    @staticmethod
+    def _receive(conn):
+        status, value = conn.recv()
+        if status == 'error':
+            raise value
+        return value
 
-    def _scrape_imdb(self, imdb_id):
-        if imdb_id in self._cache:
-            return self._cache[imdb_id]
+    def _map(self, name, **kwargs):
+        """Рассылает запрос всем шардам сразу, затем собирает ответы: шарды считают параллельно."""
+        for conn in self.connections:
+            conn.send((name, kwargs))
+        return [self._receive(conn) for conn in self.connections]
 
-        url = f"https://www.imdb.com/title/tt{imdb_id}/"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        info = {
-            'Director': None,
-            'Budget': 0,
-            'Cumulative Worldwide Gross': 0,
-            'Runtime': 0
-        }
+    def _counts(self, key, since=None, until=None):
+        total = collections.Counter()
+        for part in self._map('counts', key=key, since=since, until=until):
+            total.update(part)
+        return dict(sorted(total.items()))
 
-        try:
-            req = requests.get(url, headers=headers, timeout=3)
-            if req.status_code == 200:
-                soup = BeautifulSoup(req.content, 'html.parser')
+    def _groups(self, axis, since=None, until=None):
+        """Объединённые группы: список (id, гистограмма оценок) в порядке, как у Ratings."""
+        merged = {}
+        for part in self._map('groups', axis=axis, since=since, until=until):
+            for key, (order, hist) in part.items():
+                group = merged.get(key)
+                if group is None:
+                    merged[key] = [order, hist]
+                else:
+                    group[0] = min(group[0], order)
+                    group[1].update(hist)
+        return [(key, group[1]) for key, group in sorted(merged.items(), key=lambda x: x[1][0])]
 
-                # --- Стратегия 1: JSON-LD ---
-                json_ld = soup.find('script', type='application/ld+json')
-                if json_ld:
-                    try:
-                        data = json.loads(json_ld.string)
-                        if 'director' in data:
-                            d = data['director']
-                            if isinstance(d, list): info['Director'] = d[0].get('name')
-                            elif isinstance(d, dict): info['Director'] = d.get('name')
-                                    
-                        if 'duration' in data:
-                            dur = data['duration']
-                            match = re.search(r'PT(?:(\d+)H)?(?:(\d+)M)?', dur)
-                            if match:
-                                h = int(match.group(1) or 0)
-                                m = int(match.group(2) or 0)
-                                info['Runtime'] = h * 60 + m
-                    except: pass
-
-                # --- Стратегия 2: Поиск в DOM (режиссёр) ---
-                if not info['Director']:
-                    director_label = soup.find(string=re.compile(r"^Director", re.IGNORECASE))
-                    if director_label:
-                        parent = director_label.find_parent('li')
-                        if parent:
-                            link = parent.find('a', href=re.compile(r'/name/'))
-                            if link:
-                                info['Director'] = link.get_text().strip()
-
-                # --- Стратегия 3: Текстовые регулярные выражения для бюджета/сборов ---
-                text = soup.get_text()
-                
-                # Бюджет: ищет "Budget" сразу перед валютой ИЛИ "Budget" ... валюта
-                budget_match = re.search(r'Budget.*?([$€£][\d,]+)', text, re.IGNORECASE)
-                if budget_match:
-                    raw = budget_match.group(1)
-                    info['Budget'] = float(re.sub(r'[^\d.]', '', raw))
-
-                # Сборы: ищем "Gross worldwide" ИЛИ "Cumulative Worldwide Gross"
-                gross_match = re.search(r'(?:Gross worldwide|Cumulative Worldwide Gross).*?([$€£][\d,]+)', text, re.IGNORECASE)
-                if gross_match:
-                    raw = gross_match.group(1)
-                    info['Cumulative Worldwide Gross'] = float(re.sub(r'[^\d.]', '', raw))
+    @staticmethod
+    def _apply(metric, hist):
+        """
+        metric по объединённому Counter оценок. Среднее, медиана и дисперсия считаются
+        по RatingHistogram за O(10), без списка оценок; прочие метрики и оценки вне шкалы -
+        по восстановленному списку.
+        """
+        method = Ratings._histogram_metric(metric)
+        if method is None and metric is Ratings.variance:
+            method = RatingHistogram.variance
+        if method is not None:
+            counts = [0] * len(RATING_SCALE)
+            for rating, c in hist.items():
+                code = rating_code(rating)
+                if code is None:
+                    break
+                counts[code] += c
+            else:
+                return method(RatingHistogram(counts))
+        return metric(sorted(hist.elements()))
 
-        except Exception:
-            pass 
-        
-        self._cache[imdb_id] = info
-        self._save_cache()
-        return info
+    def _title(self, mid):
+        return self._movies_map.get(mid, str(mid))
 
-    def _get_title(self, mid):
-        return self.titles.get(int(mid), f"Фильм {mid}")
+    class Movies:
+        def __init__(self, parent):
+            self.parent = parent
 
-    def show(self, data):
-        return ResultVisualizer(data)
-    
-    def get_imdb(self, list_of_movies, list_of_fields):
-        result = []
-        for mid in list_of_movies:
-            # mid может быть строкой или int из get_ids()
-            if str(mid) in self.movie_imdb_map:
-                imdb_id = self.movie_imdb_map[str(mid)]
-                data = self._scrape_imdb(imdb_id)
-                
-                # Получаем настоящее название с помощью исправленного помощника
-                actual_title = self._get_title(mid)
-                
-                row = [str(mid), actual_title]
-                for field in list_of_fields:
-                    row.append(data.get(field, None))
-                result.append(row)
-        return sorted(result, key=lambda x: int(x[0]), reverse=True)
-        
-    def top_directors(self, n):
-        counts = collections.defaultdict(int)
-        for mid, imdb_id in self.movie_imdb_map.items():
-            if imdb_id in self._cache:
-                d = self._cache[imdb_id].get('Director')
-                if d:
-                    counts[d] += 1
-        return dict(sorted(counts.items(), key=lambda x: x[1], reverse=True)[:n])
-        
-    def most_expensive(self, n):
-        budgets = {}
-        for mid, imdb_id in self.movie_imdb_map.items():
-            if imdb_id in self._cache:
-                b = self._cache[imdb_id].get('Budget', 0)
-                if b > 0:
-                    budgets[self._get_title(mid)] = b
-        return dict(sorted(budgets.items(), key=lambda x: x[1], reverse=True)[:n])
-        
-    def most_profitable(self, n):
-        profits = {}
-        for mid, imdb_id in self.movie_imdb_map.items():
-            if imdb_id in self._cache:
-                b = self._cache[imdb_id].get('Budget', 0)
-                g = self._cache[imdb_id].get('Cumulative Worldwide Gross', 0)
-                if b > 0 and g > 0:
-                    profits[self._get_title(mid)] = g - b
-        return dict(sorted(profits.items(), key=lambda x: x[1], reverse=True)[:n])
-        
-    def longest(self, n):
-        runtimes = {}
-        for mid, imdb_id in self.movie_imdb_map.items():
-            if imdb_id in self._cache:
-                r = self._cache[imdb_id].get('Runtime', 0)
-                if r > 0:
-                    runtimes[self._get_title(mid)] = r
-        return dict(sorted(runtimes.items(), key=lambda x: x[1], reverse=True)[:n])
-        
-    def top_cost_per_minute(self, n):
-        cpm = {}
-        for mid, imdb_id in self.movie_imdb_map.items():
-            if imdb_id in self._cache:
-                b = self._cache[imdb_id].get('Budget', 0)
-                r = self._cache[imdb_id].get('Runtime', 0)
-                if b > 0 and r > 0:
-                    val = round(b / r, 2)
-                    cpm[self._get_title(mid)] = val
-        return dict(sorted(cpm.items(), key=lambda x: x[1], reverse=True)[:n])
+        @memoized
+        def dist_by_year(self):
+            return self.parent._counts('year')
+
+        @memoized
+        def dist_by_rating(self, since=None, until=None):
+            return self.parent._counts('rating', since, until)
+
+        @memoized
+        def top_by_num_of_ratings(self, n, since=None, until=None):
+            groups = self.parent._groups('movieId', since, until)
+            top = sorted(groups, key=lambda x: sum(x[1].values()), reverse=True)[:n]
+            return {self.parent._title(mid): sum(hist.values()) for mid, hist in top}
+
+        @memoized
+        def top_by_ratings(self, n, metric=None, since=None, until=None):
+            if metric is None: metric = Ratings.average
+            calc = [(mid, round(self.parent._apply(metric, hist), 2))
+                    for mid, hist in self.parent._groups('movieId', since, until)]
+            calc.sort(key=lambda x: x[1], reverse=True)
+            return {self.parent._title(mid): val for mid, val in calc[:n]}
+
+        @memoized
+        def top_controversial(self, n):
+            calc = [(mid, round(self.parent._apply(Ratings.variance, hist), 2))
+                    for mid, hist in self.parent._groups('movieId')]
+            calc.sort(key=lambda x: x[1], reverse=True)
+            return {self.parent._title(mid): val for mid, val in calc[:n]}
+
+    class Users:
+        def __init__(self, parent):
+            self.parent = parent
+
+        @memoized
+        def dist_by_num_of_ratings(self):
+            dist = collections.Counter(sum(hist.values()) for _, hist in self.parent._groups('userId'))
+            return dict(sorted(dist.items()))
+
+        @memoized
+        def dist_by_ratings(self, metric=None):
+            if metric is None: metric = Ratings.average
+            dist = collections.Counter(round(self.parent._apply(metric, hist), 2)
+                                       for _, hist in self.parent._groups('userId'))
+            return dict(sorted(dist.items()))
+
+        @memoized
+        def top_controversial(self, n):
+            calc = [(uid, round(self.parent._apply(Ratings.variance, hist), 2))
+                    for uid, hist in self.parent._groups('userId')]
+            calc.sort(key=lambda x: x[1], reverse=True)
+            return dict(calc[:n])
 
 
 # ==========================================
@@ -849,6 +4097,678 @@ class Tests:
         # Пользователь 2 оценил 1:5.0, 2:3.0, 3:2.0 -> имеет дисперсию
         assert 2 in uvar
 
+    def test_rating_histograms(self, tmp_path):
+        rnd = random.Random(7)
+        for size in (1, 2, 5, 10, 101):
+            values = [rnd.choice(RATING_SCALE) for _ in range(size)]
+            hist = RatingHistogram.from_values(values)
+            assert len(hist) == size
+            assert hist.median() == Ratings.median(values)
+            assert hist.mean() == Ratings.average(values)
+            assert abs(hist.variance() - Ratings.variance(values)) < 1e-12
+            assert hist.quantile(0) == min(values) and hist.quantile(1) == max(values)
+            assert hist.mode() == max(sorted(set(values)), key=values.count)
+        assert RatingHistogram.from_values([1.0, 2.0, 3.0, 5.0]).quantile(0.25) == 1.75
+        with pytest.raises(ValueError):
+            RatingHistogram.from_values([3.3])
+
+        m, r_file, _, _ = Tests._create_dummy_csvs(tmp_path)
+        ratings = Ratings(r_file, m)
+        assert ratings.columns().code is not None
+        expected = {'Long Title Movie (2020)': 5.0, 'Toy Story (1995)': 4.0, 'Grumpier Old Men (1995)': 3.0}
+        assert ratings.movies.top_by_ratings(3, metric=Ratings.median) == expected
+        assert ratings.movies.top_by_ratings(3, metric=lambda v: Ratings.median(v)) == expected
+        assert ratings.movies.dist_by_rating() == {2.0: 1, 3.0: 1, 4.0: 3, 5.0: 2}
+        by_median = ratings.users.dist_by_ratings(metric=Ratings.median)
+
+        # Оценка вне шкалы - тот же результат через сортировку оценок
+        ratings.append([{'userId': 9, 'movieId': 99, 'rating': 0.1, 'timestamp': 978300760}])
+        assert ratings.columns().code is None
+        assert ratings.movies.top_by_ratings(3, metric=Ratings.median) == expected
+        assert ratings.users.dist_by_ratings(metric=Ratings.median) == dict(sorted({**by_median, 0.1: 1}.items()))
+
+    @staticmethod
+    def _trimmed_mean(values):
+        s = sorted(values)
+        return Ratings.average(s[1:-1] if len(s) > 2 else s)
+
+    @staticmethod
+    def _worker_pid(values):
+        return os.getpid()
+
+    def test_parallel_metrics(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(os, 'cpu_count', lambda: 2) # пул и на машине с одним процессором
+        rnd = random.Random(3)
+        groups = [[rnd.choice(RATING_SCALE) for _ in range(rnd.randint(1, 20))] for _ in range(50)]
+        serial = [Tests._trimmed_mean(g) for g in groups]
+        assert evaluate_metric(Tests._trimmed_mean, groups, workers=2, batch_size=8) == serial
+        pids = set(evaluate_metric(Tests._worker_pid, groups, workers=2, batch_size=8))
+        assert os.getpid() not in pids
+        # Число процессов ограничено числом процессоров, каким бы ни был workers
+        assert len(set(evaluate_metric(Tests._worker_pid, groups, workers=500, batch_size=1))) <= 2
+        # Лямбда не сериализуется - последовательный запасной путь в этом процессе
+        assert set(evaluate_metric(lambda g: os.getpid(), groups, workers=2, batch_size=8)) == {os.getpid()}
+
+        # Векторная метрика: один вызов на пакет, группы - массивы
+        calls = []
+
+        @vectorized_metric
+        def spread(arrays):
+            calls.append(len(arrays))
+            return [max(a) - min(a) for a in arrays]
+        assert evaluate_metric(spread, groups, batch_size=16) == [max(g) - min(g) for g in groups]
+        assert calls == [16, 16, 16, 2]
+        with pytest.raises(ValueError):
+            evaluate_metric(vectorized_metric(lambda arrays: [0.0]), groups)
+
+        m, r_file, _, _ = Tests._create_dummy_csvs(tmp_path)
+        ratings = Ratings(r_file, m)
+        assert ratings.movies.top_by_ratings(3, metric=Tests._trimmed_mean, workers=2) == \
+            ratings.movies.top_by_ratings(3, metric=lambda v: Tests._trimmed_mean(v))
+        assert ratings.users.dist_by_ratings(metric=spread, workers=2) == \
+            ratings.users.dist_by_ratings(metric=lambda v: max(v) - min(v))
+
+    def test_compact_records(self, tmp_path):
+        m_file, _, _, l_file = Tests._create_dummy_csvs(tmp_path)
+        movies = Movies(m_file)
+        rec = movies.movies[1]
+        assert isinstance(rec, MovieRecord)
+        assert rec == {'title': 'Toy Story (1995)', 'genres': 'Adventure|Animation|Children', 'year': 1995}
+        assert rec['year'] == rec.year == 1995 and rec.get('rating') is None
+        assert pickle.loads(pickle.dumps(rec)) == rec
+        assert sys.getsizeof(rec) < sys.getsizeof(dict(rec))
+        assert '<th>Title</th>' in movies.show(movies.movies)._repr_html_()
+
+        links = Links(l_file)
+        links.cache_file = str(tmp_path / "imdb_cache.json")
+        links._cache = {'0114709': ImdbInfo('John Lasseter', 30000000.0, 0, 81,
+                                            ImdbMeta(1.0, 'ok', 200, '"v1"', None)),
+                        '0113497': ImdbInfo('Joe Johnston', 0, 0, 104)}
+        assert '_meta' not in links._cache['0113497'] and links._cache['0113497'].get('_meta') is None
+        links._save_cache()
+        loaded = links._load_cache()
+        assert loaded == links._cache
+        # Два объекта одного процесса сохраняют кэш одновременно: временные файлы не пересекаются
+        other = Links(l_file)
+        other.cache_file, other._cache = links.cache_file, dict(links._cache)
+        threads = [threading.Thread(target=obj._save_cache) for obj in (links, other) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert links._load_cache() == links._cache
+        assert os.listdir(tmp_path).count('imdb_cache.json') == 1
+        assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+        assert isinstance(loaded['0114709'].meta, ImdbMeta) and loaded['0114709']['_meta']['etag'] == '"v1"'
+        assert links.longest(1) == {'Jumanji (1995)': 104}
+
+    def test_user_sessions(self, tmp_path, monkeypatch):
+        m, r_file, _, _ = Tests._create_dummy_csvs(tmp_path)
+        ts = 964982703
+        rows = [{'userId': 7, 'movieId': 1, 'rating': 4.0, 'timestamp': ts + k}
+                for k in (20060, 0, 600, 10000, 1200, 20000)]
+        results = []
+        for numpy in (np, None): # векторный путь и запасной на чистом Python
+            monkeypatch.setitem(globals(), 'np', numpy)
+            ratings = Ratings(r_file, m, ids=IdDictionary())
+            ratings.append(rows)
+            assert ratings.sessions().count == [2, 3, 2, 3, 1, 2]
+            per_user = ratings.users.sessions_per_user(binge=3)
+            assert per_user[7] == {'sessions': 3, 'ratings_per_session': 2.0, 'hours_between': 2.61, 'binges': 1}
+            assert per_user[1]['hours_between'] is None
+            assert ratings.users.dist_by_session_length() == {1: 1, 2: 3, 3: 2}
+            assert ratings.users.dist_by_session_length(gap=datetime.timedelta(hours=3)) == {2: 2, 3: 1, 6: 1}
+            assert ratings.users.most_active_users(2) == {7: 6, 2: 3}
+            assert ratings.users.most_active_users(2, window=3600) == {2: 3, 7: 3}
+            # Интервал полуоткрытый: оценки через ровно 60 секунд в одно окно не попадают
+            assert ratings.users.most_active_users(1, window=60) == {1: 1}
+            results.append(ratings.users.most_active_users(5, window=datetime.timedelta(minutes=1)))
+        assert results[0] == results[1]
+
+    def test_time_windows(self, tmp_path):
+        m, r_file, t_file, _ = Tests._create_dummy_csvs(tmp_path)
+        ratings = Ratings(r_file, m)
+        ts = 964982703
+
+        # [since, until) захватывает 3-ю, 4-ю и 5-ю оценки (все от пользователя 2)
+        assert ratings.movies.dist_by_rating(since=ts+200, until=ts+500) == {2.0: 1, 3.0: 1, 5.0: 1}
+        assert ratings.movies.dist_by_rating() == ratings.movies.dist_by_rating(since=0)
+        top = ratings.movies.top_by_num_of_ratings(5, since=ts+500)
+        assert top == {'Toy Story (1995)': 1, 'Long Title Movie (2020)': 1}
+        top_avg = ratings.movies.top_by_ratings(1, since=ts+200, until=ts+300)
+        assert top_avg == {'Toy Story (1995)': 5.0}
+        assert ratings.movies.top_by_num_of_ratings(5, since='2030-01-01') == {}
+
+        # Тумблинг-окна покрывают все оценки ровно один раз
+        trend = ratings.movies.rating_trend(window_days=1, step_days=1)
+        assert sum(v['count'] for v in trend.values()) == 7
+        assert all(isinstance(k, datetime.date) for k in trend)
+        assert ratings.movies.rating_trend(since=ts+200, until=ts+201)[datetime.datetime.fromtimestamp(ts+200).date()] == {'count': 1, 'average': 5.0}
+
+        tags = Tags(t_file)
+        assert tags.most_popular(5, until=1445715000) == {'pixar': 2}
+        assert set(tags.most_popular(5, since=1445715100)) == {'very scary', 'animals'}
+
+    def test_compressed_inputs(self, tmp_path):
+        m, r_file, t_file, l_file = Tests._create_dummy_csvs(tmp_path)
+        plain_movies = Movies(m).movies
+        plain_tags = Tags(t_file).rows
+        plain_ratings = Ratings(r_file, m)._ratings
+
+        codecs = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+        if zstandard is not None:
+            codecs['.zst'] = lambda path, mode: zstandard.open(path, mode)
+        for suffix, opener in codecs.items():
+            packed_dir = tmp_path / suffix.strip('.')
+            packed_dir.mkdir()
+            for src in (m, r_file, t_file, l_file):
+                with open(src, 'rb') as f_in, opener(str(packed_dir / (os.path.basename(src) + suffix)), 'wb') as f_out:
+                    f_out.write(f_in.read())
+
+            d = str(packed_dir)
+            # Соседние ratings/tags/movies находятся по сжатому расширению
+            assert Movies(os.path.join(d, 'movies.csv' + suffix)).movies == plain_movies
+            assert Tags(os.path.join(d, 'tags.csv' + suffix)).rows == plain_tags
+            assert Ratings(os.path.join(d, 'ratings.csv' + suffix), os.path.join(d, 'movies.csv' + suffix))._ratings == plain_ratings
+            links = Links(os.path.join(d, 'links.csv' + suffix))
+            assert links.movie_imdb_map['1'] == '0114709'
+            assert links.titles[1] == 'Toy Story (1995)'
+            assert len(read_csv_limited(os.path.join(d, 'ratings.csv' + suffix), limit=2)) == 2
+            assert len(read_csv_limited(os.path.join(d, 'ratings.csv' + suffix), limit=None)) == 7
+
+    @pytest.mark.skipif(pa is None, reason="нужен pyarrow")
+    def test_parquet_roundtrip(self, tmp_path):
+        m, r_file, t_file, _ = Tests._create_dummy_csvs(tmp_path)
+        movies = Movies(m)
+        tags = Tags(t_file)
+        ratings = Ratings(r_file, m)
+
+        assert movies.to_arrow().schema == Movies.arrow_schema()
+        assert Movies.from_parquet(movies.to_parquet(str(tmp_path / 'movies.parquet'))).movies == movies.movies
+        assert Tags.from_parquet(tags.to_parquet(str(tmp_path / 'tags.parquet'))).most_popular(5) == tags.most_popular(5)
+
+        r_pq = ratings.to_parquet(str(tmp_path / 'ratings.parquet'), row_group_size=2)
+        loaded = Ratings.from_parquet(r_pq, path_to_movies_file=m)
+        assert sorted(loaded._ratings, key=lambda r: r['timestamp']) == ratings._ratings
+        assert loaded.movies.top_by_num_of_ratings(3) == ratings.movies.top_by_num_of_ratings(3)
+
+        # Фильтр по времени: статистика групп строк отсекает лишние группы
+        ts = 964982703
+        window = Ratings.from_parquet(r_pq, since=ts+200, until=ts+500)
+        assert [r['timestamp'] for r in window._ratings] == [ts+200, ts+300, ts+400]
+        assert pq.ParquetFile(r_pq).metadata.num_row_groups == 4
+        by_movie = Ratings.from_parquet(r_pq, movie_ids=(2, 3), columns=['movieId', 'rating'])
+        assert sorted(r['movieId'] for r in by_movie._ratings) == [2, 3, 3]
+        # Непрочитанные колонки не подменяются заглушками: методы, которым они нужны, падают явно
+        assert by_movie.movies.top_by_num_of_ratings(1) == {'3': 2}
+        movie_only = Ratings.from_parquet(r_pq, path_to_movies_file=m, columns=['movieId'])
+        assert movie_only.movies.top_by_num_of_ratings(3) == ratings.movies.top_by_num_of_ratings(3)
+        with pytest.raises(ValueError, match='rating'):
+            movie_only.movies.top_by_ratings(3)
+        with pytest.raises(ValueError, match='timestamp'):
+            by_movie.movies.dist_by_year()
+        with pytest.raises(ValueError, match='userId'):
+            by_movie.users.dist_by_num_of_ratings()
+        assert None not in by_movie.ids.users and None not in by_movie.ids.movies
+        with pytest.raises(ValueError, match='movieId'):
+            Movies.from_parquet(str(tmp_path / 'movies.parquet'), columns=['title'])
+        tag_only = Tags.from_parquet(str(tmp_path / 'tags.parquet'), columns=['tag'])
+        assert tag_only.most_popular(1) == tags.most_popular(1) == {'pixar': 2}
+        with pytest.raises(ValueError, match='timestamp'):
+            tag_only.most_popular(3, since=0)
+        assert tag_only.to_arrow().column('userId').null_count == len(tags.rows)
+
+        links = self._get_ready_links_object()
+        links.links_data = [{'movieId': '10', 'imdbId': 'tt1', 'tmdbId': '1'}, {'movieId': '40', 'imdbId': 'tt4', 'tmdbId': ''}]
+        restored = Links.from_parquet(links.to_parquet(str(tmp_path / 'links.parquet')))
+        assert restored._cache['tt1'] == links._cache['tt1']
+        assert 'tt4' not in restored._cache
+        assert restored.most_expensive(5) == {'Movie A (Cheap)': 100.0}
+
+    def test_sketches(self, tmp_path):
+        cms = CountMinSketch(epsilon=0.01, delta=0.01)
+        other = CountMinSketch(epsilon=0.01, delta=0.01)
+        for i in range(1000):
+            (cms if i % 2 else other).add(i % 50)
+        cms.merge(other)
+        assert cms.total == 1000
+        assert all(20 <= cms.estimate(i) <= 20 + 0.01 * 1000 for i in range(50))
+
+        hh = HeavyHitters(k=5, epsilon=0.01)
+        for i in range(2000):
+            hh.add('hot' if i % 3 == 0 else f"cold{i}")
+        assert hh.top(1)[0][0] == 'hot'
+
+        left, right = HyperLogLog(error=0.05), HyperLogLog(error=0.05)
+        for i in range(5000):
+            left.add(i)
+            right.add(i + 2500)
+        assert abs(left.count() - 5000) <= 5000 * 4 * left.error
+        assert abs(left.merge(right).count() - 7500) <= 7500 * 4 * left.error
+
+        m, r_file, t_file, _ = Tests._create_dummy_csvs(tmp_path)
+        tags = Tags(t_file)
+        assert tags.most_popular(5, sketch=True) == tags.most_popular(5)
+
+        ratings = Ratings(r_file, m)
+        assert ratings.users.dist_by_num_of_ratings(sketch=True) == ratings.users.dist_by_num_of_ratings()
+        assert list(ratings.movies.top_by_num_of_ratings(2, sketch=True).items()) == [('Toy Story (1995)', 3), ('Grumpier Old Men (1995)', 2)]
+        assert ratings.movies.distinct_users(1) == 3
+        assert ratings.users.distinct_movies(2) == 3
+        assert ratings.movies.distinct_users(999) == 0
+
+        # Части без общих пользователей объединяются в тот же результат, что и весь поток
+        rows = read_csv_limited(r_file, limit=None)
+        whole = RatingsSketch().update(rows)
+        merged = RatingsSketch().update(rows[:2]).merge(RatingsSketch().update(rows[2:]))
+        assert merged.count_dist == whole.count_dist
+        assert merged.movie_popularity.top(2) == whole.movie_popularity.top(2)
+        assert merged.users_per_movie[1].dense() == whole.users_per_movie[1].dense()
+        assert merged.user_sorted and not RatingsSketch().update(rows[:3]).merge(RatingsSketch().update(rows[2:])).user_sorted
+
+        # Разреженный HyperLogLog даёт те же регистры, что и плотный, пока мал - несколько байт
+        sparse, dense = HyperLogLog(error=0.05, sparse=True), HyperLogLog(error=0.05)
+        for i in range(3):
+            sparse.add(i)
+            dense.add(i)
+        assert sparse.registers is None and len(sparse.sparse) == 3 and sparse.dense() == dense.registers
+        for i in range(3, 2000):
+            sparse.add(i)
+            dense.add(i)
+        assert sparse.sparse is None and sparse.registers == dense.registers
+
+        # Оценка есть для каждого ключа; count_dist точен и через границы блоков
+        rnd = random.Random(5)
+        big = [{'userId': u, 'movieId': rnd.randint(1, 300)} for u in range(1, 400) for _ in range(rnd.randint(1, 30))]
+        stream = RatingsSketch(k=10)
+        for i in range(0, len(big), 500):
+            stream.update(big[i:i + 500])
+        truth = collections.defaultdict(set)
+        for r in big:
+            truth[r['movieId']].add(r['userId'])
+        assert set(stream.users_per_movie) == set(truth)
+        assert all(abs(stream.users_per_movie[mid].count() - len(users)) <= 4 * 0.1 * len(users) + 1
+                   for mid, users in truth.items())
+        assert stream.count_dist == collections.Counter(collections.Counter(r['userId'] for r in big).values())
+        rnd.shuffle(big)
+        assert not RatingsSketch().update(big).user_sorted
+
+        # Скетч тегов идёт потоком по файлу; добавленные строки - по памяти
+        ts = 1445714990
+        assert tags.most_popular(1, since=ts, sketch=True) == tags.most_popular(1, since=ts) == {'pixar': 2}
+        assert tags.most_popular(5, since=1445715100, sketch=True) == {'very scary': 1, 'animals': 1}
+        tags.append([{'userId': 1, 'movieId': 1, 'tag': 'fresh', 'timestamp': ts}] * 5)
+        assert tags.most_popular(1, sketch=True) == {'fresh': 5}
+
+    def test_sampling(self, tmp_path):
+        m, r_file, t_file, _ = Tests._create_dummy_csvs(tmp_path)
+
+        res = sample_csv(r_file, 3, seed=1)
+        assert len(res.rows) == 3 and res.population == 7
+        seek = sample_csv(r_file, 100, method='seek', seed=1)
+        assert len(seek.rows) == 7 # все строки, включая первую после заголовка
+        # Строки одной длины выбираются равновероятно, первая после заголовка - тоже
+        even = os.path.join(tmp_path, "even.csv")
+        with open(even, 'w', encoding='utf-8') as f:
+            f.write("userId,movieId,rating,timestamp\n")
+            f.writelines(f"{u},1,4.0,964982703\n" for u in range(10, 20))
+        rnd = random.Random(2)
+        hits = collections.Counter(_sample_seek(even, 1, rnd).rows[0]['userId'] for _ in range(2000))
+        assert all(130 <= hits[str(u)] <= 270 for u in range(10, 20))
+        groups = sample_csv(r_file, 3, stratify='userId', seed=1)
+        sizes = collections.Counter(r['userId'] for r in groups.rows)
+        assert all(sizes[u] == {'1': 2, '2': 3, '3': 2}[u] for u in sizes) # пользователи целиком
+
+        # Выборка размером со всю совокупность: оценки точные, интервал нулевой
+        full = Ratings(r_file, m, sample=100, seed=1)
+        exact = Ratings(r_file, m)
+        dbr = full.movies.dist_by_rating()
+        assert {k: v.value for k, v in dbr.items()} == exact.movies.dist_by_rating()
+        assert all(v.low == v.value == v.high for v in dbr.values())
+        assert list(full.movies.top_by_num_of_ratings(1).values())[0].value == 3
+        assert isinstance(full.movies.top_by_ratings(2)['Long Title Movie (2020)'], Estimate)
+        by_user = Ratings(r_file, m, sample=100, stratify='userId', seed=1)
+        assert {k: v.value for k, v in by_user.users.dist_by_num_of_ratings().items()} == exact.users.dist_by_num_of_ratings()
+        assert {k: v.value for k, v in by_user.users.dist_by_ratings().items()} == exact.users.dist_by_ratings()
+
+        tags = Tags(t_file, sample=100, seed=1)
+        assert tags.most_popular(1)['pixar'].value == 2
+
+        # Крупный файл: 95% интервал по выборке 500 из 5000 накрывает истинную долю
+        big = tmp_path / 'big.csv'
+        rnd = random.Random(0)
+        with open(big, 'w', encoding='utf-8') as f:
+            f.write("userId,movieId,rating,timestamp\n")
+            for i in range(5000):
+                f.write(f"{i // 50},{rnd.randint(1, 20)},{rnd.choice([1.0, 3.0, 4.0, 4.0])},{964982703 + i}\n")
+        truth = Ratings(str(big), m, limit=None).movies.dist_by_rating()
+        for method in ('reservoir', 'seek'):
+            est = Ratings(str(big), m, sample=500, sample_method=method, seed=6).movies.dist_by_rating()
+            assert all(est[k].low <= truth[k] <= est[k].high for k in truth)
+
+    def test_memoization(self, tmp_path):
+        m, r_file, t_file, _ = Tests._create_dummy_csvs(tmp_path)
+        ratings = Ratings(r_file, m)
+
+        first = ratings.movies.top_by_ratings(2)
+        first['mutated'] = 1 # изменение результата не портит кеш
+        assert ratings.movies.top_by_ratings(2) == ratings.movies.top_by_ratings(2, metric=None)
+        assert 'mutated' not in ratings.movies.top_by_ratings(2)
+        info = ratings.cache_info()
+        assert info['misses'] == 2 and info['hits'] == 2
+
+        # Метрика без __hash__ - вычисление без кеша, результат корректен
+        class Trimmed:
+            def __eq__(self, other):
+                return isinstance(other, Trimmed)
+            __hash__ = None
+            def __call__(self, values):
+                return max(values)
+        assert ratings.users.dist_by_ratings(metric=Trimmed()) == ratings.users.dist_by_ratings(metric=max)
+        assert ratings.cache_info()['uncacheable'] == 1
+
+        # append и reload делают старые результаты недействительными
+        before = ratings.movies.top_by_num_of_ratings(1)
+        ratings.append([{'userId': 4, 'movieId': 3, 'rating': 1.0, 'timestamp': 964983703},
+                        {'userId': 5, 'movieId': 3, 'rating': 1.0, 'timestamp': 964983704}])
+        assert ratings.movies.top_by_num_of_ratings(1) == {'Grumpier Old Men (1995)': 4} != before
+        assert ratings.movies.dist_by_rating(since=964983703) == {1.0: 2}
+        ratings.reload()
+        assert ratings.movies.top_by_num_of_ratings(1) == before
+
+        # Вытеснение LRU
+        ratings._query_cache = QueryCache(maxsize=2)
+        for n in (1, 2, 3):
+            ratings.movies.top_controversial(n)
+        assert ratings.cache_info()['evictions'] == 1 and ratings.cache_info()['size'] == 2
+
+        tags = Tags(t_file)
+        assert tags.most_popular(1) == {'pixar': 2}
+        tags.append([{'userId': 9, 'movieId': 2, 'tag': 'funny', 'timestamp': 1445715300}] * 3)
+        assert tags.most_popular(1) == {'funny': 4}
+
+        movies = Movies(m)
+        assert 2021 not in movies.dist_by_release()
+        movies.append([{'movieId': 9, 'title': 'New Movie (2021)', 'genres': 'Drama'}])
+        assert movies.dist_by_release()[2021] == 1
+
+        # Вложенные словари результата тоже копируются: правка не портит кеш
+        trend = ratings.movies.rating_trend(window_days=1, step_days=1)
+        next(iter(trend.values()))['count'] = -1
+        assert -1 not in (v['count'] for v in ratings.movies.rating_trend(window_days=1, step_days=1).values())
+
+        # Одновременные промахи по одному ключу - одно вычисление; кеш у объекта один
+        cache, calls, gate = QueryCache(), [], threading.Event()
+        def slow():
+            calls.append(1)
+            gate.wait(5)
+            return {'value': 1}
+        pool = concurrent.futures.ThreadPoolExecutor(4)
+        futures = [pool.submit(cache.get_or_compute, 'key', slow) for _ in range(4)]
+        while cache.coalesced < 3:
+            time.sleep(0.01)
+        gate.set()
+        assert [f.result() for f in futures] == [{'value': 1}] * 4 and calls == [1]
+        fresh = Tags(t_file)
+        assert len({id(c) for c in pool.map(lambda _: fresh.query_cache, range(50))}) == 1
+        pool.shutdown()
+
+        links = self._get_ready_links_object()
+        assert links.top_directors(5) == {'Director One': 2, 'Director Two': 1}
+        links.movie_imdb_map['40'] = 'tt4'
+        links._cache['tt4'] = dict(Links.CACHE_DEFAULTS, Director='Director Two')
+        assert links.top_directors(5) == {'Director One': 2, 'Director Two': 2}
+
+        # Кеш общий для потоков: одновременные вызовы не портят LRU и статистику
+        cache = QueryCache(maxsize=8)
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            values = list(pool.map(lambda i: cache.get_or_compute(i % 16, lambda: [i % 16]), range(2000)))
+        assert values == [[i % 16] for i in range(2000)]
+        assert cache.hits + cache.misses + cache.coalesced == 2000 and len(cache._data) <= 8
+
+    def test_ratings_similarity(self, tmp_path):
+        m, r_file, _, _ = Tests._create_dummy_csvs(tmp_path)
+        ratings = Ratings(r_file, m)
+
+        for backend in (['array', 'scipy'] if sparse is not None else ['array']):
+            mat = ratings.matrix(backend=backend)
+            assert mat.shape == (3, 4)
+            assert mat.nnz == 7
+
+            # Фильм 1 = (4, 5, 4) по пользователям; фильм 3 = (4, 2, 0) -> cos = 26 / sqrt(57 * 20)
+            sim = ratings.movies.similar_movies(1, 3)
+            assert list(sim.keys()) == ['Grumpier Old Men (1995)', 'Jumanji (1995)', 'Long Title Movie (2020)']
+            assert sim['Grumpier Old Men (1995)'] == round(26 / math.sqrt(57 * 20), 2)
+
+            users = ratings.users.similar_users(2, 5, method='pearson')
+            assert isinstance(users, dict)
+            assert 2 not in users
+
+            # Блочная обработка с пулом потоков совпадает с последовательной
+            serial = mat.top_k_neighbours('movie', k=2, block_size=1)
+            parallel = mat.top_k_neighbours('movie', k=2, block_size=2, workers=2)
+            assert serial == parallel
+
+        assert ratings.movies.similar_movies(999, 3) == {}
+
+    def test_dense_ids(self, tmp_path):
+        m, r_file, _, l_file = Tests._create_dummy_csvs(tmp_path)
+        ids = IdDictionary()
+        movies = Movies(m, ids=ids)
+        ratings = Ratings(r_file, m, ids=ids)
+        links = Links(l_file, ids=ids)
+
+        # Фильмы получили индексы при загрузке movies.csv; оценки и ссылки используют те же
+        assert ids.movies.keys == [1, 2, 3, 5]
+        assert sorted(ids.users.index.values()) == list(range(len(ids.users)))
+        cols = ratings.columns()
+        assert [ids.movies.decode(i) for i in cols.movie] == [r['movieId'] for r in ratings._ratings]
+        assert [ids.users.decode(u) for u in cols.user] == [r['userId'] for r in ratings._ratings]
+        assert cols.titles[ids.movies.get(3)] == 'Grumpier Old Men (1995)'
+
+        link_cols = links.columns()
+        assert [ids.movies.decode(i) for i in link_cols.movie] == [1, 2, 3]
+        assert [ids.imdb.decode(i) for i in link_cols.imdb] == ['0114709', '0113497', '0113228']
+
+        # Агрегаты по плотным индексам совпадают с прежними результатами
+        assert ratings.movies.top_by_num_of_ratings(2) == {'Toy Story (1995)': 3, 'Grumpier Old Men (1995)': 2}
+        assert ratings.users.top_controversial(1) == {2: 1.56}
+        ratings.append([{'userId': 9, 'movieId': 4, 'rating': 1.0, 'timestamp': 964983703}])
+        assert ratings.movies.top_by_ratings(5)['Waiting to Exhale (1995)'] == 1.0
+        assert ids.users.decode(ratings.columns().user[-1]) == 9
+
+        # Без ids= у объекта свой словарь: чужие id не раздувают его массивы
+        own = Ratings(r_file, m)
+        assert own.ids is not Ratings(r_file, m).ids
+        own.columns()
+        assert len(own.ids.users) == len({r['userId'] for r in own._ratings}) < len(ids.users)
+
+        # Одновременное кодирование одних и тех же новых id из нескольких потоков
+        shared = IdMap()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=lambda: [shared.encode(k) for k in range(20000)]) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert shared.keys == list(range(20000))
+
+    def test_sharded_ratings(self, tmp_path):
+        m, _, _, _ = Tests._create_dummy_csvs(tmp_path)
+        r_file = os.path.join(tmp_path, "ratings_big.csv")
+        rnd = random.Random(7)
+        with open(r_file, 'w', encoding='utf-8') as f:
+            f.write("userId,movieId,rating,timestamp\n")
+            for _ in range(400):
+                f.write(f"{rnd.randint(1, 30)},{rnd.randint(1, 8)},{rnd.randint(1, 10) / 2},"
+                        f"{rnd.randint(946684800, 1537799250)}\n")
+
+        single = Ratings(r_file, m, limit=350)
+        since = datetime.datetime(2005, 1, 1)
+        for key in ('userId', 'movieId'):
+            with ShardedRatings.local(r_file, m, n_shards=3, key=key, limit=350) as sharded:
+                assert sum(sharded.sizes) == 350
+                for obj, name, args in [
+                    ('movies', 'dist_by_year', ()),
+                    ('movies', 'dist_by_rating', ()),
+                    ('movies', 'top_by_num_of_ratings', (5,)),
+                    ('movies', 'top_by_ratings', (8, Ratings.median)),
+                    ('movies', 'top_controversial', (8,)),
+                    ('users', 'dist_by_num_of_ratings', ()),
+                    ('users', 'dist_by_ratings', ()),
+                    ('users', 'top_controversial', (10,)),
+                ]:
+                    expected = getattr(getattr(single, obj), name)(*args)
+                    assert getattr(getattr(sharded, obj), name)(*args) == expected, (key, name)
+                    assert list(getattr(getattr(sharded, obj), name)(*args)) == list(expected)
+                assert sharded.movies.top_by_ratings(8, since=since) == single.movies.top_by_ratings(8, since=since)
+                assert list(sharded.movies.top_by_num_of_ratings(8, since=since)) == \
+                    list(single.movies.top_by_num_of_ratings(8, since=since))
+                # повторный запрос - из кеша, без обращения к шардам
+                hits = sharded.cache_info()['hits']
+                assert sharded.users.top_controversial(10) == single.users.top_controversial(10)
+                assert sharded.cache_info()['hits'] == hits + 1
+
+        with pytest.raises(ValueError):
+            ShardedRatings.local(r_file, m, start_method='no-such-method')
+        with ShardedRatings.local(r_file, m, n_shards=2, limit=350, start_method='spawn') as sharded:
+            assert sharded.movies.top_by_ratings(8) == single.movies.top_by_ratings(8)
+        # среднее и медиана - по гистограмме, без разворачивания Counter в список оценок
+        huge = collections.Counter({4.0: 10 ** 12, 3.5: 1})
+        assert ShardedRatings._apply(Ratings.median, huge) == 4.0
+        assert abs(ShardedRatings._apply(Ratings.average, huge) - 4.0) < 1e-9
+        assert ShardedRatings._apply(Ratings.average, collections.Counter({4.25: 2})) == 4.25
+
+    def test_memory_budget(self, tmp_path):
+        pytest.importorskip('resource')
+        m, _, _, _ = Tests._create_dummy_csvs(tmp_path)
+        r_file = os.path.join(tmp_path, "ratings_big.csv")
+        rnd = random.Random(3)
+        with open(r_file, 'w', encoding='utf-8') as f:
+            f.write("userId,movieId,rating,timestamp\n")
+            for _ in range(100000):
+                f.write(f"{rnd.randint(1, 2000)},{rnd.randint(1, 1500)},{rnd.randint(1, 10) / 2},"
+                        f"{rnd.randint(946684800, 1537799250)}\n")
+
+        # Крошечный бюджет: много сброшенных блоков и слияние в несколько проходов
+        exact = Ratings(r_file, m, limit=20000)
+        external = Ratings(r_file, m, limit=20000, memory_budget=1)
+        assert external._ratings == []
+        since = datetime.datetime(2010, 1, 1)
+        assert external.movies.top_by_ratings(10, since=since) == exact.movies.top_by_ratings(10, since=since)
+        assert list(external.movies.top_controversial(10)) == list(exact.movies.top_controversial(10))
+        assert external.users.dist_by_ratings(Ratings.median) == exact.users.dist_by_ratings(Ratings.median)
+        assert external.users.top_controversial(10) == exact.users.top_controversial(10)
+        assert external._ratings == []
+
+        # Пик RSS процесса растёт меньше бюджета (в отдельном процессе - свой пик)
+        # ru_maxrss на Linux переживает exec и стартует с пика родителя (pytest), поэтому, где есть,
+        # берётся VmHWM из /proc - пик именно этого процесса
+        script = (
+            "import sys, resource\n"
+            "from movielens_analysis import Ratings\n"
+            "def peak():\n"
+            "    try:\n"
+            "        with open('/proc/self/status') as f:\n"
+            "            return next(int(l.split()[1]) * 1024 for l in f if l.startswith('VmHWM:'))\n"
+            "    except (OSError, StopIteration):\n"
+            "        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)\n"
+            "before = peak()\n"
+            "r = Ratings(sys.argv[1], None, limit=None, memory_budget=int(sys.argv[2]) or None)\n"
+            "res = [r.movies.top_by_ratings(10), r.movies.top_controversial(10),\n"
+            "       r.users.dist_by_ratings(), r.users.top_controversial(10)]\n"
+            "print(peak() - before)\n"
+            "print(repr(res))\n"
+        )
+        budget = 8 * 2**20
+        runs = {}
+        for b in (0, budget):
+            out = subprocess.run([sys.executable, '-c', script, r_file, str(b)], check=True, capture_output=True,
+                                 text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split('\n', 1)
+            runs[b] = int(out[0]), out[1]
+        assert runs[budget][1] == runs[0][1]
+        assert runs[budget][0] < budget < runs[0][0]
+
+    def test_tag_rating_join(self, tmp_path):
+        m, r_file, t_file, _ = Tests._create_dummy_csvs(tmp_path)
+        ids = IdDictionary()
+        tags = Tags(t_file, ids=ids)
+        ratings = Ratings(r_file, m, ids=ids)
+        join = TagRatingJoin(tags, ratings)
+
+        # Фильм 1: 4, 5, 4; фильм 2: 3; фильм 3: 4, 2
+        assert join.avg_rating_by_tag(3) == {'pixar': 4.33, 'very scary': 3.0, 'animals': 3.0}
+        assert join.rating_dist_by_tag('old men') == {2.0: 1, 4.0: 1}
+        # Автор тега 'old men' (пользователь 3) фильм 3 не оценивал; дубликат 'pixar' считается один раз
+        assert join.avg_rating_by_tag(5, on='user') == {'pixar': 4.0, 'very scary': 3.0, 'animals': 3.0}
+        assert join.rating_dist_by_tag(on='user')['pixar'] == {4.0: 1}
+        assert join.tags_for_top_rated_movies(2) == {'Long Title Movie (2020)': [], 'Toy Story (1995)': ['pixar']}
+
+        assert join.pairs() == TagRatingJoin(tags, ratings, method='merge').pairs() == [(0, 0), (1, 0), (2, 3), (3, 3)]
+        keys = [random.Random(1).randint(0, 20) for _ in range(50)]
+        assert hash_join(keys[:10], keys) == merge_join(keys[:10], keys)
+        # Сторона-итератор просматривается потоком, с какой бы стороны она ни была
+        assert hash_join(keys[:10], iter(keys)) == hash_join(keys[:10], keys)
+        assert hash_join(iter(keys), keys[:10]) == hash_join(keys, keys[:10])
+
+        tags.append([{'userId': 1, 'movieId': 3, 'tag': 'pixar', 'timestamp': 1445715300}])
+        assert join.rating_dist_by_tag('pixar') == {2.0: 1, 4.0: 3, 5.0: 1}
+        with pytest.raises(ValueError):
+            TagRatingJoin(Tags(t_file, ids=IdDictionary()), ratings)
+
+    def test_rating_cube(self, tmp_path, monkeypatch):
+        Tests._create_dummy_csvs(tmp_path)
+        cube = RatingCube.open(str(tmp_path))
+        assert os.path.exists(os.path.join(tmp_path, 'movielens_cube.bin'))
+
+        assert cube.roll_up() == {'count': 7, 'mean': 3.86}
+        assert cube.roll_up('decade') == {1990: {'count': 6, 'mean': 3.67}, 2020: {'count': 1, 'mean': 5.0}}
+        # Фильм с обоими жанрами учитывается один раз
+        assert cube.dice(['Adventure', 'Children']) == {'count': 4, 'mean': 4.0}
+        assert cube.dice(['Comedy', 'Sci-Fi'], match='any', by='year') == {
+            1995: {'count': 2, 'mean': 3.0}, 2020: {'count': 1, 'mean': 5.0}}
+        assert cube.slice(rating=4.0, by='genre') == {
+            'Adventure': {'count': 2, 'mean': 4.0}, 'Animation': {'count': 2, 'mean': 4.0},
+            'Children': {'count': 2, 'mean': 4.0}, 'Comedy': {'count': 1, 'mean': 4.0},
+            'Romance': {'count': 1, 'mean': 4.0}}
+        assert cube.slice(genre='Horror') == {'count': 0, 'mean': 0.0}
+        assert cube.dice(years=(2000, None), ratings=(4.5, 5.0)) == {'count': 1, 'mean': 5.0}
+
+        # Повторное открытие читает файл, а не строит куб заново
+        monkeypatch.setattr(RatingCube, 'build', classmethod(lambda cls, *a: pytest.fail("rebuilt")))
+        loaded = RatingCube.open(str(tmp_path))
+        assert loaded.counts == cube.counts and loaded.roll_up('rating') == cube.roll_up('rating')
+
+    def test_materialized_views(self, tmp_path):
+        m, r_file, _, _ = Tests._create_dummy_csvs(tmp_path)
+        views = MaterializedViews(str(tmp_path))
+        movies = Movies(m)
+        ratings = Ratings(r_file, m)
+
+        assert views.refresh() is True
+        assert os.path.exists(views.path)
+        assert views.dist_by_release() == movies.dist_by_release()
+        assert views.dist_by_genres() == movies.dist_by_genres()
+        assert views.dist_by_year() == ratings.movies.dist_by_year()
+        assert views.dist_by_rating() == ratings.movies.dist_by_rating()
+        assert views.dist_by_num_of_ratings() == ratings.users.dist_by_num_of_ratings()
+        assert views.movie_stats()[1] == (3, 13.0, 57.0)
+        assert views.user_stats()[2] == (3, 10.0, 38.0)
+
+        # Новый объект читает сохранённый файл без пересчёта
+        assert MaterializedViews(str(tmp_path)).refresh() is False
+
+        # Изменение входного файла - представления пересобираются
+        with open(r_file, 'a', encoding='utf-8') as f:
+            f.write("4,2,0.5,964983703\n")
+        assert views.refresh() is True
+        assert views.dist_by_rating()[0.5] == 1
+        assert views.movie_stats()[2] == (2, 3.5, 9.25)
+
     # Тесты для ЛИНКС:
     def _get_ready_links_object(self):
         l = Links("non_existent_file.csv")
@@ -961,6 +4881,144 @@ class Tests:
         assert top_movie == 'Movie B (Expensive)'
         assert result[top_movie] == 5.0
 
+    @staticmethod
+    def _start_imdb_stub(pages):
+        """
+        Локальный сервер вместо IMDb: pages - {imdbId: (статус, html)}; отдаёт ETag и отвечает 304
+        на совпадающий If-None-Match. Возвращает (сервер, шаблон URL, журнал запросов).
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        log = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                imdb_id = self.path.strip('/').split('/')[-1][2:]
+                log.append((imdb_id, self.headers.get('If-None-Match')))
+                status, body = pages.get(imdb_id, (404, ''))
+                etag = f'"{hashlib.md5(body.encode()).hexdigest()}"'
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f"http://127.0.0.1:{server.server_address[1]}/title/tt{{}}/", log
+
+    @staticmethod
+    def _imdb_page(director, budget, minutes):
+        return ('<html><script type="application/ld+json">'
+                f'{{"director": [{{"name": "{director}"}}], "duration": "PT{minutes // 60}H{minutes % 60}M"}}'
+                f'</script><body><li>Budget ${budget:,} (estimated)</li></body></html>')
+
+    def test_imdb_refresh(self, tmp_path):
+        _, _, _, l_file = Tests._create_dummy_csvs(tmp_path)
+        pages = {'0114709': (200, self._imdb_page('John Lasseter', 30000000, 81)),
+                 '0113497': (500, '')}
+        server, url, log = self._start_imdb_stub(pages)
+        try:
+            links = Links(l_file)
+            links.cache_file = str(tmp_path / "imdb_cache.json")
+            links._cache = {}
+            links.IMDB_URL = url
+            links.get_imdb(['1', '2'], ['Director'])
+            assert links._cache['0114709']['Budget'] == 30000000.0
+            assert links._cache['0113497']['_meta']['status'] == 'failed'
+
+            refresher = ImdbRefresher(links, max_age=0, retry_failed=0, batch_size=1, pause=0)
+            # Сначала неудачная загрузка, затем самая старая
+            assert refresher.due() == ['0113497', '0114709']
+            pages['0113497'] = (200, self._imdb_page('Joe Johnston', 65000000, 104))
+            assert refresher.refresh(budget=1) == {'requests': 1, 'updated': 1}
+            assert links.top_directors(5) == {'John Lasseter': 1, 'Joe Johnston': 1}
+
+            # Неизменённая страница: условный запрос и 304, данные и ETag сохраняются
+            del log[:]
+            assert refresher.refresh(budget=1) == {'requests': 1, 'not_modified': 1}
+            assert log[0][0] == '0114709' and log[0][1] is not None
+            assert links._cache['0114709']['Director'] == 'John Lasseter'
+
+            # Ошибка при обновлении не затирает полученные раньше данные
+            pages['0113497'] = (503, '')
+            assert refresher.refresh(budget=1) == {'requests': 1, 'failed': 1}
+            assert links._cache['0113497']['Budget'] == 65000000.0
+            assert json.load(open(links.cache_file))['0113497']['_meta']['code'] == 503
+
+            # Фоновый поток: проходы идут, пока не вызван stop()
+            refresher.pause = 0.01
+            refresher.start(interval=0.01)
+            deadline = time.time() + 5
+            while refresher.stats['runs'] < 5 and time.time() < deadline:
+                time.sleep(0.01)
+            refresher.stop()
+            assert refresher.stats['runs'] >= 5
+
+            # Запись кэша из нескольких потоков: файл всегда целый и совпадает с кэшем
+            def write(k):
+                for i in range(20):
+                    links._update_cache({f"{k}-{i}": ImdbInfo(f"Director {k}", i, 0, 90)})
+            threads = [threading.Thread(target=write, args=(k,)) for k in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert links._load_cache() == links._cache and len(links._cache) == 82
+            assert not [f for f in os.listdir(tmp_path) if f.endswith('.tmp')]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_imdb_pipeline(self, tmp_path):
+        _, _, _, l_file = Tests._create_dummy_csvs(tmp_path)
+        pages = {'0114709': (200, self._imdb_page('John Lasseter', 30000000, 81)),
+                 '0113497': (200, self._imdb_page('Joe Johnston', 65000000, 104)),
+                 '0113228': (500, '')}
+        server, url, log = self._start_imdb_stub(pages)
+        try:
+            links = Links(l_file)
+            links.cache_file = str(tmp_path / "imdb_cache.json")
+            links._cache = {}
+            links.IMDB_URL = url
+            stats = links.prefetch_imdb([1, 2, 3], fetchers=2, parsers=2, queue_size=1, batch_size=2)
+            assert (stats['updated'], stats['failed']) == (2, 1)
+            assert stats['stages']['fetch']['items'] == 3 and stats['stages']['parse']['items'] == 2
+            assert stats['stages']['write']['items'] == 3 and stats['stages']['write']['batches'] == 2
+            assert all(q['max'] <= q['capacity'] == 1 for q in stats['queues'].values())
+            assert links.top_directors(5) == {'John Lasseter': 1, 'Joe Johnston': 1}
+            assert links.get_imdb([2], ['Runtime']) == [['2', 'Jumanji (1995)', 104]]
+            assert set(json.load(open(links.cache_file))) == {'0114709', '0113497', '0113228'}
+
+            # Уже закешированные пропускаются; с refresh - условные запросы и 304 без разбора
+            assert links.prefetch_imdb([1, 2])['stages']['fetch']['items'] == 0
+            del log[:]
+            stats = links.prefetch_imdb([1, 2], refresh=True, parsers=0)
+            assert stats['not_modified'] == 2 and stats['stages']['parse']['items'] == 0
+            assert all(etag is not None for _, etag in log)
+            assert links._cache['0114709']['Budget'] == 30000000.0
+
+            # Писатель конвейера и фоновое обновление пишут один файл кэша одновременно
+            refresher = ImdbRefresher(links, max_age=0, retry_failed=0, pause=0)
+            refresher.start(interval=0)
+            try:
+                for _ in range(3):
+                    links.prefetch_imdb([1, 2, 3], refresh=True, fetchers=3, parsers=0, batch_size=1)
+            finally:
+                refresher.stop()
+            assert links._load_cache() == links._cache
+            assert not [f for f in os.listdir(tmp_path) if f.endswith('.tmp')]
+        finally:
+            server.shutdown()
+            server.server_close()
+
 if __name__ == '__main__':
     # Запуск тестов
     sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,251 @@
+"""
+Бенчмарки для movielens_analysis.py на синтетических данных в формате MovieLens.
+
+Запуск:
+    python movielens_benchmarks.py similarity --size 1m
+    python movielens_benchmarks.py similarity --size 25m
+    python movielens_benchmarks.py similarity --ratings 200000 --data-dir /tmp/ml
+    python movielens_benchmarks.py compressed --size 1m
+    python movielens_benchmarks.py join --size 25m
+    python movielens_benchmarks.py memory --size 25m
+    python movielens_benchmarks.py sessions --size 25m
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import gzip
+import bz2
+import lzma
+import tracemalloc
+
+from movielens_analysis import (Ratings, Tags, Movies, MovieRecord, ImdbInfo, ImdbMeta, TagRatingJoin, IdDictionary,
+                                read_csv_limited, zstandard)
+
+# Размеры как у MovieLens 1M и 25M: (оценок, пользователей, фильмов)
+SIZES = {
+    '1m': (1_000_000, 6040, 3706),
+    '25m': (25_000_000, 162541, 59047),
+}
+
+TAG_WORDS = ['funny', 'dark', 'classic', 'atmospheric', 'twist ending', 'pixar', 'based on a book',
+             'visually appealing', 'slow', 'great soundtrack', 'sci-fi', 'predictable', 'cult film', 'violent']
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Drama',
+          'Fantasy', 'Horror', 'Romance', 'Sci-Fi', 'Thriller', 'War']
+
+
+def generate_dataset(base_dir, n_ratings, n_users, n_movies, seed=42):
+    """
+    Пишет movies.csv и ratings.csv примерно на n_ratings оценок.
+    Как и в MovieLens, оценки отсортированы по userId, популярность фильмов неравномерна.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(base_dir, exist_ok=True)
+    m_file = os.path.join(base_dir, 'movies.csv')
+    r_file = os.path.join(base_dir, 'ratings.csv')
+
+    with open(m_file, 'w', encoding='utf-8') as f:
+        f.write("movieId,title,genres\n")
+        for mid in range(1, n_movies + 1):
+            genres = '|'.join(rnd.sample(GENRES, rnd.randint(1, 4)))
+            f.write(f"{mid},Movie {mid} ({rnd.randint(1930, 2018)}),{genres}\n")
+
+    avg = n_ratings / n_users
+    total = 0
+    with open(r_file, 'w', encoding='utf-8') as f:
+        f.write("userId,movieId,rating,timestamp\n")
+        for uid in range(1, n_users + 1):
+            if total >= n_ratings:
+                break
+            k = min(n_movies, n_ratings - total, 1 + int(rnd.expovariate(1 / avg)))
+            # квадрат равномерной величины смещает выбор к "популярным" фильмам с малыми id
+            seen = set()
+            while len(seen) < k:
+                seen.add(1 + int(n_movies * rnd.random() ** 2))
+            lines = []
+            for mid in sorted(seen):
+                rating = rnd.randint(1, 10) / 2
+                lines.append(f"{uid},{mid},{rating},{rnd.randint(946684800, 1537799250)}\n")
+            f.writelines(lines)
+            total += k
+    return m_file, r_file, total
+
+
+def generate_tags(base_dir, ratings, n_tags, seed=42):
+    """
+    Пишет tags.csv из n_tags тегов (как в MovieLens 25M - примерно один тег на 25 оценок).
+    Большая часть тегов ставится на фильмы, которые автор оценил, остальные - на случайные.
+    """
+    rnd = random.Random(seed)
+    rows = ratings._ratings
+    users = ratings.ids.users.keys
+    movies = ratings.ids.movies.keys
+    t_file = os.path.join(base_dir, 'tags.csv')
+    with open(t_file, 'w', encoding='utf-8') as f:
+        f.write("userId,movieId,tag,timestamp\n")
+        for _ in range(n_tags):
+            if rnd.random() < 0.7:
+                r = rows[rnd.randrange(len(rows))]
+                uid, mid = r['userId'], r['movieId']
+            else:
+                uid, mid = rnd.choice(users), rnd.choice(movies)
+            f.write(f"{uid},{mid},{rnd.choice(TAG_WORDS)},{rnd.randint(1135429210, 1537799250)}\n")
+    return t_file
+
+
+def timed(label, func, *args, **kwargs):
+    """Выполняет func и печатает время выполнения."""
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    print(f"  {label:<40} {time.perf_counter() - start:10.3f} s")
+    return res
+
+
+def bench_similarity(m_file, r_file, n_ratings, args):
+    ratings = timed("load", Ratings, r_file, m_file, limit=n_ratings)
+    mat = timed("matrix (CSR/CSC)", ratings.matrix)
+    print(f"  shape={mat.shape} nnz={mat.nnz} backend={mat.backend}")
+
+    sample = mat.movies[:args.queries]
+    timed(f"similar_movies x{len(sample)}", lambda: [ratings.movies.similar_movies(mid, 10) for mid in sample])
+    timed(f"similar_users x{len(sample)}", lambda: [ratings.users.similar_users(uid, 10) for uid in mat.users[:args.queries]])
+    timed(f"top_k_neighbours pearson x{len(sample)}", mat.top_k_neighbours, 'movie', sample, 10, 'pearson',
+          block_size=args.block_size, workers=args.workers)
+
+
+def bench_compressed(m_file, r_file, n_ratings, args):
+    """Пропускная способность распаковки+разбора ratings.csv в сравнении с обычным CSV."""
+    codecs = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+    if zstandard is not None:
+        codecs['.zst'] = zstandard.open
+    plain_size = os.path.getsize(r_file)
+    variants = [('', r_file)]
+    for suffix, opener in codecs.items():
+        path = r_file + suffix
+        with open(r_file, 'rb') as f_in, opener(path, 'wb') as f_out:
+            while True:
+                chunk = f_in.read(1 << 20)
+                if not chunk:
+                    break
+                f_out.write(chunk)
+        variants.append((suffix, path))
+
+    for suffix, path in variants:
+        start = time.perf_counter()
+        rows = read_csv_limited(path, limit=None)
+        elapsed = time.perf_counter() - start
+        ratio = plain_size / os.path.getsize(path)
+        print(f"  {('csv' + suffix):<10} rows={len(rows):<10} ratio={ratio:5.2f}x "
+              f"{plain_size / elapsed / 2**20:8.1f} MiB/s {len(rows) / elapsed:12.0f} rows/s")
+
+
+def bench_join(m_file, r_file, n_ratings, args):
+    """Соединение тегов и оценок: hash- и merge-соединение по (userId, movieId) и запросы поверх."""
+    ids = IdDictionary()
+    ratings = timed("load ratings", Ratings, r_file, m_file, limit=n_ratings, ids=ids)
+    timed("ratings dense columns", ratings.columns)
+    n_tags = max(1, n_ratings // 25)
+    t_file = timed(f"generate {n_tags} tags", generate_tags, os.path.dirname(r_file), ratings, n_tags)
+    tags = timed("load tags", Tags, t_file, limit=n_tags, ids=ids)
+    timed("tags dense columns", tags.columns)
+
+    for method in ('hash', 'merge'):
+        join = TagRatingJoin(tags, ratings, method=method)
+        timed(f"build (movie histograms) [{method}]", join._build)
+        pairs = timed(f"{method} join on (userId, movieId)", join.pairs)
+    print(f"  pairs={len(pairs)}")
+    timed("avg_rating_by_tag on movie", join.avg_rating_by_tag, 10)
+    timed("avg_rating_by_tag on user", join.avg_rating_by_tag, 10, on='user')
+    timed("rating_dist_by_tag (all tags)", join.rating_dist_by_tag)
+    timed("tags_for_top_rated_movies", join.tags_for_top_rated_movies, args.queries, min_ratings=10)
+
+
+def allocated(func):
+    """(результат func, байт, выделенных при его построении и ещё не освобождённых)."""
+    tracemalloc.start()
+    try:
+        res = func()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return res, size
+
+
+def bench_memory(m_file, r_file, n_ratings, args):
+    """Память Movies.movies и кэша IMDb: компактные записи (Record) против словарей на строку."""
+    n_movies = sum(1 for _ in open(m_file)) - 1
+    movies = timed("load movies", Movies, m_file, limit=n_movies, ids=IdDictionary())
+    # Строки общие для обеих раскладок: сравниваются только контейнеры
+    _, compact = allocated(lambda: {mid: MovieRecord(r.title, r.genres, r.year) for mid, r in movies.movies.items()})
+    _, plain = allocated(lambda: {mid: dict(r) for mid, r in movies.movies.items()})
+    print(f"  Movies.movies  {len(movies.movies)} rows: dict {plain / 2**20:8.2f} MiB, "
+          f"records {compact / 2**20:8.2f} MiB ({plain / compact:.1f}x)")
+
+    rnd = random.Random(42)
+    entries = [(f"{i:07d}", f"Director {rnd.randrange(5000)}", float(rnd.randrange(10**8)),
+                float(rnd.randrange(10**9)), rnd.randint(60, 200), f'"{i:x}"') for i in range(n_movies)]
+    _, compact = allocated(lambda: {imdb_id: ImdbInfo(d, b, g, r, ImdbMeta(1.0, 'ok', 200, etag, None))
+                                    for imdb_id, d, b, g, r, etag in entries})
+    _, plain = allocated(lambda: {imdb_id: {'Director': d, 'Budget': b, 'Cumulative Worldwide Gross': g, 'Runtime': r,
+                                            '_meta': {'fetched': 1.0, 'status': 'ok', 'code': 200,
+                                                      'etag': etag, 'last_modified': None}}
+                                  for imdb_id, d, b, g, r, etag in entries})
+    print(f"  Links._cache   {len(entries)} rows: dict {plain / 2**20:8.2f} MiB, "
+          f"records {compact / 2**20:8.2f} MiB ({plain / compact:.1f}x)")
+
+
+def bench_sessions(m_file, r_file, n_ratings, args):
+    """Сессии пользователей: сортировка по (userId, timestamp) и проход по паузам между оценками."""
+    ratings = timed("load", Ratings, r_file, m_file, limit=n_ratings, ids=IdDictionary())
+    timed("dense columns", ratings.columns)
+    timed("(userId, timestamp) sort", ratings._user_timeline)
+    sessions = timed("sessions (gap 30 min)", ratings.sessions)
+    print(f"  sessions={len(sessions.count)}")
+    timed("sessions_per_user", ratings.users.sessions_per_user)
+    timed("dist_by_session_length", ratings.users.dist_by_session_length)
+    timed("most_active_users", ratings.users.most_active_users, 10)
+    timed("most_active_users window=1 day", ratings.users.most_active_users, 10, window=24 * 3600)
+
+
+BENCHMARKS = {
+    'compressed': bench_compressed,
+    'join': bench_join,
+    'memory': bench_memory,
+    'sessions': bench_sessions,
+    'similarity': bench_similarity,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки movielens_analysis на синтетических данных")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--size', choices=sorted(SIZES), default='1m')
+    parser.add_argument('--ratings', type=int, help="Переопределяет число оценок для --size")
+    parser.add_argument('--data-dir', help="Каталог для синтетических данных (по умолчанию - временный)")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--block-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    n_ratings, n_users, n_movies = SIZES[args.size]
+    if args.ratings:
+        n_users = max(1, n_users * args.ratings // n_ratings)
+        n_ratings = args.ratings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = args.data_dir or tmp
+        m_file, r_file, total = timed("generate dataset", generate_dataset, base_dir, n_ratings, n_users, n_movies)
+        print(f"dataset: {total} ratings, {n_users} users, {n_movies} movies in {base_dir}")
+
+        names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+        for name in names:
+            print(f"[{name}]")
+            BENCHMARKS[name](m_file, r_file, total, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Нагрузочный тест для movielens_service.py: запросы/сек и перцентили задержки на localhost.
+
+Запуск (сервис уже запущен):
+    python movielens_loadtest.py --url http://127.0.0.1:8765 --requests 5000 --concurrency 16
+Или с собственным сервисом на реальных данных:
+    python movielens_loadtest.py --data-dir data --requests 5000
+"""
+import sys
+import time
+import random
+import argparse
+import threading
+import concurrent.futures
+import urllib.request
+
+# Смесь запросов как в отчёте: повторяющиеся вызовы с небольшим числом вариантов аргументов
+DEFAULT_PATHS = [
+    '/movies/dist_by_release',
+    '/movies/dist_by_genres',
+    '/movies/most_genres?n=10',
+    '/tags/most_popular?n=10',
+    '/tags/most_words?n=10',
+    '/tags/tags_with?word=funny',
+    '/ratings/movies/dist_by_year',
+    '/ratings/movies/dist_by_rating',
+    '/ratings/movies/top_by_num_of_ratings?n=10',
+    '/ratings/movies/top_by_ratings?n=10&metric=average',
+    '/ratings/movies/top_controversial?n=10',
+    '/ratings/users/dist_by_num_of_ratings',
+    '/ratings/users/dist_by_ratings?metric=median',
+    '/ratings/users/top_controversial?n=10',
+]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def run(base_url, paths, n_requests, concurrency, seed=0):
+    """Выполняет n_requests запросов в concurrency потоков; возвращает сводку."""
+    rnd = random.Random(seed)
+    plan = [rnd.choice(paths) for _ in range(n_requests)]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(path):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base_url + path, timeout=60) as resp:
+                resp.read()
+                ok = resp.status == 200
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, plan))
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': n_requests,
+        'errors': errors,
+        'seconds': total,
+        'rps': n_requests / total if total else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP-сервиса аналитики")
+    parser.add_argument('--url', help="Адрес запущенного сервиса; без него сервис поднимается локально")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        from movielens_service import AnalyticsService, make_server
+        server = make_server(AnalyticsService(args.data_dir, args.limit), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        res = run(base_url.rstrip('/'), DEFAULT_PATHS, args.requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print(f"{res['requests']} requests, {res['errors']} errors in {res['seconds']:.2f} s")
+    print(f"{res['rps']:.0f} req/s  p50={res['p50_ms']:.2f} ms  p99={res['p99_ms']:.2f} ms  max={res['max_ms']:.2f} ms")
+    return 1 if res['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,508 @@
+"""
+Запуск отчёта movielens_report.ipynb из командной строки.
+
+Спецификация отчёта (JSON) перечисляет анализы - вызовы методов с аргументами.
+Загрузка таблиц и построение индексов (плотные столбцы, индекс по времени, матрица,
+скетчи) выделяются в общие этапы, от которых зависят анализы; получившийся граф этапов
+выполняется параллельно в пуле потоков или процессов. Сводки без аргументов (VIEW_CALLS)
+читаются из MaterializedViews и пересчитываются, только если изменились входные CSV.
+Результаты пишутся в JSON или HTML, в конце печатается время каждого этапа.
+
+Запуск:
+    python movielens_report.py --data-dir data --output report.html
+    python movielens_report.py spec.json --executor process --workers 4 --output report.json
+
+Спецификация:
+    {"limit": 1000,
+     "analyses": {"top_rated": {"call": "ratings.movies.top_by_ratings", "args": {"n": 10, "metric": "median"}}}}
+"""
+import os
+import sys
+import json
+import html
+import time
+import random
+import argparse
+import threading
+import multiprocessing
+import concurrent.futures
+
+import pytest
+
+from movielens_analysis import (Movies, Tags, Ratings, Links, IdDictionary, MaterializedViews, ResultVisualizer,
+                                find_data_file)
+from movielens_service import METRICS, to_jsonable
+
+# Анализы из movielens_report.ipynb (без скрапинга IMDb: get_imdb ходит в сеть)
+DEFAULT_ANALYSES = {
+    'movies.dist_by_release': {'call': 'movies.dist_by_release'},
+    'movies.dist_by_genres': {'call': 'movies.dist_by_genres'},
+    'movies.most_genres': {'call': 'movies.most_genres', 'args': {'n': 10}},
+    'tags.most_popular': {'call': 'tags.most_popular', 'args': {'n': 10}},
+    'tags.most_words': {'call': 'tags.most_words', 'args': {'n': 10}},
+    'tags.longest': {'call': 'tags.longest', 'args': {'n': 10}},
+    'tags.most_words_and_longest': {'call': 'tags.most_words_and_longest', 'args': {'n': 10}},
+    'tags.tags_with': {'call': 'tags.tags_with', 'args': {'word': 'funny'}},
+    'ratings.movies.dist_by_year': {'call': 'ratings.movies.dist_by_year'},
+    'ratings.movies.dist_by_rating': {'call': 'ratings.movies.dist_by_rating'},
+    'ratings.movies.top_by_num_of_ratings': {'call': 'ratings.movies.top_by_num_of_ratings', 'args': {'n': 10}},
+    'ratings.movies.top_by_ratings': {'call': 'ratings.movies.top_by_ratings', 'args': {'n': 10, 'metric': 'average'}},
+    'ratings.movies.top_controversial': {'call': 'ratings.movies.top_controversial', 'args': {'n': 10}},
+    'ratings.users.dist_by_num_of_ratings': {'call': 'ratings.users.dist_by_num_of_ratings'},
+    'ratings.users.dist_by_ratings': {'call': 'ratings.users.dist_by_ratings', 'args': {'metric': 'median'}},
+    'ratings.users.top_controversial': {'call': 'ratings.users.top_controversial', 'args': {'n': 10}},
+    'links.top_directors': {'call': 'links.top_directors', 'args': {'n': 10}},
+    'links.most_expensive': {'call': 'links.most_expensive', 'args': {'n': 10}},
+    'links.most_profitable': {'call': 'links.most_profitable', 'args': {'n': 10}},
+    'links.longest': {'call': 'links.longest', 'args': {'n': 10}},
+    'links.top_cost_per_minute': {'call': 'links.top_cost_per_minute', 'args': {'n': 10}},
+}
+
+# Индексы, которые строятся отдельными этапами: (таблица, метод) -> методы анализа, которым он нужен.
+# Анализы в потоках только читают готовые индексы: ленивое построение из нескольких потоков сразу
+# не потокобезопасно, поэтому здесь должны быть все ленивые индексы, которые трогают анализы.
+INDEXES = {
+    ('ratings', 'columns'): {'dist_by_rating', 'top_by_num_of_ratings', 'top_by_ratings', 'top_controversial',
+                             'dist_by_num_of_ratings', 'dist_by_ratings',
+                             'sessions_per_user', 'dist_by_session_length', 'most_active_users'},
+    ('ratings', 'time_index'): {'rating_trend'},
+    ('ratings', 'matrix'): {'similar_movies', 'similar_users'},
+    ('ratings', 'sketch'): {'distinct_users', 'distinct_movies'},
+    ('ratings', '_user_timeline'): {'sessions_per_user', 'dist_by_session_length', 'most_active_users'},
+    ('links', 'columns'): {'top_directors', 'most_expensive', 'most_profitable', 'longest', 'top_cost_per_minute'},
+    ('tags', 'time_index'): set(),
+}
+# Индексы, которые строятся поверх других индексов той же таблицы
+INDEX_DEPS = {
+    ('ratings', '_user_timeline'): ['columns'],
+}
+
+# Вызовы без аргументов, которые отдаются из сохранённых MaterializedViews (таблица 'views'):
+# при совпадении отпечатков входов таблица для них не загружается и ничего не пересчитывается
+VIEW_CALLS = {
+    'movies.dist_by_release': 'dist_by_release',
+    'movies.dist_by_genres': 'dist_by_genres',
+    'ratings.movies.dist_by_year': 'dist_by_year',
+    'ratings.movies.dist_by_rating': 'dist_by_rating',
+    'ratings.users.dist_by_num_of_ratings': 'dist_by_num_of_ratings',
+}
+
+# Объекты, загруженные этапами load; при executor='process' достаются дочерним процессам через fork
+_OBJECTS = {}
+
+
+class Stage:
+    """Этап графа: загрузка таблицы, построение индекса или анализ."""
+    def __init__(self, name, kind, func, deps=()):
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.deps = list(deps)
+        self.start = self.end = None
+        self.worker = None
+        self.error = None
+        self.result = None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.end is not None else 0.0
+
+
+def _call(table, path, args):
+    """Вызов метода анализа: 'movies.top_by_ratings' у объекта таблицы; metric передаётся по имени."""
+    target = _OBJECTS[table]
+    for attr in path:
+        target = getattr(target, attr)
+    if 'metric' in args:
+        if args['metric'] not in METRICS:
+            raise ValueError(f"metric должен быть одним из: {', '.join(METRICS)}")
+        args = dict(args, metric=METRICS[args['metric']])
+    return to_jsonable(target(**args))
+
+
+def _load_table(table, data_dir, limit, ids):
+    if table == 'views':
+        # Сразу сверяет отпечатки (и при необходимости пересобирает): анализы в потоках только читают
+        views = MaterializedViews(data_dir, limit)
+        views.refresh()
+        return views
+    m_path = find_data_file(data_dir, 'movies.csv')
+    if table == 'movies':
+        return Movies(m_path, limit=limit, ids=ids)
+    if table == 'tags':
+        return Tags(find_data_file(data_dir, 'tags.csv'), limit=limit, ids=ids)
+    if table == 'ratings':
+        return Ratings(find_data_file(data_dir, 'ratings.csv'), m_path, limit=limit, ids=ids)
+    return Links(find_data_file(data_dir, 'links.csv'), limit=limit, ids=ids)
+
+
+def _init_process(data_dir, limit, indexes):
+    """Инициализация процесса пула без fork (spawn): таблицы и индексы строятся заново."""
+    ids = IdDictionary()
+    for table, methods in indexes.items():
+        _OBJECTS[table] = _load_table(table, data_dir, limit, ids)
+        for method in methods:
+            getattr(_OBJECTS[table], method)()
+
+
+def _run_in_process(table, path, args):
+    """Задача для пула процессов: результат, время начала и конца, pid."""
+    start = time.time()
+    result = _call(table, path, args)
+    return result, start, time.time(), f"pid-{os.getpid()}"
+
+
+class ReportRunner:
+    """
+    Строит граф этапов по спецификации и выполняет его.
+    executor='thread' - весь граф в одном пуле потоков (этап стартует, как только готовы зависимости);
+    executor='process' - загрузка и индексы в потоках, затем анализы в пуле процессов. С fork
+    (Linux, macOS) процессы получают загруженные таблицы без повторного чтения файлов; где fork нет
+    (Windows), процессы запускаются через spawn и каждый загружает таблицы и индексы сам.
+    views=True - вызовы из VIEW_CALLS без аргументов читаются из MaterializedViews рядом с данными.
+    """
+    EXECUTORS = ('thread', 'process')
+
+    def __init__(self, spec, data_dir='data', workers=None, executor='thread', start_method=None, views=True):
+        if executor not in self.EXECUTORS:
+            raise ValueError(f"executor должен быть одним из: {', '.join(self.EXECUTORS)}")
+        methods = multiprocessing.get_all_start_methods()
+        if start_method is None:
+            start_method = 'fork' if 'fork' in methods else 'spawn'
+        elif start_method not in methods:
+            raise ValueError(f"start_method {start_method!r} недоступен, доступны: {', '.join(methods)}")
+        self.start_method = start_method
+        self.spec = spec
+        self.data_dir = spec.get('data_dir', data_dir)
+        self.limit = spec.get('limit', 1000)
+        self.workers = workers or os.cpu_count()
+        self.executor = executor
+        self.views = spec.get('views', views)
+        self.stages = self.plan()
+
+    def _loader(self, table):
+        def load():
+            _OBJECTS[table] = _load_table(table, self.data_dir, self.limit, self._ids)
+        return load
+
+    @staticmethod
+    def _indexer(table, method):
+        def build():
+            getattr(_OBJECTS[table], method)()
+        return build
+
+    def plan(self):
+        """Dict: имя этапа -> Stage. Общие загрузки и индексы - по одному этапу на все анализы."""
+        self._ids = IdDictionary()
+        stages = {}
+        for name, item in self.spec['analyses'].items():
+            table, *path = item['call'].split('.')
+            if table not in ('movies', 'tags', 'ratings', 'links') or not path:
+                raise ValueError(f"{name}: неизвестный вызов {item['call']}")
+            args = item.get('args', {})
+            if self.views and not args and item['call'] in VIEW_CALLS:
+                table, path = 'views', [VIEW_CALLS[item['call']]]
+            load = f"load:{table}"
+            if load not in stages:
+                stages[load] = Stage(load, 'load', self._loader(table))
+            deps = [load]
+            needed = [m for (t, m), methods in INDEXES.items() if t == table and path[-1] in methods]
+            if args.get('since') is not None or args.get('until') is not None:
+                needed.append('time_index')
+            if args.get('sketch'):
+                needed.append('sketch')
+            for method in needed:
+                deps.append(self._index_stage(stages, table, method, load))
+            stage = Stage(name, 'analysis', (table, path, args), deps)
+            stages[name] = stage
+        return stages
+
+    def _index_stage(self, stages, table, method, load):
+        """Имя этапа построения индекса (создаётся вместе с этапами индексов, от которых зависит)."""
+        index = f"index:{table}.{method}"
+        if index not in stages:
+            deps = [load] + [self._index_stage(stages, table, m, load) for m in INDEX_DEPS.get((table, method), ())]
+            stages[index] = Stage(index, 'index', self._indexer(table, method), deps)
+        return index
+
+    def _execute(self, stage):
+        stage.start = time.time()
+        stage.worker = threading.current_thread().name
+        try:
+            if stage.kind == 'analysis':
+                stage.result = _call(*stage.func)
+            else:
+                stage.func()
+        finally:
+            stage.end = time.time()
+
+    def _run_graph(self, stages, pool, submit):
+        """Запускает этапы, как только завершены их зависимости; ошибка зависимости пропускает этап."""
+        pending = dict(stages)
+        running = {}
+        while pending or running:
+            for name, stage in list(pending.items()):
+                deps = [self.stages[d] for d in stage.deps]
+                if any(d.error for d in deps):
+                    stage.error = f"Не выполнен этап {next(d.name for d in deps if d.error)}"
+                    del pending[name]
+                elif all(d.end is not None for d in deps):
+                    running[submit(pool, stage)] = stage
+                    del pending[name]
+            if not running:
+                if pending: # зависимости вне графа - выполнять нечего
+                    raise RuntimeError(f"Не удаётся выполнить этапы: {', '.join(pending)}")
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    stage.error = repr(e)
+                    if stage.end is None: # ошибка в другом процессе: время начала неизвестно
+                        stage.end = time.time()
+                        stage.start = stage.start or stage.end
+                else:
+                    if value is not None: # из процесса: результат и время выполнения
+                        stage.result, stage.start, stage.end, stage.worker = value
+
+    def run(self):
+        """Выполняет граф; возвращает время выполнения (с)."""
+        self.started = time.time()
+        thread_submit = lambda pool, stage: pool.submit(self._execute, stage)
+        with concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='thread') as pool:
+            if self.executor == 'thread':
+                self._run_graph(self.stages, pool, thread_submit)
+            else:
+                prepare = {n: s for n, s in self.stages.items() if s.kind != 'analysis'}
+                self._run_graph(prepare, pool, thread_submit)
+        if self.executor == 'process':
+            analyses = {n: s for n, s in self.stages.items() if s.kind == 'analysis'}
+            ctx = multiprocessing.get_context(self.start_method)
+            options = {}
+            if self.start_method != 'fork': # без fork дочерние процессы не наследуют _OBJECTS
+                indexes = {}
+                for s in self.stages.values():
+                    if s.kind == 'index':
+                        table, method = s.name[len('index:'):].split('.', 1)
+                        indexes.setdefault(table, []).append(method)
+                    elif s.kind == 'load':
+                        indexes.setdefault(s.name[len('load:'):], [])
+                options = {'initializer': _init_process, 'initargs': (self.data_dir, self.limit, indexes)}
+            with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=ctx, **options) as pool:
+                self._run_graph(analyses, pool, lambda pool, stage: pool.submit(_run_in_process, *stage.func))
+        self.finished = time.time()
+        return self.finished - self.started
+
+    def results(self):
+        """Dict: имя анализа -> результат (или {'error': ...})."""
+        return {name: ({'error': s.error} if s.error else s.result)
+                for name, s in self.stages.items() if s.kind == 'analysis'}
+
+    def timings(self):
+        """Время этапов в порядке запуска: имя, тип, начало и длительность (с от старта), исполнитель."""
+        rows = []
+        for s in sorted(self.stages.values(), key=lambda s: (s.start is None, s.start or 0)):
+            rows.append({'stage': s.name, 'kind': s.kind,
+                         'start': round((s.start or self.started) - self.started, 4),
+                         'duration': round(s.duration, 4), 'worker': s.worker, 'error': s.error})
+        return rows
+
+    def summary(self):
+        """Сводка: общее время, сумма времени этапов по типам и выигрыш от параллельности."""
+        wall = self.finished - self.started
+        busy = sum(s.duration for s in self.stages.values())
+        by_kind = {}
+        for s in self.stages.values():
+            by_kind[s.kind] = round(by_kind.get(s.kind, 0.0) + s.duration, 4)
+        return {'wall': round(wall, 4), 'busy': round(busy, 4), 'by_kind': by_kind,
+                'parallelism': round(busy / wall, 2) if wall else 0.0,
+                'executor': self.executor, 'workers': self.workers}
+
+    def print_timings(self, out=sys.stdout):
+        print(f"{'stage':<44} {'kind':<9} {'start':>8} {'time':>8}  worker", file=out)
+        for row in self.timings():
+            status = f"  ERROR {row['error']}" if row['error'] else ''
+            print(f"{row['stage']:<44} {row['kind']:<9} {row['start']:8.3f} {row['duration']:8.3f}  "
+                  f"{row['worker']}{status}", file=out)
+        summary = self.summary()
+        kinds = ', '.join(f"{k} {v:.3f} s" for k, v in summary['by_kind'].items())
+        print(f"total {summary['wall']:.3f} s wall, {summary['busy']:.3f} s in stages ({kinds}), "
+              f"parallelism x{summary['parallelism']}", file=out)
+
+    def write(self, path, fmt=None):
+        """Пишет отчёт: fmt 'json' или 'html' (по умолчанию - по расширению path)."""
+        fmt = fmt or ('html' if path.endswith(('.html', '.htm')) else 'json')
+        if fmt == 'json':
+            report = {'results': self.results(), 'timings': self.timings(), 'summary': self.summary()}
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            return path
+
+        parts = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>MovieLens report</title></head><body>",
+                 "<h1>MovieLens report</h1>"]
+        for name, result in self.results().items():
+            parts.append(f"<h2>{html.escape(name)}</h2>")
+            if isinstance(result, dict) and set(result) == {'error'}:
+                parts.append(f"<p><b>Ошибка:</b> {html.escape(result['error'])}</p>")
+            else:
+                parts.append(ResultVisualizer(result)._repr_html_())
+        parts.append("<h2>Время этапов</h2>")
+        rows = [[r['stage'], r['kind'], r['start'], r['duration'], r['worker']] for r in self.timings()]
+        parts.append(ResultVisualizer(rows, ['Этап', 'Тип', 'Начало, с', 'Время, с', 'Исполнитель'])._repr_html_())
+        parts.append("</body></html>")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(parts))
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Параллельный запуск отчёта MovieLens по спецификации")
+    parser.add_argument('spec', nargs='?', help="JSON-спецификация (по умолчанию - анализы из ноутбука)")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--limit', type=int, help="Переопределяет limit из спецификации")
+    parser.add_argument('--executor', choices=ReportRunner.EXECUTORS, default='thread',
+                        help="thread - пул потоков; process - пул процессов (fork, а где его нет - spawn: "
+                             "каждый процесс заново загружает таблицы)")
+    parser.add_argument('--start-method', choices=multiprocessing.get_all_start_methods(),
+                        help="Способ запуска процессов для --executor process (по умолчанию fork, если доступен)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help="Файл отчёта (.json или .html)")
+    parser.add_argument('--format', choices=['json', 'html'])
+    parser.add_argument('--no-views', action='store_true',
+                        help="Считать сводки заново, не читая сохранённые представления (movielens_views.json)")
+    args = parser.parse_args(argv)
+
+    if args.spec:
+        with open(args.spec, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+    else:
+        spec = {'analyses': DEFAULT_ANALYSES}
+    if args.limit is not None:
+        spec = dict(spec, limit=args.limit)
+
+    runner = ReportRunner(spec, args.data_dir, args.workers, args.executor, args.start_method,
+                          views=not args.no_views)
+    runner.run()
+    runner.print_timings()
+    if args.output:
+        print(f"report: {runner.write(args.output, args.format)}")
+    return 1 if any(s.error for s in runner.stages.values()) else 0
+
+
+# ==========================================
+# ТЕСТОВЫЙ КЛАСС
+# ==========================================
+
+class Tests:
+    def test_report_graph_and_outputs(self, tmp_path):
+        from movielens_analysis import Tests as AnalysisTests
+        AnalysisTests._create_dummy_csvs(tmp_path)
+        spec = {'analyses': {
+            'top': {'call': 'ratings.movies.top_by_num_of_ratings', 'args': {'n': 2}},
+            'median': {'call': 'ratings.users.dist_by_ratings', 'args': {'metric': 'median'}},
+            'window': {'call': 'ratings.movies.dist_by_rating', 'args': {'since': 964982803}},
+            'popular': {'call': 'tags.most_popular', 'args': {'n': 1}},
+            'broken': {'call': 'ratings.movies.top_by_ratings', 'args': {'n': 1, 'metric': 'max'}},
+        }}
+        for executor in ReportRunner.EXECUTORS:
+            runner = ReportRunner(spec, str(tmp_path), workers=2, executor=executor)
+            # Загрузка и индексы - общие этапы для всех анализов
+            assert sorted(n for n, s in runner.stages.items() if s.kind != 'analysis') == [
+                'index:ratings.columns', 'index:ratings.time_index', 'load:ratings', 'load:tags']
+            assert runner.stages['top'].deps == ['load:ratings', 'index:ratings.columns']
+            runner.run()
+
+            results = runner.results()
+            assert results['top'] == {'Toy Story (1995)': 3, 'Grumpier Old Men (1995)': 2}
+            assert results['popular'] == {'pixar': 2}
+            assert results['window'] == {'2.0': 1, '3.0': 1, '4.0': 2, '5.0': 2}
+            assert 'metric' in results['broken']['error']
+            for s in runner.stages.values():
+                if s.kind == 'analysis' and not s.error:
+                    assert all(s.start >= runner.stages[d].end for d in s.deps)
+
+            report = json.load(open(runner.write(str(tmp_path / 'report.json')), encoding='utf-8'))
+            assert report['results'] == json.loads(json.dumps(results))
+            assert {row['stage'] for row in report['timings']} == set(runner.stages)
+            page = open(runner.write(str(tmp_path / 'report.html')), encoding='utf-8').read()
+            assert '<h2>top</h2>' in page and 'Toy Story (1995)' in page
+
+
+    def test_spawn_and_lazy_indexes(self, tmp_path):
+        from movielens_analysis import Tests as AnalysisTests
+        AnalysisTests._create_dummy_csvs(tmp_path)
+        spec = {'analyses': {
+            'sessions': {'call': 'ratings.users.dist_by_session_length'},
+            'active': {'call': 'ratings.users.most_active_users', 'args': {'n': 1}},
+        }}
+        with pytest.raises(ValueError):
+            ReportRunner(spec, str(tmp_path), executor='process', start_method='no-such-method')
+        # Процессы без fork загружают таблицы и индексы сами
+        runner = ReportRunner(spec, str(tmp_path), workers=2, executor='process', start_method='spawn')
+        # Сортировка по (пользователь, время) строится отдельным этапом после плотных столбцов
+        assert runner.stages['index:ratings._user_timeline'].deps == ['load:ratings', 'index:ratings.columns']
+        assert 'index:ratings._user_timeline' in runner.stages['sessions'].deps
+        runner.run()
+        assert runner.results() == {'sessions': {'2': 2, '3': 1}, 'active': {'2': 3}}
+
+    def test_materialized_views(self, tmp_path):
+        from movielens_analysis import Tests as AnalysisTests
+        AnalysisTests._create_dummy_csvs(tmp_path)
+        spec = {'analyses': {
+            'release': {'call': 'movies.dist_by_release'},
+            'per_user': {'call': 'ratings.users.dist_by_num_of_ratings'},
+            'window': {'call': 'ratings.movies.dist_by_rating', 'args': {'since': 964982803}},
+        }}
+        runner = ReportRunner(spec, str(tmp_path), workers=2)
+        # Сводки без аргументов - из представлений, movies.csv не загружается
+        assert runner.stages['release'].deps == runner.stages['per_user'].deps == ['load:views']
+        assert 'load:movies' not in runner.stages and 'load:ratings' in runner.stages
+        runner.run()
+        direct = ReportRunner(spec, str(tmp_path), workers=2, views=False)
+        direct.run()
+        assert runner.results() == direct.results()
+        path = tmp_path / 'movielens_views.json'
+        built = path.stat().st_mtime_ns
+        # Повторный запуск с теми же входами читает сохранённый файл, не пересобирая его
+        again = ReportRunner(spec, str(tmp_path), workers=2, executor='process', start_method='spawn')
+        again.run()
+        assert again.results() == direct.results() and path.stat().st_mtime_ns == built
+
+    def test_concurrent_loads_share_ids(self, tmp_path):
+        # Фильмы кодируются при загрузке movies и при построении столбцов ratings - в разных потоках
+        rnd = random.Random(4)
+        movie_ids = list(range(1, 3001))
+        with open(tmp_path / 'movies.csv', 'w', encoding='utf-8') as f:
+            f.write("movieId,title,genres\n")
+            f.writelines(f"{mid},Movie {mid} (2000),Drama\n" for mid in movie_ids)
+        rnd.shuffle(movie_ids)
+        with open(tmp_path / 'ratings.csv', 'w', encoding='utf-8') as f:
+            f.write("userId,movieId,rating,timestamp\n")
+            f.writelines(f"{i % 50 + 1},{mid},4.0,{964982703 + i}\n" for i, mid in enumerate(movie_ids))
+        with open(tmp_path / 'tags.csv', 'w', encoding='utf-8') as f:
+            f.write("userId,movieId,tag,timestamp\n")
+            f.writelines(f"1,{mid},tag{mid % 7},1445714994\n" for mid in movie_ids[:500])
+        spec = {'limit': 100000, 'analyses': {
+            'genres': {'call': 'movies.dist_by_genres'},
+            'top': {'call': 'ratings.movies.top_by_num_of_ratings', 'args': {'n': 1}},
+            'popular': {'call': 'tags.most_popular', 'args': {'n': 1}},
+        }}
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) # частые переключения потоков, чтобы гонка проявлялась
+        try:
+            runners = [ReportRunner(spec, str(tmp_path), workers=4, executor='thread') for _ in range(3)]
+            for runner in runners:
+                runner.run()
+        finally:
+            sys.setswitchinterval(interval)
+        for runner in runners:
+            keys = runner._ids.movies.keys
+            assert sorted(keys) == list(range(1, 3001))
+            assert all(runner._ids.movies.get(k) == i for i, k in enumerate(keys))
+            assert runner.results()['genres'] == {'Drama': 3000}
+
+
+if __name__ == '__main__':
+    sys.exit(main())
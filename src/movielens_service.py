@@ -0,0 +1,325 @@
+"""
+Локальный HTTP/JSON сервис поверх movielens_analysis.
+
+Данные загружаются один раз, аналитические методы Movies, Tags, Ratings.Movies,
+Ratings.Users и Links из ENDPOINTS доступны как GET /<объект>/<метод>?аргумент=значение
+(или POST с JSON-объектом аргументов). Изменять данные через сервис нельзя. Скрапинг IMDb (/links/get_imdb) включается
+только флагом --allow-scraping. Результаты кешируются по методу, аргументам
+и версии данных таблицы, одинаковые одновременные запросы выполняются одним вычислением.
+
+Запуск:
+    python movielens_service.py --data-dir data --limit 1000 --port 8765
+    python movielens_service.py --allow-scraping   # плюс /links/get_imdb (запросы к IMDb)
+    curl 'http://127.0.0.1:8765/ratings/movies/top_by_ratings?n=10&metric=median'
+"""
+import sys
+import json
+import time
+import inspect
+import argparse
+import datetime
+import threading
+import collections
+import concurrent.futures
+import urllib.parse
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from movielens_analysis import Movies, Tags, Ratings, Links, Estimate, IdDictionary, find_data_file
+
+# Эндпоинты - только аналитические методы, которые читают данные; методы, меняющие данные
+# или состояние (append, reload, скрапинг), и служебные методы сюда не входят
+ENDPOINTS = {
+    'movies': ['dist_by_release', 'dist_by_genres', 'most_genres'],
+    'tags': ['most_words', 'longest', 'most_words_and_longest', 'most_popular', 'tags_with'],
+    'ratings/movies': ['dist_by_year', 'dist_by_rating', 'top_by_num_of_ratings', 'top_by_ratings',
+                       'top_controversial', 'rating_trend', 'distinct_users', 'similar_movies'],
+    'ratings/users': ['dist_by_num_of_ratings', 'dist_by_ratings', 'top_controversial', 'distinct_movies',
+                      'similar_users', 'sessions_per_user', 'dist_by_session_length', 'most_active_users'],
+    'links': ['top_directors', 'most_expensive', 'most_profitable', 'longest', 'top_cost_per_minute'],
+}
+# Скрапинг IMDb: обращается к сети и пишет файл кэша, поэтому только по явному разрешению
+SCRAPING_ENDPOINTS = {'links': ['get_imdb']}
+# Аргументы, которые задаёт сервер, а не клиент: workers запускает пул процессов на каждый запрос
+SERVER_ARGS = frozenset({'workers'})
+# Метрики передаются по имени: ?metric=median
+METRICS = {'average': Ratings.average, 'median': Ratings.median, 'variance': Ratings.variance}
+
+
+def parse_value(raw):
+    """Значение из строки запроса: JSON (числа, true, списки) или строка; 'a,b' - список строк."""
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw.split(',') if ',' in raw else raw
+
+
+def to_jsonable(obj):
+    """Приводит результат метода к JSON: ключи - строки, даты - ISO, Estimate - объект."""
+    if isinstance(obj, Estimate):
+        return obj._asdict()
+    if isinstance(obj, dict):
+        return {k if isinstance(k, str) else str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        return [to_jsonable(v) for v in obj]
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    return obj
+
+
+class AnalyticsService:
+    """
+    Загружает данные один раз и выполняет вызовы методов с кешированием результатов
+    (LRU на cache_size записей) и объединением одинаковых одновременных запросов.
+    allow_scraping=True добавляет эндпоинты SCRAPING_ENDPOINTS.
+    """
+    def __init__(self, data_dir, limit=1000, cache_size=1024, allow_scraping=False):
+        m_path = find_data_file(data_dir, 'movies.csv')
+        self.ids = IdDictionary() # один словарь id на все таблицы сервиса
+        ratings = Ratings(find_data_file(data_dir, 'ratings.csv'), m_path, limit=limit, ids=self.ids)
+        self.objects = {
+            'movies': Movies(m_path, limit=limit, ids=self.ids),
+            'tags': Tags(find_data_file(data_dir, 'tags.csv'), limit=limit, ids=self.ids),
+            'ratings/movies': ratings.movies,
+            'ratings/users': ratings.users,
+            'links': Links(find_data_file(data_dir, 'links.csv'), limit=limit, ids=self.ids),
+        }
+        self.endpoints = {}
+        self.owners = {} # путь -> таблица, по версии данных которой кешируется результат
+        tables = [ENDPOINTS] + ([SCRAPING_ENDPOINTS] if allow_scraping else [])
+        for table in tables:
+            for prefix, names in table.items():
+                for name in names:
+                    obj = self.objects[prefix]
+                    self.endpoints[f"/{prefix}/{name}"] = getattr(obj, name)
+                    self.owners[f"/{prefix}/{name}"] = getattr(obj, 'parent', obj) # Ratings.Movies -> Ratings
+
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Объекты анализа не потокобезопасны (ленивые индексы), поэтому вычисления идут по одному
+        self._compute_lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def describe(self):
+        """Список эндпоинтов с сигнатурами методов (без SERVER_ARGS)."""
+        res = {}
+        for path, method in sorted(self.endpoints.items()):
+            sig = inspect.signature(method)
+            res[path] = str(sig.replace(parameters=[p for p in sig.parameters.values() if p.name not in SERVER_ARGS]))
+        return res
+
+    def _compute(self, path, kwargs):
+        if 'metric' in kwargs:
+            if kwargs['metric'] not in METRICS:
+                raise TypeError(f"metric должен быть одним из: {', '.join(METRICS)}")
+            kwargs = dict(kwargs, metric=METRICS[kwargs['metric']])
+        with self._compute_lock:
+            result = self.endpoints[path](**kwargs)
+        return json.dumps(to_jsonable(result), ensure_ascii=False).encode('utf-8')
+
+    def call(self, path, kwargs):
+        """Возвращает JSON (bytes) результата; KeyError - нет такого эндпоинта."""
+        if path not in self.endpoints:
+            raise KeyError(path)
+        rejected = SERVER_ARGS.intersection(kwargs)
+        if rejected:
+            raise TypeError(f"Аргументы {', '.join(sorted(rejected))} задаются сервером, не запросом")
+        # Версия данных в ключе: после append/reload таблицы старые результаты не выдаются
+        table = self.owners.get(path)
+        version = table._data_version() if table is not None else None
+        key = (path, version, json.dumps(kwargs, sort_keys=True))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._cache[key]
+            future = self._inflight.get(key)
+            leader = future is None # этот запрос вычисляет, остальные ждут его результат
+            if leader:
+                future = self._inflight[key] = concurrent.futures.Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            return future.result() # ждём вычисление, начатое другим запросом
+
+        try:
+            body = self._compute(path, kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._cache[key] = body
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        future.set_result(body)
+        return body
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None # задаётся в make_server
+
+    def _send(self, status, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, kwargs):
+        path = urllib.parse.urlsplit(self.path).path.rstrip('/') or '/'
+        if path == '/':
+            return self._send(200, self.service.describe())
+        if path == '/_stats':
+            return self._send(200, dict(self.service.stats))
+        if path not in self.service.endpoints:
+            return self._send(404, {'error': f"Нет эндпоинта {path}"})
+        try:
+            self._send(200, self.service.call(path, kwargs))
+        except (TypeError, ValueError) as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            self._send(500, {'error': repr(e)})
+
+    def do_GET(self):
+        query = urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query)
+        self._handle({k: parse_value(v) for k, v in query})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            kwargs = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {'error': "Тело запроса должно быть JSON-объектом"})
+        self._handle(kwargs)
+
+    def log_message(self, format, *args):
+        pass # не засоряем вывод при нагрузочном тестировании
+
+
+def make_server(service, host='127.0.0.1', port=8765):
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON сервис аналитики MovieLens")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--allow-scraping', action='store_true',
+                        help="Включает /links/get_imdb: запросы к IMDb и запись файла кэша")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    service = AnalyticsService(args.data_dir, args.limit, args.cache_size, args.allow_scraping)
+    server = make_server(service, args.host, args.port)
+    print(f"Данные загружены за {time.perf_counter() - start:.2f} s, {len(service.endpoints)} эндпоинтов")
+    print(f"http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+# ==========================================
+# ТЕСТОВЫЙ КЛАСС
+# ==========================================
+
+class Tests:
+    @staticmethod
+    def _start(tmp_path):
+        from movielens_analysis import Tests as AnalysisTests
+        AnalysisTests._create_dummy_csvs(tmp_path)
+        service = AnalyticsService(str(tmp_path))
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        def get(path):
+            try:
+                with urllib.request.urlopen(base + path) as resp:
+                    return resp.status, json.loads(resp.read())
+            except urllib.error.HTTPError as e:
+                return e.code, json.loads(e.read())
+        return service, server, get
+
+    def test_endpoints_and_cache(self, tmp_path):
+        service, server, get = self._start(tmp_path)
+        try:
+            status, index = get('/')
+            assert status == 200
+            assert '/ratings/movies/top_by_ratings' in index
+            assert '/movies/show' not in index
+
+            status, top = get('/ratings/movies/top_by_num_of_ratings?n=2')
+            assert status == 200
+            assert top == {'Toy Story (1995)': 3, 'Grumpier Old Men (1995)': 2}
+            assert get('/ratings/movies/top_by_num_of_ratings?n=2')[1] == top
+            assert service.stats['hits'] == 1 and service.stats['misses'] == 1
+
+            assert get('/ratings/users/dist_by_ratings?metric=median')[0] == 200
+            assert get('/ratings/users/dist_by_ratings?metric=max')[0] == 400
+            # Размер пула процессов клиент не выбирает
+            assert 'workers' not in index['/ratings/movies/top_by_ratings']
+            assert get('/ratings/movies/top_by_ratings?n=2&workers=64')[0] == 400
+            assert get('/tags/most_popular?n=1')[1] == {'pixar': 2}
+            assert get('/tags/no_such_method')[0] == 404
+            # Только аналитика: ни скрапинга, ни служебных и унаследованных дублей
+            for path in ('/links/get_imdb', '/links/get_ids', '/ratings/users/dist_by_year',
+                         '/ratings/users/similar_movies', '/ratings/movies/matrix'):
+                assert path not in index and get(path)[0] == 404
+            assert '/links/get_imdb' in AnalyticsService(str(tmp_path), allow_scraping=True).endpoints
+
+            # Методы, меняющие данные, недоступны; изменения через API сбрасывают кеш сервиса
+            for path in ('/movies/append?rows=[]', '/movies/reload', '/movies/cache_info'):
+                assert get(path)[0] == 404
+            assert get('/movies/dist_by_release')[1] == {'1995': 3, '2020': 1}
+            service.objects['movies'].append([{'movieId': 6, 'title': 'New (2021)', 'genres': 'Drama'}])
+            assert get('/movies/dist_by_release')[1] == {'1995': 3, '2020': 1, '2021': 1}
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_request_coalescing(self, tmp_path):
+        service, server, get = self._start(tmp_path)
+        server.server_close()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(n):
+            calls.append(n)
+            started.set()
+            release.wait(5)
+            return {'n': n}
+        service.endpoints['/slow'] = slow
+
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            first = pool.submit(service.call, '/slow', {'n': 1})
+            started.wait(5)
+            others = [pool.submit(service.call, '/slow', {'n': 1}) for _ in range(3)]
+            while service.stats['coalesced'] < 3:
+                time.sleep(0.01)
+            release.set()
+            results = [f.result() for f in [first] + others]
+        assert calls == [1]
+        assert all(r == b'{"n": 1}' for r in results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())